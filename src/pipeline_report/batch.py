@@ -0,0 +1,399 @@
+import csv
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+import matplotlib.pyplot as plt
+from attrs import asdict, define, evolve, field, fields
+from loguru import logger
+from tabulate import tabulate
+
+from pipeline_report import profiling, render_report
+from pipeline_report.incremental import SampleStore
+
+# The manifest fields every run must have, and those it may have.
+REQUIRED_FIELDS = ["run_name", "pre_dir", "post_dir", "functional_filter_dir"]
+OPTIONAL_FIELDS = [
+    "output_dir",
+    "run_date",
+    "pipeline_version",
+    "pipeline_commit_hash",
+    "nextflow_params",
+    "ref_name",
+]
+
+
+@define
+class BatchRun:
+    """A pipeline run to render a report for.
+
+    Attributes:
+        run_name (str): The name of the run, used in the report and its file names.
+        pre_dir (Path): The directory containing the input fasta files.
+        post_dir (Path): The directory containing the output fasta files.
+        functional_filter_dir (Path): The directory containing the functional filter reports.
+        output_dir (Path): The directory the report is written to.
+        run_date (datetime): When the pipeline was run.
+        pipeline_version (Optional[str]): The version of the pipeline.
+        pipeline_commit_hash (Optional[str]): The commit the pipeline was run with.
+        nextflow_params_fp (Optional[Path]): The nextflow params as a JSON file.
+        ref_name (Optional[str]): The name of the reference added to the samples.
+    """
+
+    run_name: str
+    pre_dir: Path
+    post_dir: Path
+    functional_filter_dir: Path
+    output_dir: Path
+    run_date: datetime = field(factory=datetime.today)
+    pipeline_version: Optional[str] = None
+    pipeline_commit_hash: Optional[str] = None
+    nextflow_params_fp: Optional[Path] = None
+    ref_name: Optional[str] = None
+
+
+@define
+class RunStatus:
+    """The outcome of rendering the report of one run.
+
+    Attributes:
+        run_name (str): The name of the run.
+        status (str): Either "ok" or "failed".
+        wall_s (float): How long the run took, in seconds.
+        compile_s (float): How much of that was spent compiling the report.
+        output (Optional[str]): The report PDF, or the report JSON if it wasn't compiled.
+        error (Optional[str]): Why the run failed.
+    """
+
+    run_name: str
+    status: str
+    wall_s: float = 0.0
+    compile_s: float = 0.0
+    output: Optional[str] = None
+    error: Optional[str] = None
+
+
+def read_manifest(manifest: Path, output_dir: Path) -> list[BatchRun]:
+    """Reads the runs to render from a CSV or JSON manifest.
+
+    A CSV manifest has a header row naming the fields, and a JSON manifest is a list of
+    objects. Relative paths are taken relative to the manifest.
+
+    Args:
+        manifest (Path): The manifest, as JSON if its suffix is .json and CSV otherwise.
+        output_dir (Path): The directory each run is written to a subdirectory of, unless the
+            run has an output_dir.
+
+    Returns:
+        list[BatchRun]: The runs, in the order of the manifest.
+
+    Raises:
+        ValueError: If a run is missing a required field or two runs share a name.
+    """
+    if manifest.suffix == ".json":
+        entries = json.loads(manifest.read_text())
+        if not isinstance(entries, list):
+            raise ValueError(f"{manifest} should hold a list of runs")
+    else:
+        with manifest.open(newline="") as handle:
+            entries = list(csv.DictReader(handle))
+
+    def path(value: str) -> Path:
+        value = Path(value)
+        return value if value.is_absolute() else manifest.parent / value
+
+    runs = []
+    for number, entry in enumerate(entries, start=1):
+        entry = {k: v for k, v in entry.items() if v not in (None, "")}
+        missing = [_ for _ in REQUIRED_FIELDS if _ not in entry]
+        if missing:
+            raise ValueError(
+                f"Run {number} in {manifest} is missing {', '.join(missing)}"
+            )
+        unknown = set(entry) - set(REQUIRED_FIELDS) - set(OPTIONAL_FIELDS)
+        if unknown:
+            logger.warning(
+                f"Ignoring unknown fields {', '.join(sorted(unknown))} of run {number}"
+            )
+
+        run_name = str(entry["run_name"])
+        run = BatchRun(
+            run_name=run_name,
+            pre_dir=path(entry["pre_dir"]),
+            post_dir=path(entry["post_dir"]),
+            functional_filter_dir=path(entry["functional_filter_dir"]),
+            output_dir=path(entry["output_dir"])
+            if "output_dir" in entry
+            else output_dir / run_name,
+            pipeline_version=entry.get("pipeline_version"),
+            pipeline_commit_hash=entry.get("pipeline_commit_hash"),
+            nextflow_params_fp=path(entry["nextflow_params"])
+            if "nextflow_params" in entry
+            else None,
+            ref_name=entry.get("ref_name"),
+        )
+        if "run_date" in entry:
+            run.run_date = datetime.fromisoformat(str(entry["run_date"]))
+        runs.append(run)
+
+    names = [_.run_name for _ in runs]
+    duplicates = {_ for _ in names if names.count(_) > 1}
+    if duplicates:
+        raise ValueError(
+            f"Run names must be unique, found {', '.join(sorted(duplicates))} more than once"
+        )
+
+    return runs
+
+
+def render_run(
+    run: BatchRun,
+    options: dict[str, Any],
+    incremental: bool = False,
+    profile: bool = False,
+) -> RunStatus:
+    """Writes the data and plots of one run's report, recording a failure rather than raising it.
+
+    Args:
+        run (BatchRun): The run.
+        options (dict[str, Any]): Keyword arguments for `render_report.create_report_json`
+            that are the same for every run, such as the cache and the plot output.
+        incremental (bool): Whether to keep per-file counts in the run's data/incremental and
+            only read the files that changed since its last render.
+        profile (bool): Whether to record the time and memory used by each stage in the
+            run's data/profile.json and data/profile.csv.
+
+    Returns:
+        RunStatus: Whether the data was written.
+    """
+    logger.info(f"Rendering report for {run.run_name}")
+    start = time.perf_counter()
+    if profile:
+        profiling.enable()
+    try:
+        for directory in (run.pre_dir, run.post_dir, run.functional_filter_dir):
+            if not directory.is_dir():
+                raise FileNotFoundError(f"{directory} is not a directory")
+
+        with profiling.stage("create_report_json"):
+            render_report.create_report_json(
+                run.pre_dir,
+                run.post_dir,
+                run.functional_filter_dir,
+                run.output_dir,
+                run.run_name,
+                run.run_date,
+                run.pipeline_version,
+                run.pipeline_commit_hash,
+                pipeline_params_fp=run.nextflow_params_fp,
+                ref_name=run.ref_name,
+                store=SampleStore(run.output_dir / "data" / "incremental")
+                if incremental
+                else None,
+                **options,
+            )
+    except Exception as e:
+        logger.opt(exception=e).error(f"Failed to render report for {run.run_name}")
+        return RunStatus(
+            run.run_name,
+            "failed",
+            time.perf_counter() - start,
+            error=f"{type(e).__name__}: {e}",
+        )
+    finally:
+        # The worker outlives the run, so don't let its figures pile up.
+        plt.close("all")
+        # Write whatever was measured, even if a stage failed.
+        if profile:
+            if (run.output_dir / "data").exists():
+                profiling.write(run.output_dir / "data")
+            profiling.disable()
+
+    return RunStatus(
+        run.run_name,
+        "ok",
+        time.perf_counter() - start,
+        output=str(run.output_dir / "data" / "data.json"),
+    )
+
+
+def compile_run(run: BatchRun, status: RunStatus, force: bool = False) -> RunStatus:
+    """Compiles the report of a run whose data was written, recording a failure.
+
+    Args:
+        run (BatchRun): The run.
+        status (RunStatus): The outcome of writing the run's data.
+        force (bool): Compile even if the template, data and plots are unchanged.
+
+    Returns:
+        RunStatus: The outcome with the compilation added.
+    """
+    start = time.perf_counter()
+    try:
+        pdf_path = render_report.render(run.output_dir, run.run_name, force=force)
+    except Exception as e:
+        logger.opt(exception=e).error(f"Failed to compile report for {run.run_name}")
+        elapsed = time.perf_counter() - start
+        return evolve(
+            status,
+            status="failed",
+            wall_s=status.wall_s + elapsed,
+            compile_s=elapsed,
+            output=None,
+            error=f"{type(e).__name__}: {e}",
+        )
+
+    elapsed = time.perf_counter() - start
+    return evolve(
+        status, wall_s=status.wall_s + elapsed, compile_s=elapsed, output=str(pdf_path)
+    )
+
+
+def _init_batch_worker() -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _render_runs(
+    runs: list[BatchRun],
+    options: dict[str, Any],
+    jobs: int,
+    incremental: bool = False,
+    profile: bool = False,
+) -> list[RunStatus]:
+    if jobs <= 1 or len(runs) <= 1:
+        return [render_run(_, options, incremental, profile) for _ in runs]
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(runs)),
+        mp_context=context,
+        initializer=_init_batch_worker,
+    ) as pool:
+        futures = [
+            pool.submit(render_run, _, options, incremental, profile) for _ in runs
+        ]
+
+        statuses = []
+        for run, future in zip(runs, futures):
+            # render_run catches errors itself, so this is only a worker dying.
+            error = future.exception()
+            if error:
+                logger.opt(exception=error).error(f"Lost the worker for {run.run_name}")
+                statuses.append(
+                    RunStatus(
+                        run.run_name, "failed", error=f"{type(error).__name__}: {error}"
+                    )
+                )
+            else:
+                statuses.append(future.result())
+    return statuses
+
+
+def render_batch(
+    runs: list[BatchRun],
+    options: dict[str, Any],
+    jobs: int = 1,
+    compile_pdf: bool = True,
+    typst_jobs: Optional[int] = None,
+    incremental: bool = False,
+    profile: bool = False,
+    recompile: bool = False,
+) -> list[RunStatus]:
+    """Renders the reports of many runs, reusing the imported modules between them.
+
+    The data and plots of every run are written first. With one job the runs are handled one
+    after another in this process. With more, they are spread over long-lived worker processes
+    that each handle many runs, so the start-up cost of the plotting libraries is paid once per
+    worker rather than once per run. The reports are then compiled, running a bounded number of
+    typst processes at once, and reports that are already up to date are skipped. A failing
+    run doesn't stop the others.
+
+    The runs share the cache in the options, so no run evicts it. Evicting while another run
+    is still scanning the cache would delete entries from under it, so the caller should
+    evict the cache once the batch has finished.
+
+    Args:
+        runs (list[BatchRun]): The runs.
+        options (dict[str, Any]): Keyword arguments for `render_report.create_report_json`
+            that are the same for every run.
+        jobs (int): The number of runs to write the data and plots of at once.
+        compile_pdf (bool): Whether to compile the reports with typst.
+        typst_jobs (Optional[int]): The number of typst processes to run at once. The same as
+            `jobs` if None.
+        incremental (bool): Whether each run keeps per-file counts in its data/incremental
+            and only reads the files that changed since its last render.
+        profile (bool): Whether to record the stages of writing each run's data and plots in
+            its data/profile.json and data/profile.csv. The compile time of each run is in
+            its status.
+        recompile (bool): Compile every report, even those that are up to date.
+
+    Returns:
+        list[RunStatus]: The outcome of each run, in the order of the runs.
+    """
+    statuses = _render_runs(
+        runs, {**options, "evict_cache": False}, jobs, incremental, profile
+    )
+    if not compile_pdf:
+        return statuses
+
+    # typst does the work in its own process, so threads are enough to run several at once.
+    with ThreadPoolExecutor(max_workers=max(typst_jobs or jobs, 1)) as pool:
+        futures = [
+            pool.submit(compile_run, run, status, recompile)
+            if status.status == "ok"
+            else None
+            for run, status in zip(runs, statuses)
+        ]
+        return [
+            future.result() if future else status
+            for status, future in zip(statuses, futures)
+        ]
+
+
+def format_statuses(statuses: list[RunStatus]) -> str:
+    """Formats the outcome of each run as a Markdown table."""
+    return tabulate(
+        [
+            [
+                _.run_name,
+                _.status,
+                f"{_.wall_s:.1f}",
+                f"{_.compile_s:.1f}",
+                _.output or _.error,
+            ]
+            for _ in statuses
+        ],
+        headers=["run", "status", "wall (s)", "compile (s)", "output"],
+        tablefmt="github",
+    )
+
+
+def write_statuses(statuses: list[RunStatus], output_dir: Path) -> tuple[Path, Path]:
+    """Writes the outcome of each run as JSON and CSV.
+
+    Args:
+        statuses (list[RunStatus]): The outcomes.
+        output_dir (Path): The directory to write batch_status.json and batch_status.csv to.
+
+    Returns:
+        tuple[Path, Path]: The JSON and CSV files.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    json_path = output_dir / "batch_status.json"
+    csv_path = output_dir / "batch_status.csv"
+    rows = [asdict(_) for _ in statuses]
+
+    json_path.write_text(json.dumps(rows, indent=4))
+    with csv_path.open("w", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=[_.name for _ in fields(RunStatus)])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    logger.info(f"Wrote the status of {len(rows)} runs to {json_path} and {csv_path}")
+    return json_path, csv_path
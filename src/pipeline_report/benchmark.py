@@ -0,0 +1,470 @@
+import json
+import multiprocessing
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from importlib import metadata
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import polars as pl
+from attrs import asdict, define
+from loguru import logger
+from tabulate import tabulate
+
+from pipeline_report import choices, parse_data, profiling
+
+REF_NAME = "REF"
+_RESIDUES = np.frombuffer(b"ACGT", dtype=np.uint8)
+_GAP = ord("-")
+
+# The steps that can be benchmarked. The plot steps time only the plotting function, with its
+# data loaded beforehand.
+PLOT_STEPS = choices.BENCHMARK_PLOT_STEPS
+STEPS = choices.BENCHMARK_STEPS
+
+# The CLI arguments whose start-up time is measured by default.
+STARTUP_COMMANDS = [
+    "--help",
+    "render --help",
+    "render-batch --help",
+    "convert-msa --help",
+    "benchmark --help",
+]
+# Libraries that are slow to import, which a command should only load once it needs them.
+HEAVY_MODULES = [
+    "matplotlib",
+    "numpy",
+    "pandas",
+    "plotnine",
+    "polars",
+    "pyarrow",
+    "upsetplot",
+]
+
+
+@define
+class CohortSpec:
+    """The shape of a synthetic cohort.
+
+    Attributes:
+        samples (int): The number of samples, each with a pre, post and functional filter file.
+        reads_per_sample (int): The number of sequences in each pre-pipeline file.
+        alignment_length (int): The width of the post-pipeline alignments.
+        retention (float): The fraction of sequences that make it through the pipeline.
+        seed (int): The seed for the random number generator.
+    """
+
+    samples: int
+    reads_per_sample: int
+    alignment_length: int
+    retention: float = 0.7
+    seed: int = 0
+
+    @property
+    def label(self) -> str:
+        return f"{self.samples}x{self.reads_per_sample}x{self.alignment_length}"
+
+
+@define
+class Cohort:
+    """A synthetic cohort written to disk.
+
+    Attributes:
+        spec (CohortSpec): The shape of the cohort.
+        pre_dir (Path): The directory of pre-pipeline FASTA files.
+        post_dir (Path): The directory of aligned post-pipeline FASTA files.
+        functional_filter_dir (Path): The directory of functional filter reports.
+        input_bytes (int): The total size of the input files.
+    """
+
+    spec: CohortSpec
+    pre_dir: Path
+    post_dir: Path
+    functional_filter_dir: Path
+    input_bytes: int
+
+
+@define
+class BenchmarkResult:
+    """The fastest of the repeats of one benchmark step on one cohort.
+
+    Attributes:
+        step (str): The step that was timed.
+        cohort (str): The label of the cohort, as samples x reads x alignment length.
+        samples (int): The number of samples in the cohort.
+        reads (int): The number of pre-pipeline sequences in the cohort.
+        input_mb (float): The size of the cohort's input files in MiB.
+        wall_s (float): Elapsed wall-clock time in seconds.
+        cpu_s (float): CPU time in seconds, including any worker processes.
+        peak_rss_mb (float): The peak resident set size of the process that ran the step, in
+            MiB. This includes the interpreter and imported modules.
+        reads_per_s (float): Pre-pipeline sequences processed per second.
+        mb_per_s (float): MiB of input processed per second.
+    """
+
+    step: str
+    cohort: str
+    samples: int
+    reads: int
+    input_mb: float
+    wall_s: float
+    cpu_s: float
+    peak_rss_mb: float
+    reads_per_s: float
+    mb_per_s: float
+
+
+@define
+class StartupResult:
+    """The fastest of the repeats of starting the CLI with some arguments.
+
+    Attributes:
+        command (str): The arguments the CLI was started with.
+        wall_s (float): Elapsed wall-clock time in seconds, including starting the interpreter.
+        heavy_modules (list[str]): The libraries from `HEAVY_MODULES` that were imported.
+    """
+
+    command: str
+    wall_s: float
+    heavy_modules: list[str]
+
+
+def sample_id(index: int) -> str:
+    """Builds an ELLPACA-style sample ID, e.g. CAP100_1000-A, that is unique for each index.
+
+    The participant (CAPxxx) and visit are fixed-width as the ELLPACA sample ID schema
+    expects.
+    """
+    participant = 100 + index % 900
+    visit = 1000 + 10 * (index // 900)
+    pool = "AB"[index % 2]
+    return f"CAP{participant:03d}_{visit:04d}-{pool}"
+
+
+def _write_fasta(file: Path, names: list[str], rows: np.ndarray, lengths: np.ndarray):
+    with file.open("wb") as handle:
+        for name, row, length in zip(names, rows, lengths):
+            handle.write(f">{name}\n".encode())
+            handle.write(row[:length].tobytes())
+            handle.write(b"\n")
+
+
+def generate_cohort(spec: CohortSpec, output_dir: Path) -> Cohort:
+    """Writes a synthetic cohort with the same layout as the pipeline's output.
+
+    Every sample gets a pre-pipeline FASTA file, an aligned post-pipeline FASTA file holding
+    the reference and the sequences that passed, and a functional filter report.
+
+    Args:
+        spec (CohortSpec): The shape of the cohort.
+        output_dir (Path): The directory to write the pre, post and functional_filter
+            directories to.
+
+    Returns:
+        Cohort: The cohort.
+    """
+    rng = np.random.default_rng(spec.seed)
+    cohort = Cohort(
+        spec=spec,
+        pre_dir=output_dir / "pre",
+        post_dir=output_dir / "post",
+        functional_filter_dir=output_dir / "functional_filter",
+        input_bytes=0,
+    )
+    for directory in [cohort.pre_dir, cohort.post_dir, cohort.functional_filter_dir]:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    width = spec.alignment_length
+    reads = spec.reads_per_sample
+    reference = np.full((1, width), ord("A"), dtype=np.uint8)
+
+    for index in range(spec.samples):
+        name = sample_id(index)
+        names = [f"{name}_{_}" for _ in range(reads)]
+        lengths = rng.integers(
+            max(1, int(width * 0.8)), width, size=reads, endpoint=True
+        )
+        rows = rng.choice(_RESIDUES, size=(reads, width))
+        _write_fasta(cohort.pre_dir / f"{name}.fasta", names, rows, lengths)
+
+        passes = rng.random((reads, 4)) < spec.retention ** (1 / 4)
+        kept = passes.all(axis=1)
+        aligned = np.where(np.arange(width) < lengths[:, None], rows, _GAP)[kept]
+        _write_fasta(
+            cohort.post_dir / f"{name}.fasta",
+            [REF_NAME] + [_ for _, keep in zip(names, kept) if keep],
+            np.concatenate([reference, aligned.astype(np.uint8)]),
+            np.full(len(aligned) + 1, width),
+        )
+
+        earliest_stop = rng.integers(0, width, size=reads)
+        pl.DataFrame(
+            {
+                "seq_name": names,
+                "num_stop_codons": rng.poisson(0.3, size=reads),
+                "nt_length_ungapped": lengths,
+                "nt_length_gapped": np.full(reads, width),
+                "divisible_by_3": lengths % 3 == 0,
+                "earliest_stop_codon": earliest_stop,
+                "earliest_stop_pct": earliest_stop / width,
+                "loss_from_median": rng.random(reads),
+                "longest_gap_length": rng.integers(0, 30, size=reads).astype(float),
+                "longest_gap_location": rng.integers(0, width, size=reads).astype(
+                    float
+                ),
+                "passes_frameshift_filter": passes[:, 0],
+                "passes_minimum_length_filter": passes[:, 1],
+                "passes_no_stop_codon_filter": passes[:, 2],
+                "passes_early_stop_codon_filter": passes[:, 3],
+                "flag": np.where(kept, "", "filtered"),
+                "passes_filter": kept,
+            },
+            schema=parse_data.FUNCTIONAL_FILTER_SCHEMA,
+        ).write_csv(cohort.functional_filter_dir / f"{name}.report.csv")
+
+    cohort.input_bytes = sum(
+        _.stat().st_size
+        for directory in [cohort.pre_dir, cohort.post_dir, cohort.functional_filter_dir]
+        for _ in directory.iterdir()
+    )
+    logger.info(
+        f"Generated cohort {spec.label} ({cohort.input_bytes / 2**20:.1f} MiB) in {output_dir}"
+    )
+    return cohort
+
+
+def _run_step(
+    step: str, cohort: Cohort, tables: dict[str, Path], output_dir: Path, workers: int
+) -> profiling.StageRecord:
+    """Runs one step of the report build. Meant to run in a fresh process."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from pipeline_report import create_plots, render_report
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if step == "generate_report_data":
+        with profiling.measure(step) as record:
+            data = parse_data.generate_report_data(
+                cohort.pre_dir,
+                cohort.post_dir,
+                cohort.functional_filter_dir,
+                pre_post_output=output_dir / "pre_post.parquet",
+                functional_filter_output=output_dir / "functional_filter.parquet",
+                attrition_output=output_dir / "attrition.parquet",
+                ref_name=REF_NAME,
+                workers=workers,
+            )
+            record.rows = data.pre_post_df.height
+        return record
+
+    if step == "create_report_json":
+        with profiling.measure(step) as record:
+            render_report.create_report_json(
+                cohort.pre_dir,
+                cohort.post_dir,
+                cohort.functional_filter_dir,
+                output_dir,
+                "benchmark",
+                datetime.today(),
+                "benchmark",
+                "benchmark",
+                "png",
+                None,
+                REF_NAME,
+                workers=workers,
+            )
+        return record
+
+    func = getattr(create_plots, PLOT_STEPS[step])
+    if step == "plot:msa_gridplot":
+        data = cohort.post_dir
+    elif step in ("plot:upsetplot", "plot:seq_length_boxplot"):
+        data = parse_data.load_table(tables["functional_filter"])
+    else:
+        data = parse_data.load_table(tables["attrition"])
+
+    with profiling.measure(step) as record:
+        func(data, output_dir / f"{step.split(':')[1]}.png")
+        record.rows = getattr(data, "height", None)
+    return record
+
+
+def _run_step_isolated(
+    step: str, cohort: Cohort, tables: dict[str, Path], output_dir: Path, workers: int
+) -> profiling.StageRecord:
+    # A fresh process per step keeps the peak RSS of one step from leaking into the next.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(
+            _run_step, step, cohort, tables, output_dir, workers
+        ).result()
+
+
+def run_benchmarks(
+    specs: list[CohortSpec],
+    work_dir: Path,
+    steps: Optional[list[str]] = None,
+    repeats: int = 1,
+    workers: int = 1,
+) -> list[BenchmarkResult]:
+    """Generates each cohort and times each step of the report build on it.
+
+    Every run of a step happens in a fresh process, and the fastest of the repeats is kept.
+
+    Args:
+        specs (list[CohortSpec]): The cohorts to benchmark.
+        work_dir (Path): The directory to write the cohorts and the step outputs to.
+        steps (Optional[list[str]]): The steps to time, from `STEPS`. All steps if None.
+        repeats (int): The number of times to run each step.
+        workers (int): The number of processes the steps may use.
+
+    Returns:
+        list[BenchmarkResult]: The results, by cohort and then by step.
+
+    Raises:
+        ValueError: If an unknown step is requested.
+    """
+    steps = steps or STEPS
+    unknown = set(steps) - set(STEPS)
+    if unknown:
+        raise ValueError(f"Unknown benchmark steps: {', '.join(sorted(unknown))}")
+
+    results = []
+    for spec in specs:
+        cohort_dir = work_dir / spec.label
+        cohort = generate_cohort(spec, cohort_dir / "input")
+
+        # The plots are drawn from the tables, so build them once up front.
+        tables_dir = cohort_dir / "tables"
+        tables = {
+            "functional_filter": tables_dir / "functional_filter.parquet",
+            "attrition": tables_dir / "attrition.parquet",
+        }
+        if any(_ in PLOT_STEPS for _ in steps):
+            tables_dir.mkdir(parents=True, exist_ok=True)
+            parse_data.generate_report_data(
+                cohort.pre_dir,
+                cohort.post_dir,
+                cohort.functional_filter_dir,
+                pre_post_output=tables_dir / "pre_post.parquet",
+                functional_filter_output=tables["functional_filter"],
+                attrition_output=tables["attrition"],
+                ref_name=REF_NAME,
+                workers=workers,
+            )
+
+        for step in steps:
+            records = []
+            for repeat in range(repeats):
+                output_dir = cohort_dir / "output" / step.replace(":", "_")
+                # Start from scratch so nothing is skipped as up to date.
+                shutil.rmtree(output_dir, ignore_errors=True)
+                logger.info(f"Running {step} on {spec.label} ({repeat + 1}/{repeats})")
+                records.append(
+                    _run_step_isolated(step, cohort, tables, output_dir, workers)
+                )
+
+            best = min(records, key=lambda record: record.wall_s)
+            reads = spec.samples * spec.reads_per_sample
+            input_mb = cohort.input_bytes / 2**20
+            results.append(
+                BenchmarkResult(
+                    step=step,
+                    cohort=spec.label,
+                    samples=spec.samples,
+                    reads=reads,
+                    input_mb=round(input_mb, 3),
+                    wall_s=round(best.wall_s, 4),
+                    cpu_s=round(best.cpu_s, 4),
+                    peak_rss_mb=round(max(_.max_rss_mb for _ in records), 1),
+                    reads_per_s=round(reads / best.wall_s, 1),
+                    mb_per_s=round(input_mb / best.wall_s, 3),
+                )
+            )
+
+    return results
+
+
+def _imported_modules(args: list[str]) -> set[str]:
+    # -X importtime reports every module imported, one per line, as "... | cumulative | name".
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args], capture_output=True, text=True
+    )
+    return {
+        line.rsplit("|", 1)[1].strip().split(".")[0]
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and line.count("|") == 2
+    }
+
+
+def run_startup_benchmarks(
+    commands: Optional[list[str]] = None, repeats: int = 5
+) -> list[StartupResult]:
+    """Times how long the CLI takes to start with each of some arguments.
+
+    Each command is run in a fresh interpreter, as a user would run it. An argument error still
+    counts, since it should be reported just as quickly.
+
+    Args:
+        commands (Optional[list[str]]): The arguments to start the CLI with, each as one
+            string. `STARTUP_COMMANDS` if None.
+        repeats (int): The number of times to run each command.
+
+    Returns:
+        list[StartupResult]: The fastest run of each command.
+    """
+    results = []
+    for command in commands or STARTUP_COMMANDS:
+        args = ["-m", "pipeline_report.cli", *shlex.split(command)]
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *args], capture_output=True)
+            times.append(time.perf_counter() - start)
+
+        heavy = sorted(_imported_modules(args) & set(HEAVY_MODULES))
+        logger.info(f"Started with {command!r} in {min(times):.3f}s")
+        results.append(StartupResult(command, round(min(times), 4), heavy))
+
+    return results
+
+
+def format_results(results: list[BenchmarkResult] | list[StartupResult]) -> str:
+    """Formats benchmark results as a plain-text table."""
+    return tabulate([asdict(_) for _ in results], headers="keys", tablefmt="github")
+
+
+def write_results(
+    results: list[BenchmarkResult] | list[StartupResult], output: Path
+) -> None:
+    """Writes benchmark results as JSON, along with the versions they were measured with.
+
+    Args:
+        results (list[BenchmarkResult] | list[StartupResult]): The results.
+        output (Path): The JSON file to write.
+    """
+    try:
+        version = metadata.version("pipeline-report")
+    except metadata.PackageNotFoundError:
+        # Running from a source checkout that isn't installed.
+        version = "unknown"
+
+    payload = {
+        "pipeline_report": version,
+        "polars": pl.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": multiprocessing.cpu_count(),
+        "results": [asdict(_) for _ in results],
+    }
+    output.write_text(json.dumps(payload, indent=4))
+    logger.info(f"Wrote benchmark results to {output}")
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+import polars as pl
+from attrs import define
+from loguru import logger
+
+# Bump this whenever the layout of the parsed frames changes so old entries are ignored.
+CACHE_VERSION = 3
+
+
+def file_digest(file: Path) -> str:
+    """Computes the SHA-256 digest of a file's contents.
+
+    Args:
+        file (Path): The file to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+    with file.open("rb") as handle:
+        return hashlib.file_digest(handle, "sha256").hexdigest()
+
+
+def frame_fingerprint(df: pl.DataFrame, columns: list[str]) -> str:
+    """Computes a fingerprint of the values in some columns of a dataframe.
+
+    Args:
+        df (pl.DataFrame): The dataframe.
+        columns (list[str]): The columns to include in the fingerprint.
+
+    Returns:
+        str: A hex digest that changes whenever the schema, order or values of the columns do.
+    """
+    # Row hashing doesn't support nested types, so lists are hashed as joined strings.
+    subset = df.select(columns)
+    subset = subset.with_columns(
+        pl.col(name).cast(pl.List(pl.String)).list.join(",")
+        for name, dtype in subset.schema.items()
+        if isinstance(dtype, pl.List)
+    )
+    digest = hashlib.sha256()
+    digest.update(f"{pl.__version__}{subset.schema}".encode())
+    # Fixed seeds keep the row hashes stable between runs of the same polars version.
+    digest.update(
+        subset.hash_rows(seed=0, seed_1=1, seed_2=2, seed_3=3).to_numpy().tobytes()
+    )
+    return digest.hexdigest()
+
+
+def directory_fingerprint(directory: Path, pattern: str) -> str:
+    """Computes a fingerprint of the files in a directory from their names, sizes and mtimes.
+
+    Args:
+        directory (Path): The directory.
+        pattern (str): A glob selecting the files to include.
+
+    Returns:
+        str: A hex digest that changes whenever a matching file is added, removed or modified.
+    """
+    digest = hashlib.sha256()
+    for file in sorted(directory.glob(pattern)):
+        stat = file.stat()
+        digest.update(f"{file.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def plot_fingerprint(data_fingerprint: str, **params) -> str:
+    """Combines the fingerprint of a plot's data with the parameters it is drawn with.
+
+    Args:
+        data_fingerprint (str): The fingerprint of the data the plot is drawn from.
+        **params: The parameters the plot is drawn with. Values must be JSON serialisable or
+            have a meaningful string representation.
+
+    Returns:
+        str: A hex digest identifying the plot.
+    """
+    payload = json.dumps(
+        {"version": CACHE_VERSION, "data": data_fingerprint, **params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def report_fingerprint(report_dir: Path, template: bytes) -> str:
+    """Fingerprints everything a compiled report is made from.
+
+    Args:
+        report_dir (Path): The report's output directory, holding data/data.json.
+        template (bytes): The typst template.
+
+    Returns:
+        str: A hex digest that changes whenever the template, the report data or any of the
+            images it references do.
+    """
+    data_json = report_dir / "data" / "data.json"
+    digest = hashlib.sha256(template)
+    digest.update(data_json.read_bytes())
+    for key, value in sorted(json.loads(data_json.read_text()).items()):
+        if key.startswith("img_"):
+            digest.update(f"{key}\0{file_digest(report_dir / value)}\n".encode())
+    return digest.hexdigest()
+
+
+@define
+class PlotCache:
+    """Records the fingerprint each plot was last drawn with, so unchanged plots can be skipped.
+
+    Compiled reports are tracked the same way, keyed on the run name.
+
+    Attributes:
+        manifest_path (Path): The JSON file the fingerprints are stored in.
+    """
+
+    manifest_path: Path
+
+    def _read(self) -> dict[str, str]:
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            return json.loads(self.manifest_path.read_text())
+        except ValueError:
+            logger.warning(f"Ignoring unreadable plot manifest {self.manifest_path}")
+            return {}
+
+    def is_current(self, name: str, fingerprint: str, outputs: list[Path]) -> bool:
+        """Checks whether a plot was last drawn with the given fingerprint.
+
+        Args:
+            name (str): The name of the plot.
+            fingerprint (str): The fingerprint of the plot's current data and parameters.
+            outputs (list[Path]): The files the plot writes, which must all still exist.
+
+        Returns:
+            bool: True if the plot doesn't need to be redrawn.
+        """
+        return self._read().get(name) == fingerprint and all(
+            _.exists() for _ in outputs
+        )
+
+    def record(self, name: str, fingerprint: str) -> None:
+        """Stores the fingerprint a plot was drawn with.
+
+        Args:
+            name (str): The name of the plot.
+            fingerprint (str): The fingerprint of the plot's data and parameters.
+        """
+        entries = self._read()
+        entries[name] = fingerprint
+        self.manifest_path.write_text(json.dumps(entries, indent=4, sort_keys=True))
+
+
+@define
+class IngestionCache:
+    """An on-disk cache of parsed input files, stored as one Parquet file per input.
+
+    Entries are keyed on the resolved path, size and modification time of the input file
+    (and optionally a hash of its contents), so any change to the file results in a miss.
+
+    Attributes:
+        cache_dir (Path): The directory the Parquet files are stored in.
+        max_size_bytes (Optional[int]): The size the cache is trimmed back to by `evict`,
+            removing the least recently used entries first. No limit if None.
+        hash_contents (bool): Whether to also key entries on a hash of the file contents.
+    """
+
+    cache_dir: Path
+    max_size_bytes: Optional[int] = None
+    hash_contents: bool = False
+
+    def key(self, source: Path, kind: str) -> str:
+        """Builds the cache key for an input file.
+
+        Args:
+            source (Path): The input file.
+            kind (str): What the file is parsed as, e.g. "pre" or "functional_filter".
+
+        Returns:
+            str: The cache key.
+        """
+        stat = source.stat()
+        parts = [
+            str(CACHE_VERSION),
+            kind,
+            str(source.resolve()),
+            str(stat.st_size),
+            str(stat.st_mtime_ns),
+        ]
+        if self.hash_contents:
+            parts.append(file_digest(source))
+
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def contains(self, source: Path, kind: str) -> bool:
+        """Checks whether an input file is cached, without parsing or touching it.
+
+        Args:
+            source (Path): The input file.
+            kind (str): What the file is parsed as, e.g. "pre" or "functional_filter".
+
+        Returns:
+            bool: True if the file is cached.
+        """
+        return (self.cache_dir / f"{self.key(source, kind)}.parquet").exists()
+
+    def _store(self, source: Path, entry: Path, df: pl.DataFrame) -> None:
+        # Write to a temporary file first so concurrent workers never see a partial entry.
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        partial = entry.with_suffix(f".{os.getpid()}.tmp")
+        df.write_parquet(partial)
+        os.replace(partial, entry)
+        logger.debug(f"Cached {source} at {entry}")
+
+    def ensure(
+        self, source: Path, kind: str, loader: Callable[[], pl.DataFrame]
+    ) -> Path:
+        """Makes sure an input file is cached, parsing and storing it on a miss.
+
+        Unlike `load`, the cached frame isn't read on a hit, so it can be scanned lazily.
+
+        Args:
+            source (Path): The input file.
+            kind (str): What the file is parsed as, e.g. "pre" or "functional_filter".
+            loader (Callable[[], pl.DataFrame]): Parses the file when it isn't cached.
+
+        Returns:
+            Path: The Parquet file holding the parsed input file.
+        """
+        entry = self.cache_dir / f"{self.key(source, kind)}.parquet"
+
+        if entry.exists():
+            # Touch the entry so eviction treats it as recently used.
+            os.utime(entry)
+            logger.debug(f"Found {source} in cache")
+        else:
+            self._store(source, entry, loader())
+
+        return entry
+
+    def load(
+        self, source: Path, kind: str, loader: Callable[[], pl.DataFrame]
+    ) -> pl.DataFrame:
+        """Returns the parsed frame for an input file, parsing and storing it on a miss.
+
+        Args:
+            source (Path): The input file.
+            kind (str): What the file is parsed as, e.g. "pre" or "functional_filter".
+            loader (Callable[[], pl.DataFrame]): Parses the file when it isn't cached.
+
+        Returns:
+            pl.DataFrame: The parsed file.
+        """
+        entry = self.ensure(source, kind, loader)
+
+        try:
+            return pl.read_parquet(entry)
+        except (OSError, pl.exceptions.PolarsError) as e:
+            logger.warning(f"Replacing unreadable cache entry {entry}: {e}")
+            df = loader()
+            self._store(source, entry, df)
+            return df
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache fits in `max_size_bytes`."""
+        if self.max_size_bytes is None or not self.cache_dir.exists():
+            return
+
+        entries = [(_, _.stat()) for _ in self.cache_dir.glob("*.parquet")]
+        entries.sort(key=lambda entry: entry[1].st_mtime)
+        total_size = sum(stat.st_size for _, stat in entries)
+
+        for entry, stat in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total_size -= stat.st_size
+            logger.debug(f"Evicted {entry} from cache")
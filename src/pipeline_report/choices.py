@@ -0,0 +1,34 @@
+import enum
+
+# The values offered as choices on the command line. This module is imported as soon as the
+# CLI starts, so it must not import anything heavy.
+
+
+class DataFormat(str, enum.Enum):
+    PARQUET = "parquet"
+    IPC = "ipc"
+    CSV = "csv"
+
+    @property
+    def suffix(self) -> str:
+        return {"parquet": ".parquet", "ipc": ".arrow", "csv": ".csv"}[self.value]
+
+
+class PlotFormat(str, enum.Enum):
+    PNG = "png"
+    SVG = "svg"
+
+
+class SampleIDSchema(str, enum.Enum):
+    ELLPACA = "ELLPACA"
+
+
+# The steps that can be benchmarked, and the `create_plots` function each plot step times.
+BENCHMARK_PLOT_STEPS = {
+    "plot:msa_gridplot": "create_msa_gridplot",
+    "plot:upsetplot": "create_filter_upset_plot",
+    "plot:seq_length_boxplot": "create_seq_length_boxplot",
+    "plot:seq_count_bubbleplot": "create_seq_count_bubbleplot",
+    "plot:seq_count_barplot": "create_seq_count_barplot",
+}
+BENCHMARK_STEPS = ["generate_report_data", "create_report_json", *BENCHMARK_PLOT_STEPS]
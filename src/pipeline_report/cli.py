@@ -5,10 +5,120 @@ from typing import Annotated
 import typer
 from loguru import logger
 
-from pipeline_report import render_report
+from pipeline_report.choices import (
+    BENCHMARK_STEPS,
+    DataFormat,
+    PlotFormat,
+    SampleIDSchema,
+)
+
+# The commands import what they need when they run, so that the plotting and data libraries
+# aren't loaded just to show the help or report a bad argument.
 
 app = typer.Typer()
 
+# Options that render and render-batch share, so a batch of runs can be configured in the
+# same way as a single run.
+SampleIDSchemaOption = Annotated[
+    SampleIDSchema,
+    typer.Option(
+        help="Naming schema of the sample IDs the input files are named after. Every name is checked before any file is read."
+    ),
+]
+WorkersOption = Annotated[
+    int,
+    typer.Option(
+        help="Number of processes each report uses to read its input files and draw its plots.",
+        min=1,
+    ),
+]
+CacheHashOption = Annotated[
+    bool,
+    typer.Option(help="Also key cached files on a hash of their contents."),
+]
+IOThreadsOption = Annotated[
+    int,
+    typer.Option(
+        help="Number of threads reading upcoming input files ahead of their parsing, which hides the latency of network filesystems. 0 reads each file as it is parsed.",
+        min=0,
+    ),
+]
+IOReadaheadOption = Annotated[
+    int,
+    typer.Option(
+        help="Number of input files read ahead of the one being parsed.", min=1
+    ),
+]
+MSAMatrixOption = Annotated[
+    bool,
+    typer.Option(
+        "--msa-matrix/--no-msa-matrix",
+        help="Convert the post-pipeline alignments to memory-mappable matrix files in data/msa.",
+    ),
+]
+DataFormatOption = Annotated[
+    DataFormat,
+    typer.Option(help="File format of the tables written to the data directory."),
+]
+DataCompressionOption = Annotated[
+    str,
+    typer.Option(
+        help="Compression codec for the data tables. Defaults to zstd for parquet and ipc."
+    ),
+]
+GraphicFiletypeOption = Annotated[
+    PlotFormat,
+    typer.Option(help="File format of the plots embedded in the report."),
+]
+PlotFormatOption = Annotated[
+    list[PlotFormat],
+    typer.Option(help="Also write the plots in this format. Can be repeated."),
+]
+PlotDPIOption = Annotated[
+    int,
+    typer.Option(
+        help="Resolution of the plots. Defaults to 300, or 100 for the MSA grid.",
+        min=1,
+    ),
+]
+RasterizeOption = Annotated[
+    bool,
+    typer.Option(
+        help="Draw plot layers with many points or bars as images in vector plots."
+    ),
+]
+IncrementalOption = Annotated[
+    bool,
+    typer.Option(
+        help="Keep per-file counts in data/incremental and only read the files that changed since the last run."
+    ),
+]
+AggregateOnlyOption = Annotated[
+    bool,
+    typer.Option(
+        help="Only keep per-file counts of the pre and post files rather than a row per sequence."
+    ),
+]
+LineageOption = Annotated[
+    bool,
+    typer.Option(
+        "--lineage",
+        help="Also write the fate of every read and a per-sample survival breakdown to data/.",
+    ),
+]
+ProfileOption = Annotated[
+    bool,
+    typer.Option(
+        help="Record the time and memory used by each stage in data/profile.json and data/profile.csv."
+    ),
+]
+RecompileOption = Annotated[
+    bool,
+    typer.Option(
+        help="Compile the report even if its template, data and plots are unchanged."
+    ),
+]
+
 
 @app.command("render")
 def render_report_cli(
@@ -66,27 +176,340 @@ def render_report_cli(
     ref_name: Annotated[
         str, typer.Option(help="Name of the reference added to the samples.")
     ] = None,
+    sample_id_schema: SampleIDSchemaOption = SampleIDSchema.ELLPACA,
+    workers: WorkersOption = 1,
+    cache: Annotated[
+        bool, typer.Option(help="Cache parsed input files between runs.")
+    ] = False,
+    cache_dir: Annotated[
+        Path,
+        typer.Option(
+            help="Directory for the input cache. Defaults to data/cache in the output directory.",
+            file_okay=False,
+        ),
+    ] = None,
+    cache_max_size: Annotated[
+        int,
+        typer.Option(
+            help="Size in MB the input cache is trimmed back to after each run.", min=0
+        ),
+    ] = 2048,
+    cache_hash: CacheHashOption = False,
+    io_threads: IOThreadsOption = 0,
+    io_readahead: IOReadaheadOption = 16,
+    msa_matrix_files: MSAMatrixOption = False,
+    data_format: DataFormatOption = DataFormat.PARQUET,
+    data_compression: DataCompressionOption = None,
+    graphic_filetype: GraphicFiletypeOption = PlotFormat.PNG,
+    plot_format: PlotFormatOption = None,
+    plot_dpi: PlotDPIOption = None,
+    rasterize: RasterizeOption = True,
+    incremental: IncrementalOption = False,
+    aggregate_only: AggregateOnlyOption = False,
+    read_lineage: LineageOption = False,
+    profile: ProfileOption = False,
+    recompile: RecompileOption = False,
 ):
-    logger.info("Creating JSON data.")
-    render_report.create_report_json(
-        pipeline_pre_dir,
-        pipeline_post_dir,
-        pipeline_functional_filter_dir,
-        output_dir,
-        run_name,
-        run_date,
-        pipeline_version,
-        pipeline_commit_hash,
-        "png",
-        nextflow_params_fp,
-        ref_name,
-    )
+    from pipeline_report import profiling, render_report
+    from pipeline_report.cache import IngestionCache
+    from pipeline_report.create_plots import PlotOutput
+    from pipeline_report.incremental import SampleStore
+    from pipeline_report.prefetch import Prefetcher
+
+    if profile:
+        profiling.enable()
 
-    logger.info("Rendering report")
-    render_report.render(output_dir, run_name)
+    ingestion_cache = None
+    if cache:
+        ingestion_cache = IngestionCache(
+            cache_dir=cache_dir or output_dir / "data" / "cache",
+            max_size_bytes=cache_max_size * 1024 * 1024,
+            hash_contents=cache_hash,
+        )
+
+    try:
+        logger.info("Creating JSON data.")
+        with profiling.stage("create_report_json"):
+            render_report.create_report_json(
+                pipeline_pre_dir,
+                pipeline_post_dir,
+                pipeline_functional_filter_dir,
+                output_dir,
+                run_name,
+                run_date,
+                pipeline_version,
+                pipeline_commit_hash,
+                graphic_filetype.value,
+                nextflow_params_fp,
+                ref_name,
+                workers=workers,
+                cache=ingestion_cache,
+                convert_msas=msa_matrix_files,
+                data_format=data_format,
+                data_compression=data_compression,
+                store=SampleStore(output_dir / "data" / "incremental")
+                if incremental
+                else None,
+                aggregate_only=aggregate_only,
+                plot_output=PlotOutput(
+                    formats=[_.value for _ in plot_format or []],
+                    dpi=plot_dpi,
+                    rasterize=rasterize,
+                ),
+                read_lineage=read_lineage,
+                prefetcher=Prefetcher(concurrency=io_threads, readahead=io_readahead)
+                if io_threads
+                else None,
+                sample_id_schema=sample_id_schema,
+            )
+
+        logger.info("Rendering report")
+        render_report.render(output_dir, run_name, force=recompile)
+    finally:
+        # Write whatever was measured, even if a stage failed.
+        if profile and (output_dir / "data").exists():
+            profiling.write(output_dir / "data")
     pass
 
 
+@app.command("render-batch")
+def render_batch_cli(
+    manifest: Annotated[
+        Path,
+        typer.Argument(
+            help="CSV or JSON file listing the runs, with run_name, pre_dir, post_dir and functional_filter_dir and optionally output_dir, run_date, pipeline_version, pipeline_commit_hash, nextflow_params and ref_name.",
+            dir_okay=False,
+            exists=True,
+        ),
+    ],
+    output_dir: Annotated[
+        Path,
+        typer.Argument(
+            help="Location where each run's report is written, in a directory named after the run unless the manifest gives one.",
+            file_okay=False,
+        ),
+    ],
+    jobs: Annotated[
+        int,
+        typer.Option(help="Number of runs rendered at once.", min=1),
+    ] = 1,
+    workers: WorkersOption = 1,
+    cache: Annotated[
+        bool, typer.Option(help="Cache parsed input files, shared between the runs.")
+    ] = False,
+    cache_dir: Annotated[
+        Path,
+        typer.Option(
+            help="Directory for the input cache. Defaults to cache in the output directory.",
+            file_okay=False,
+        ),
+    ] = None,
+    cache_max_size: Annotated[
+        int,
+        typer.Option(
+            help="Size in MB the input cache is trimmed back to after the batch.", min=0
+        ),
+    ] = 2048,
+    cache_hash: CacheHashOption = False,
+    io_threads: IOThreadsOption = 0,
+    io_readahead: IOReadaheadOption = 16,
+    sample_id_schema: SampleIDSchemaOption = SampleIDSchema.ELLPACA,
+    msa_matrix_files: MSAMatrixOption = False,
+    data_format: DataFormatOption = DataFormat.PARQUET,
+    data_compression: DataCompressionOption = None,
+    graphic_filetype: GraphicFiletypeOption = PlotFormat.PNG,
+    plot_format: PlotFormatOption = None,
+    plot_dpi: PlotDPIOption = None,
+    rasterize: RasterizeOption = True,
+    incremental: IncrementalOption = False,
+    aggregate_only: AggregateOnlyOption = False,
+    read_lineage: LineageOption = False,
+    profile: ProfileOption = False,
+    recompile: RecompileOption = False,
+    compile_pdf: Annotated[
+        bool,
+        typer.Option(
+            "--compile/--no-compile",
+            help="Compile the reports with typst, or only write their data and plots.",
+        ),
+    ] = True,
+    typst_jobs: Annotated[
+        int,
+        typer.Option(
+            help="Number of typst processes run at once. Defaults to the number of jobs.",
+            min=1,
+        ),
+    ] = None,
+):
+    from pipeline_report import batch
+    from pipeline_report.cache import IngestionCache
+    from pipeline_report.create_plots import PlotOutput
+    from pipeline_report.prefetch import Prefetcher
+
+    runs = batch.read_manifest(manifest, output_dir)
+    logger.info(f"Rendering {len(runs)} runs from {manifest}")
+
+    ingestion_cache = None
+    if cache:
+        ingestion_cache = IngestionCache(
+            cache_dir=cache_dir or output_dir / "cache",
+            max_size_bytes=cache_max_size * 1024 * 1024,
+            hash_contents=cache_hash,
+        )
+
+    statuses = batch.render_batch(
+        runs,
+        {
+            "graphic_filetype": graphic_filetype.value,
+            "workers": workers,
+            "cache": ingestion_cache,
+            "convert_msas": msa_matrix_files,
+            "data_format": data_format,
+            "data_compression": data_compression,
+            "aggregate_only": aggregate_only,
+            "plot_output": PlotOutput(
+                formats=[_.value for _ in plot_format or []],
+                dpi=plot_dpi,
+                rasterize=rasterize,
+            ),
+            "read_lineage": read_lineage,
+            "prefetcher": Prefetcher(concurrency=io_threads, readahead=io_readahead)
+            if io_threads
+            else None,
+            "sample_id_schema": sample_id_schema,
+        },
+        jobs=jobs,
+        compile_pdf=compile_pdf,
+        typst_jobs=typst_jobs,
+        incremental=incremental,
+        profile=profile,
+        recompile=recompile,
+    )
+    if ingestion_cache:
+        ingestion_cache.evict()
+
+    print(batch.format_statuses(statuses))
+    batch.write_statuses(statuses, output_dir)
+
+    failed = [_.run_name for _ in statuses if _.status != "ok"]
+    if failed:
+        logger.error(f"{len(failed)} of {len(runs)} runs failed: {', '.join(failed)}")
+        raise typer.Exit(code=1)
+    logger.success(f"Done - rendered {len(runs)} reports in {output_dir}")
+
+
+@app.command("convert-msa")
+def convert_msa_cli(
+    msa_dir: Annotated[
+        Path,
+        typer.Argument(
+            help="Directory containing aligned FASTA files.",
+            file_okay=False,
+        ),
+    ],
+    output_dir: Annotated[
+        Path,
+        typer.Argument(
+            help="Location where the matrix files are going to be written.",
+            file_okay=False,
+        ),
+    ],
+):
+    from pipeline_report import msa_matrix
+
+    matrices = msa_matrix.convert_msa_dir(msa_dir, output_dir)
+    logger.success(f"Done - {len(matrices)} matrix files in {output_dir}")
+
+
+@app.command("benchmark")
+def benchmark_cli(
+    work_dir: Annotated[
+        Path,
+        typer.Argument(
+            help="Location where the synthetic cohorts and outputs are going to be written.",
+            file_okay=False,
+        ),
+    ],
+    samples: Annotated[
+        list[int], typer.Option(help="Number of samples in a cohort. Can be repeated.")
+    ] = [10],
+    reads_per_sample: Annotated[
+        list[int],
+        typer.Option(help="Number of sequences per sample. Can be repeated."),
+    ] = [1000],
+    alignment_length: Annotated[
+        list[int],
+        typer.Option(help="Width of the post-pipeline alignments. Can be repeated."),
+    ] = [2600],
+    step: Annotated[
+        list[str],
+        typer.Option(
+            help=f"Step to time, one of {', '.join(BENCHMARK_STEPS)}. Can be repeated. Defaults to all."
+        ),
+    ] = None,
+    repeats: Annotated[
+        int, typer.Option(help="Number of times to run each step.", min=1)
+    ] = 1,
+    workers: Annotated[
+        int, typer.Option(help="Number of processes the steps may use.", min=1)
+    ] = 1,
+    seed: Annotated[int, typer.Option(help="Seed for the synthetic data.")] = 0,
+    output: Annotated[
+        Path,
+        typer.Option(
+            help="JSON file to write the results to. Defaults to results.json in the work directory."
+        ),
+    ] = None,
+):
+    from pipeline_report import benchmark
+
+    specs = [
+        benchmark.CohortSpec(n_samples, n_reads, length, seed=seed)
+        for n_samples in samples
+        for n_reads in reads_per_sample
+        for length in alignment_length
+    ]
+    results = benchmark.run_benchmarks(
+        specs, work_dir, steps=step, repeats=repeats, workers=workers
+    )
+    print(benchmark.format_results(results))
+    benchmark.write_results(results, output or work_dir / "results.json")
+
+
+@app.command("benchmark-startup")
+def benchmark_startup_cli(
+    command: Annotated[
+        list[str],
+        typer.Option(
+            help="Arguments to start the CLI with, quoted as one string. Can be repeated. Defaults to the help of each command."
+        ),
+    ] = None,
+    repeats: Annotated[
+        int, typer.Option(help="Number of times to start each command.", min=1)
+    ] = 5,
+    max_seconds: Annotated[
+        float,
+        typer.Option(
+            help="Fail if any command takes longer than this to start.", min=0
+        ),
+    ] = None,
+    output: Annotated[
+        Path, typer.Option(help="JSON file to write the results to.")
+    ] = None,
+):
+    from pipeline_report import benchmark
+
+    results = benchmark.run_startup_benchmarks(command, repeats=repeats)
+    print(benchmark.format_results(results))
+    if output:
+        benchmark.write_results(results, output)
+
+    slow = [_.command for _ in results if max_seconds and _.wall_s > max_seconds]
+    if slow:
+        logger.error(f"Took longer than {max_seconds}s to start: {', '.join(slow)}")
+        raise typer.Exit(code=1)
+
+
 def cli_entrypoint():
     app()
 
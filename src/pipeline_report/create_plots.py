@@ -1,41 +1,150 @@
-import os
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional
 
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 import plotnine as pn
 import polars as pl
 import upsetplot
+from attrs import define
 from loguru import logger
 
-from pipeline_report import utils
+from pipeline_report import parse_data, utils
+from pipeline_report.msa_matrix import MATRIX_SUFFIX, load_msa
 
 # logger.add(sys.stderr, format="{time} {level} {message}", filter="plots", level="INFO")
 
+# The columns each plot reads from its dataframe.
+UPSET_COLUMNS = [
+    "passes_frameshift_filter",
+    "passes_minimum_length_filter",
+    "passes_no_stop_codon_filter",
+    "passes_early_stop_codon_filter",
+]
+UPSET_COUNTS_COLUMNS = ["filter_code", "count"]
+LENGTH_BOXPLOT_COLUMNS = ["sample_id", "nt_length_ungapped", "passes_filter"]
+LENGTH_BOXPLOT_STATS_COLUMNS = [
+    "sample_id",
+    "length_q1",
+    "length_median",
+    "length_q3",
+    "whisker_low",
+    "whisker_high",
+    "outliers",
+]
+BUBBLEPLOT_COLUMNS = ["filename", "pre", "post", "pct_lost"]
+BARPLOT_COLUMNS = ["filename", "post", "pct_lost"]
+
+# The UpSet plot labels of the filters, in the bit order of `parse_data.filter_code_expr`.
+UPSET_FILTER_NAMES = [
+    "Frameshift Filter",
+    "Minimum Length Filter",
+    "No Stop Codon Filter",
+    "Early Stop Codon Filter",
+]
+
+# The resolution plots are drawn at unless configured otherwise, which is enough for print.
+DEFAULT_DPI = 300
+# Layers with more marks than this are dense enough to be worth rasterizing in vector output.
+DENSE_LAYER_MARKS = 1000
+# A smooth colourbar is thousands of shaded triangles in vector output, while as many flat
+# bins look the same at a fraction of the size.
+COLOURBAR = pn.guide_colorbar(display="rectangles")
+
+
+@define
+class PlotOutput:
+    """How the plots are written.
+
+    Attributes:
+        formats (Optional[list[str]]): The formats (by file extension) to write each plot in,
+            next to the output path it's given. Only the format of the output path if None.
+        dpi (Optional[int]): The resolution of raster output, and of rasterized layers in
+            vector output. Each plot's own default if None.
+        rasterize (bool): Whether to draw dense layers as embedded images in vector output,
+            which keeps the files small and quick to render when there are many marks.
+    """
+
+    formats: Optional[list[str]] = None
+    dpi: Optional[int] = None
+    rasterize: bool = True
+
+    def paths(self, output: Path) -> list[Path]:
+        """Returns the files a plot with the given output path is written to."""
+        if not self.formats:
+            return [output]
+        return list(dict.fromkeys(output.with_suffix(f".{_}") for _ in self.formats))
+
+    def resolution(self, default: float = DEFAULT_DPI) -> float:
+        return self.dpi or default
+
+    def is_dense(self, marks: int) -> bool:
+        """Checks whether a layer with this many marks should be rasterized."""
+        return self.rasterize and marks > DENSE_LAYER_MARKS
+
+
+def _save_figure(
+    fig: plt.Figure, output: Path, plot_output: PlotOutput, dpi: float
+) -> None:
+    for path in plot_output.paths(output):
+        logger.info(f"Writing to {path}")
+        fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+
+
+def _save_ggplot(
+    plot: pn.ggplot,
+    output: Path,
+    plot_output: PlotOutput,
+    width: float,
+    height: float,
+) -> None:
+    for path in plot_output.paths(output):
+        logger.info(f"Writing to {path}")
+        pn.ggsave(
+            plot,
+            filename=path,
+            width=width,
+            height=height,
+            dpi=plot_output.resolution(),
+        )
+
 
 def create_msa_gridplot(
-    data: Path, output: Path, width: Optional[int] = 4, height: Optional[int] = None
+    data: Path,
+    output: Path,
+    width: Optional[int] = 4,
+    height: Optional[int] = None,
+    downsample: Optional[Literal["sample", "block"]] = "sample",
+    plot_output: Optional[PlotOutput] = None,
 ) -> None:
     """Produces a grid of zoomed out MSA grids.
 
     Useful for showing a high-level overview of the MSAs produced.
 
     Args:
-        data (Path): A path to a directory containing the FASTA files to draw
+        data (Path): A path to a directory containing the FASTA files (or MSA matrix files)
+            to draw
         output (Path): The path to write the output to
         width (Optional[int]): Number of columns to have in the grid. Defaults to 4
         height (Optional[int]): Unset. Don't use
+        downsample (Optional[Literal["sample", "block"]]): How to shrink each MSA to the size of
+            its panel in pixels while reading it. None draws the full alignments.
+        plot_output (Optional[PlotOutput]): How to write the plot. The grid is drawn at the
+            default figure resolution unless a dpi is set.
     """
     # Create the MSA Grid. Move to new function
+    plot_output = plot_output or PlotOutput()
 
     logger.info("Producing MSA grid plot")
     files = []
-    file_list = [_ for _ in data.glob("*.fasta")]
-    file_list.sort()
+    file_list = utils.input_files(data, ".fasta") + sorted(
+        data.glob(f"*{MATRIX_SUFFIX}")
+    )
 
     for file in file_list:
-        if os.stat(file).st_size > 0:
+        if not utils.input_is_empty(file):
             files.append(file)
 
     if not width:
@@ -53,13 +162,26 @@ def create_msa_gridplot(
         rows = len(files)
 
     fig, ax = plt.subplots(ncols=cols, nrows=rows, squeeze=False)
+    fig_width, fig_height = 13, 25
+    dpi = plot_output.resolution(fig.dpi)
+
+    # Nothing finer than a pixel of a panel can be seen, so don't read more than that.
+    max_rows, max_cols = None, None
+    if downsample and rows:
+        max_rows = int(np.ceil(fig_height * dpi / rows))
+        max_cols = int(np.ceil(fig_width * dpi / cols))
 
     counter = 0
     for col in range(cols):
         for row in range(rows):
             if counter > len(files) - 1:
                 break
-            _, current_msa = utils.msa_to_numpy(files[counter])
+            _, current_msa = load_msa(
+                files[counter],
+                max_rows=max_rows,
+                max_cols=max_cols,
+                method=downsample or "sample",
+            )
 
             ax[row][col].imshow(current_msa, interpolation="none", cmap="viridis")
             ax[row][col].set_aspect("auto")
@@ -67,95 +189,125 @@ def create_msa_gridplot(
             ax[row][col].set_title(files[counter].stem[:6])
             counter += 1
 
-    fig.set_size_inches(13, 25)
+    fig.set_size_inches(fig_width, fig_height)
     fig.tight_layout()
-
-    logger.info(f"Writing to {output}")
-    fig.savefig(output)
+    _save_figure(fig, output, plot_output, dpi)
 
 
-def create_filter_upset_plot(data: pl.DataFrame, output: Path) -> None:
+def create_filter_upset_plot(
+    data: pl.DataFrame, output: Path, plot_output: Optional[PlotOutput] = None
+) -> None:
     """Produces an UpSet plot from the filtering data.
 
+    The plot is drawn from the number of sequences passing each combination of filters, so
+    only the (at most 16) counts are handed to upsetplot.
+
     Args:
-        data (pl.DataFrame): A polars DataFrame with the functional filter data
+        data (pl.DataFrame): A polars DataFrame with the functional filter data, or the counts
+            from `parse_data.filter_combination_counts`. Counts of several groups (e.g. per
+            sample) are added up.
         output (Path): Path to write the output to
+        plot_output (Optional[PlotOutput]): How to write the plot.
     """
 
     logger.info("Producing UpSet plot")
 
-    upsetdata = upsetplot.from_indicators(
-        data.select(
-            [
-                pl.col("passes_frameshift_filter"),
-                pl.col("passes_minimum_length_filter"),
-                pl.col("passes_no_stop_codon_filter"),
-                pl.col("passes_early_stop_codon_filter"),
-            ]
-        )
-        .rename(
-            {
-                "passes_frameshift_filter": "Frameshift Filter",
-                "passes_minimum_length_filter": "Minimum Length Filter",
-                "passes_no_stop_codon_filter": "No Stop Codon Filter",
-                "passes_early_stop_codon_filter": "Early Stop Codon Filter",
-            }
-        )
-        .to_pandas()
+    if "filter_code" not in data.columns:
+        data = parse_data.filter_combination_counts(data)
+    counts = data.group_by("filter_code").agg(pl.col("count").sum()).sort("filter_code")
+    codes = counts["filter_code"].to_numpy()
+
+    upsetdata = pd.Series(
+        counts["count"].to_numpy(),
+        index=pd.MultiIndex.from_arrays(
+            [(codes >> bit & 1).astype(bool) for bit in range(len(UPSET_FILTER_NAMES))],
+            names=UPSET_FILTER_NAMES,
+        ),
     )
     fig = plt.figure()
     upsetplot.UpSet(
         upsetdata,
-        subset_size="count",
+        subset_size="sum",
         show_counts=True,
         sort_by="cardinality",
         element_size=50,
     ).plot(fig)
+    plot_output = plot_output or PlotOutput()
+    _save_figure(fig, output, plot_output, plot_output.resolution())
 
-    logger.info(f"Writing to {output}")
-    fig.savefig(output, dpi=1200)
-    fig.savefig(output.with_suffix(".svg"), dpi=1200)
 
-
-def create_seq_length_boxplot(data: pl.DataFrame, output: Path) -> None:
+def create_seq_length_boxplot(
+    data: pl.DataFrame, output: Path, plot_output: Optional[PlotOutput] = None
+) -> None:
     """Produces a boxplot of sequence length for each file
 
+    The boxes are drawn from per-sample statistics rather than from every sequence, so the
+    plot doesn't grow with the number of sequences.
+
     Args:
-        data (pl.DataFrame): A dataframe containing the results from the functional filter
+        data (pl.DataFrame): A dataframe containing the results from the functional filter, or
+            the statistics from `parse_data.length_boxplot_stats`.
         output (Path): The path to write the output to
+        plot_output (Optional[PlotOutput]): How to write the plot. The outliers are
+            rasterized when there are many of them.
     """
     logger.info("Producing sequence length boxplot")
+    plot_output = plot_output or PlotOutput()
+    if "whisker_low" in data.columns:
+        stats = data.filter(pl.col("length_median").is_not_null()).sort("sample_id")
+    else:
+        stats = parse_data.length_boxplot_stats(data)
+    outliers = (
+        stats.select("sample_id", "outliers")
+        .explode("outliers")
+        .drop_nulls()
+        .rename({"outliers": "nt_length_ungapped"})
+    )
+
     length_boxplot = (
         pn.ggplot(
-            data.sort(by="sample_id").filter(pl.col("passes_filter")),
-            pn.aes(y="nt_length_ungapped", x="sample_id", color="sample_id"),
+            stats.drop("outliers"),
+            pn.aes(
+                x="sample_id",
+                lower="length_q1",
+                middle="length_median",
+                upper="length_q3",
+                ymin="whisker_low",
+                ymax="whisker_high",
+                color="sample_id",
+            ),
+        )
+        + pn.geom_boxplot(stat="identity")
+        + pn.geom_point(
+            pn.aes(x="sample_id", y="nt_length_ungapped", color="sample_id"),
+            data=outliers,
+            inherit_aes=False,
+            size=1.5,
+            stroke=0.5,
+            raster=plot_output.is_dense(outliers.height),
         )
-        + pn.geom_boxplot()
         + pn.labs(y="Sequence Nucleotide Length (without gaps)", x="Sample")
         + pn.coord_flip()
         + pn.theme_classic()
         + pn.theme(legend_position="none")
     )
 
-    logger.info(f"Writing to {output}")
-    pn.ggsave(length_boxplot, filename=output, width=8.27, height=11.69, dpi=1200)
-    pn.ggsave(
-        length_boxplot,
-        filename=output.with_suffix(".svg"),
-        width=8.27,
-        height=11.69,
-        dpi=1200,
-    )
+    _save_ggplot(length_boxplot, output, plot_output, width=8.27, height=11.69)
 
 
-def create_seq_count_bubbleplot(data: pl.DataFrame, output: Path) -> None:
+def create_seq_count_bubbleplot(
+    data: pl.DataFrame, output: Path, plot_output: Optional[PlotOutput] = None
+) -> None:
     """Produces a bubbleplot showing sequence count before and after being run through the pipeline
 
     Args:
         data (pl.DataFrame): A dataframe with sequence attrition data
         output (Path): The path to save the plot to.
+        plot_output (Optional[PlotOutput]): How to write the plot. The points are rasterized
+            when there are many samples.
     """
     logger.info("Producing sequence count bubbleplot")
+    plot_output = plot_output or PlotOutput()
     seq_attrition_bubble_plot = (
         pn.ggplot(
             data.with_columns(
@@ -165,7 +317,7 @@ def create_seq_count_bubbleplot(data: pl.DataFrame, output: Path) -> None:
             ),
             pn.aes(x="pre", y="post", size="pct_lost", fill="pct_lost"),
         )
-        + pn.geom_point()
+        + pn.geom_point(raster=plot_output.is_dense(data.height))
         + pn.geom_label(pn.aes(label="label"), nudge_y=0.2)
         + pn.scale_x_log10()
         + pn.scale_y_log10()
@@ -175,40 +327,39 @@ def create_seq_count_bubbleplot(data: pl.DataFrame, output: Path) -> None:
             fill="Percent Lost",
         )
         + pn.scale_size(guide=None)
+        + pn.guides(fill=COLOURBAR)
         + pn.theme_bw()
         + pn.theme(legend_position="top")
     )
-    logger.info(f"Writing to {output}")
-    pn.ggsave(seq_attrition_bubble_plot, filename=output, width=8, height=6, dpi=1200)
-    pn.ggsave(
-        seq_attrition_bubble_plot,
-        filename=output.with_suffix(".svg"),
-        width=8,
-        height=6,
-        dpi=1200,
-    )
+    _save_ggplot(seq_attrition_bubble_plot, output, plot_output, width=8, height=6)
 
 
-def create_seq_count_barplot(data: pl.DataFrame, output: Path) -> None:
+def create_seq_count_barplot(
+    data: pl.DataFrame, output: Path, plot_output: Optional[PlotOutput] = None
+) -> None:
     """Produces a barplot of sequence count post-pipeline run for each sample.
 
     Args:
         data (pl.DataFrame): Dataframe with attrition data.
         output (Path): Path to save the plot to.
+        plot_output (Optional[PlotOutput]): How to write the plot. The bars are rasterized
+            when there are many samples.
     """
     logger.info("Creating sequence count bar plot.")
+    plot_output = plot_output or PlotOutput()
     file_size_plot = (
         pn.ggplot(
             data,
             pn.aes(x="filename", y="post", fill="pct_lost"),
         )
-        + pn.geom_col()
+        + pn.geom_col(raster=plot_output.is_dense(data.height))
         + pn.scale_y_log10()
         + pn.labs(
             y="Sequence Count",
             x="Sample",
             fill="Percent Lost",
         )
+        + pn.guides(fill=COLOURBAR)
         + pn.scale_x_discrete(
             limits=data.sort(by="post", descending=False)["filename"].to_list()
         )
@@ -216,12 +367,4 @@ def create_seq_count_barplot(data: pl.DataFrame, output: Path) -> None:
         + pn.coord_flip()
     )
 
-    logger.info(f"Writing plot to {output}")
-    pn.ggsave(file_size_plot, filename=output, width=8.27, height=11.69, dpi=1200)
-    pn.ggsave(
-        file_size_plot,
-        filename=output.with_suffix(".svg"),
-        width=8.27,
-        height=11.69,
-        dpi=1200,
-    )
+    _save_ggplot(file_size_plot, output, plot_output, width=8.27, height=11.69)
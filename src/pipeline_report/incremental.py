@@ -0,0 +1,198 @@
+import json
+import os
+from pathlib import Path
+from typing import Callable, Optional, TypeVar
+
+import polars as pl
+from attrs import define
+from loguru import logger
+
+from pipeline_report import parse_data, profiling
+from pipeline_report.choices import SampleIDSchema
+
+T = TypeVar("T")
+
+# Bump this whenever the layout of the aggregate tables changes so old stores are rebuilt.
+STORE_VERSION = 5
+
+
+def _source(path: Optional[Path]) -> Optional[str]:
+    return str(path.resolve()) if path else None
+
+
+@define
+class SampleStore:
+    """Per-file aggregates of a run that grows over time, updated from only the changed files.
+
+    A JSON manifest records the size and modification time of every file that has been
+    aggregated. On each update, files that are new or have changed are aggregated again, and
+    the rows of files that were removed are dropped. The aggregates are those of
+    `parse_data.load_pre_post_counts` and `parse_data.load_functional_filter_counts`.
+
+    Attributes:
+        store_dir (Path): The directory the manifest and aggregate tables are kept in.
+    """
+
+    store_dir: Path
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.store_dir / "manifest.json"
+
+    def _read_manifest(
+        self, ref_name: Optional[str], sample_id_schema: SampleIDSchema
+    ) -> dict[str, list[int]]:
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            manifest = json.loads(self.manifest_path.read_text())
+        except ValueError:
+            logger.warning(f"Ignoring unreadable manifest {self.manifest_path}")
+            return {}
+
+        # The counts leave out the reference and carry the fields of the sample IDs, so
+        # they're stale if either changes.
+        if (
+            manifest.get("version") != STORE_VERSION
+            or manifest.get("ref_name") != ref_name
+            or manifest.get("sample_id_schema") != sample_id_schema.value
+        ):
+            logger.info("Aggregates were built differently, rebuilding them")
+            return {}
+        return manifest["files"]
+
+    def _write(self, table: str, df: pl.DataFrame) -> None:
+        partial = self.store_dir / f"{table}.{os.getpid()}.tmp"
+        df.write_parquet(partial)
+        os.replace(partial, self.store_dir / f"{table}.parquet")
+
+    def _update_table(
+        self,
+        table: str,
+        schema: dict[str, pl.DataType],
+        tasks: list[tuple[list[str], T]],
+        stale: set[str],
+        summarise: Callable[[T], pl.DataFrame],
+        workers: int,
+    ) -> pl.DataFrame:
+        """Reruns the tasks covering a stale file and keeps the rows of the others.
+
+        Each task covers one or more source files, and produces the rows for all of them.
+        """
+        table_path = self.store_dir / f"{table}.parquet"
+        existing = pl.DataFrame(schema=schema)
+        if table_path.exists():
+            try:
+                existing = pl.read_parquet(table_path)
+            except (OSError, pl.exceptions.PolarsError) as e:
+                logger.warning(
+                    f"Rebuilding unreadable aggregate table {table_path}: {e}"
+                )
+
+        aggregated = set(existing["source"])
+        fresh = [
+            (sources, task)
+            for sources, task in tasks
+            if any(_ in stale or _ not in aggregated for _ in sources)
+        ]
+        # Rows are kept only for files that are still present and whose task isn't rerun.
+        current = {_ for sources, _task in tasks for _ in sources}
+        redone = {_ for sources, _task in fresh for _ in sources}
+        existing = existing.filter(pl.col("source").is_in(list(current - redone)))
+
+        logger.info(f"Aggregating {len(redone)} new or changed files into {table}")
+        frames = profiling.map_files(
+            summarise, [task for _, task in fresh], workers=workers
+        )
+        df = pl.concat([existing, *frames]).sort("source")
+        self._write(table, df)
+        return df
+
+    def update(
+        self,
+        pre_dir: Path,
+        post_dir: Path,
+        functional_filter_dir: Path,
+        ref_name: Optional[str],
+        workers: int = 1,
+        sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+    ) -> tuple[pl.DataFrame, pl.DataFrame]:
+        """Brings the aggregates up to date with the files of a run.
+
+        Args:
+            pre_dir (Path): The directory containing the input fasta files.
+            post_dir (Path): The directory containing the output fasta files.
+            functional_filter_dir (Path): The directory containing the functional filter
+                reports.
+            ref_name (Optional[str]): The name of the reference to leave out of the counts.
+            workers (int): The number of processes to read the changed files with.
+            sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the files
+                are named after.
+
+        Returns:
+            tuple[pl.DataFrame, pl.DataFrame]: The pre/post counts
+                (`parse_data.PRE_POST_COUNTS_SCHEMA`) and the functional filter counts
+                (`parse_data.FUNCTIONAL_FILTER_COUNTS_SCHEMA`), one row per file.
+
+        Raises:
+            ValueError: If any of the FASTA file or report names don't follow the sample ID
+                schema.
+        """
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self._read_manifest(ref_name, sample_id_schema)
+
+        # The pre and post files of a sample are aggregated together, so a change to either
+        # redoes both.
+        fasta_tasks = [
+            ([_source(_.path) for _ in (pre, post) if _], (pre, post, ref_name))
+            for pre, post in parse_data.sample_files(
+                pre_dir, post_dir, sample_id_schema
+            )
+        ]
+        reports, _ = parse_data.functional_filter_reports(
+            functional_filter_dir, sample_id_schema
+        )
+        report_tasks = [([_source(_)], _) for _ in reports]
+
+        files: dict[str, list[int]] = {}
+        for sources, _ in fasta_tasks + report_tasks:
+            for source in sources:
+                stat = Path(source).stat()
+                files[source] = [stat.st_size, stat.st_mtime_ns]
+        stale = {_ for _ in files if manifest.get(_) != files[_]}
+        removed = set(manifest) - set(files)
+        logger.info(
+            f"{len(stale)} files are new or changed and {len(removed)} were removed "
+            f"since the last update"
+        )
+
+        pre_post_counts = self._update_table(
+            "pre_post_counts",
+            parse_data.PRE_POST_COUNTS_SCHEMA,
+            fasta_tasks,
+            stale,
+            parse_data.summarise_sample_files,
+            workers,
+        )
+        functional_filter_counts = self._update_table(
+            "functional_filter_counts",
+            parse_data.FUNCTIONAL_FILTER_COUNTS_SCHEMA,
+            report_tasks,
+            stale,
+            parse_data.summarise_functional_filter_report,
+            workers,
+        )
+
+        # Written last, so an interrupted update is redone on the next run.
+        self.manifest_path.write_text(
+            json.dumps(
+                {
+                    "version": STORE_VERSION,
+                    "ref_name": ref_name,
+                    "sample_id_schema": sample_id_schema.value,
+                    "files": files,
+                },
+                indent=4,
+            )
+        )
+        return pre_post_counts, functional_filter_counts
@@ -0,0 +1,315 @@
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import polars as pl
+from attrs import define
+from loguru import logger
+
+from pipeline_report import parse_data, profiling, utils
+from pipeline_report.choices import DataFormat, SampleIDSchema
+
+# What happened to each read, from its pre file through to the functional filter.
+FATES = ["removed", "failed_filter", "passed_filter", "not_filtered", "unmatched"]
+FATE = pl.Enum(FATES)
+
+# One row per read. Reads are keyed on their position in the pre file of their sample, and
+# post reads missing from the pre file have no key and the fate "unmatched".
+LINEAGE_SCHEMA = {
+    "sample_id": pl.String,
+    "read_key": pl.UInt32,
+    "name": pl.String,
+    "length": pl.UInt32,
+    "in_post": pl.Boolean,
+    "filter_code": pl.UInt8,
+    "passes_filter": pl.Boolean,
+    "fate": FATE,
+}
+
+
+@define
+class ReadIndex:
+    """Interns the read IDs of a sample into integer keys.
+
+    The key of a read is its position in the sample's pre file. IDs are looked up through a
+    sorted array of their 64-bit hashes, so the index holds no strings and everything joined
+    through it is joined on integers. Duplicated IDs get the key of their first occurrence.
+
+    Attributes:
+        hashes (np.ndarray): The sorted hashes of the read IDs.
+        keys (np.ndarray): The key of the read behind each hash.
+    """
+
+    hashes: np.ndarray
+    keys: np.ndarray
+
+    @classmethod
+    def from_names(cls, names: pl.Series) -> "ReadIndex":
+        """Builds the index of a sample from the read IDs of its pre file, in file order."""
+        hashes = names.hash(seed=0).to_numpy()
+        order = np.argsort(hashes, kind="stable")
+        return cls(hashes[order], order.astype(np.uint32))
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def lookup(self, names: pl.Series) -> np.ndarray:
+        """Finds the keys of some read IDs.
+
+        Args:
+            names (pl.Series): The read IDs.
+
+        Returns:
+            np.ndarray: The key of each read ID, or -1 if it isn't in the index.
+        """
+        if not len(self):
+            return np.full(len(names), -1, dtype=np.int64)
+
+        hashes = names.hash(seed=0).to_numpy()
+        positions = np.searchsorted(self.hashes, hashes).clip(max=len(self) - 1)
+        found = self.hashes[positions] == hashes
+        return np.where(found, self.keys[positions].astype(np.int64), -1)
+
+
+def _read_fasta_names(
+    fasta: Optional[Path], ref_name: Optional[str]
+) -> tuple[pl.Series, np.ndarray]:
+    if fasta is None or utils.input_is_empty(fasta):
+        return pl.Series("name", [], dtype=pl.String), np.empty(0, dtype=np.uint32)
+
+    with utils.open_input(fasta) as handle:
+        names, lengths = utils.scan_fasta_stats(handle)
+    lengths = lengths.astype(np.uint32)
+    names = pl.Series("name", names, dtype=pl.String)
+    if ref_name:
+        keep = (names != ref_name).to_numpy()
+        names, lengths = names.filter(keep), lengths[keep]
+    return names, lengths
+
+
+def _read_filter_codes(report: Optional[Path]) -> pl.DataFrame:
+    if report is None:
+        return pl.DataFrame(
+            schema={
+                "name": pl.String,
+                "filter_code": pl.UInt8,
+                "passes_filter": pl.Boolean,
+            }
+        )
+    return (
+        parse_data.scan_functional_filter_report(report)
+        .select(
+            pl.col("seq_name").alias("name"),
+            parse_data.filter_code_expr(),
+            "passes_filter",
+        )
+        .collect()
+    )
+
+
+def _fate_expr() -> pl.Expr:
+    return (
+        pl.when(pl.col("read_key").is_null())
+        .then(pl.lit("unmatched"))
+        .when(~pl.col("in_post"))
+        .then(pl.lit("removed"))
+        .when(pl.col("passes_filter").is_null())
+        .then(pl.lit("not_filtered"))
+        .when(pl.col("passes_filter"))
+        .then(pl.lit("passed_filter"))
+        .otherwise(pl.lit("failed_filter"))
+        .cast(FATE)
+        .alias("fate")
+    )
+
+
+def sample_lineage(
+    task: tuple[Optional[Path], Optional[Path], Optional[Path], Optional[str]],
+) -> pl.DataFrame:
+    """Follows every read of one sample from its pre file through to the functional filter.
+
+    The pre file is interned into a `ReadIndex`, and the post file and the filter report are
+    mapped onto its keys, so only the read IDs of the pre file are held as strings.
+
+    Args:
+        task (tuple[Optional[Path], Optional[Path], Optional[Path], Optional[str]]): The pre
+            file, post file and functional filter report of the sample, any of which may be
+            missing, and the name of the reference sequence to ignore.
+
+    Returns:
+        pl.DataFrame: One row per read, matching `LINEAGE_SCHEMA`.
+    """
+    pre, post, report, ref_name = task
+    sample_id = utils.sample_id_from_path(pre or post)
+    pre_names, pre_lengths = _read_fasta_names(pre, ref_name)
+    post_names, _ = _read_fasta_names(post, ref_name)
+    filter_codes = _read_filter_codes(report)
+    index = ReadIndex.from_names(pre_names)
+
+    post_keys = index.lookup(post_names)
+    in_post = np.zeros(len(index), dtype=bool)
+    in_post[post_keys[post_keys >= 0]] = True
+
+    report_keys = index.lookup(filter_codes["name"])
+    matched = report_keys >= 0
+    filter_code = pl.repeat(None, len(index), dtype=pl.UInt8, eager=True)
+    passes_filter = pl.repeat(None, len(index), dtype=pl.Boolean, eager=True)
+    if matched.any():
+        filter_code = filter_code.scatter(
+            report_keys[matched], filter_codes["filter_code"].filter(matched)
+        )
+        passes_filter = passes_filter.scatter(
+            report_keys[matched], filter_codes["passes_filter"].filter(matched)
+        )
+
+    reads = pl.DataFrame(
+        {
+            "read_key": np.arange(len(index), dtype=np.uint32),
+            "name": pre_names,
+            "length": pre_lengths,
+            "in_post": in_post,
+            "filter_code": filter_code,
+            "passes_filter": passes_filter,
+        }
+    )
+
+    # Post reads that were never in the pre file should be rare, so these join on the IDs.
+    unmatched = (
+        pl.DataFrame({"name": post_names.filter(post_keys < 0)})
+        .join(filter_codes.filter(~matched), on="name", how="left")
+        .select(
+            pl.lit(None, dtype=pl.UInt32).alias("read_key"),
+            "name",
+            pl.lit(None, dtype=pl.UInt32).alias("length"),
+            pl.lit(True).alias("in_post"),
+            "filter_code",
+            "passes_filter",
+        )
+    )
+    if unmatched.height:
+        logger.warning(f"{unmatched.height} post reads of {sample_id} aren't pre reads")
+
+    return (
+        pl.concat([reads, unmatched])
+        .with_columns(pl.lit(sample_id).alias("sample_id"), _fate_expr())
+        .select(LINEAGE_SCHEMA.keys())
+        .cast(LINEAGE_SCHEMA)
+    )
+
+
+def _write_sample_lineage(
+    task: tuple[Optional[Path], Optional[Path], Optional[Path], Optional[str], Path],
+) -> pl.DataFrame:
+    """Writes the reads of one sample to a Parquet file and returns its survival breakdown."""
+    *sample, part = task
+    reads = sample_lineage(tuple(sample))
+    reads.write_parquet(part)
+    return survival_breakdown(reads)
+
+
+def write_lineage(
+    pre_dir: Path,
+    post_dir: Path,
+    functional_filter_dir: Path,
+    lineage_output: Path,
+    data_format: DataFormat = DataFormat.PARQUET,
+    compression: Optional[str] = None,
+    ref_name: Optional[str] = None,
+    workers: int = 1,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+) -> pl.DataFrame:
+    """Follows every read of a pipeline run from the pre files through to the functional filter.
+
+    Each sample is joined on its own and written to a temporary Parquet file by its worker,
+    which also counts its reads by fate. The files are then streamed into `lineage_output`,
+    so only one sample per worker is held in memory at once.
+
+    Args:
+        pre_dir (Path): The directory containing the input fasta files.
+        post_dir (Path): The directory containing the output fasta files.
+        functional_filter_dir (Path): The directory containing the functional filter reports.
+        lineage_output (Path): The path to write the reads to, one row per read matching
+            `LINEAGE_SCHEMA`.
+        data_format (DataFormat): The file format to write the reads in.
+        compression (Optional[str]): The compression codec to write the reads with.
+        ref_name (Optional[str]): The name of the reference sequence, which is ignored.
+        workers (int): The number of processes to spread the samples over.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the files are
+            named after.
+
+    Returns:
+        pl.DataFrame: The survival breakdown of every sample, as in `survival_breakdown`.
+
+    Raises:
+        ValueError: If any of the file names don't follow the sample ID schema.
+    """
+    reports = {
+        utils.sample_id_from_path(_): _
+        for _ in utils.input_files(functional_filter_dir, ".csv")
+    }
+    pairs = parse_data.sample_file_pairs(pre_dir, post_dir)
+    # Named as the other tables name their samples, so the lineage joins onto them.
+    sample_ids = [utils.sample_id_from_path(pre or post) for pre, post in pairs]
+    utils.parse_sample_ids(sample_ids, sample_id_schema)
+    logger.info(f"Following the reads of {len(pairs)} samples")
+    with tempfile.TemporaryDirectory(
+        prefix="lineage-", dir=lineage_output.parent
+    ) as parts_dir:
+        parts = [Path(parts_dir) / f"{index}.parquet" for index in range(len(pairs))]
+        tasks = [
+            (
+                pre,
+                post,
+                reports.get(sample_id),
+                ref_name,
+                part,
+            )
+            for (pre, post), sample_id, part in zip(pairs, sample_ids, parts)
+        ]
+        breakdowns = profiling.map_files(
+            _write_sample_lineage,
+            tasks,
+            workers=workers,
+            describe=lambda task: (
+                f"lineage:{(task[0] or task[1]).name}",
+                sum(_.stat().st_size for _ in task[:3] if _),
+            ),
+        )
+        reads = pl.scan_parquet(parts) if parts else pl.LazyFrame(schema=LINEAGE_SCHEMA)
+        parse_data.write_table(reads, lineage_output, data_format, compression)
+
+    if not breakdowns:
+        return survival_breakdown(pl.DataFrame(schema=LINEAGE_SCHEMA))
+    return pl.concat(breakdowns).sort("sample_id")
+
+
+def survival_breakdown(lineage: pl.DataFrame) -> pl.DataFrame:
+    """Counts the reads of each sample by fate.
+
+    Args:
+        lineage (pl.DataFrame): The reads, matching `LINEAGE_SCHEMA`.
+
+    Returns:
+        pl.DataFrame: One row per sample, with the number of reads in the pre and post files,
+            the number with each fate, and the percentage of pre reads that made it into the
+            post file and that passed the functional filter.
+    """
+    return (
+        lineage.group_by("sample_id")
+        .agg(
+            num_pre=pl.col("read_key").count(),
+            num_post=pl.col("in_post").sum(),
+            **{f"num_{_}": (pl.col("fate") == _).sum() for _ in FATES},
+        )
+        # Samples with only post reads have no pre reads to take a percentage of.
+        .with_columns(
+            pct_survived=pl.when(pl.col("num_pre") > 0).then(
+                100 * (1 - pl.col("num_removed") / pl.col("num_pre"))
+            ),
+            pct_passed=pl.when(pl.col("num_pre") > 0).then(
+                100 * pl.col("num_passed_filter") / pl.col("num_pre")
+            ),
+        )
+        .sort("sample_id")
+    )
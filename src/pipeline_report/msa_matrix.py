@@ -0,0 +1,264 @@
+import os
+import struct
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy as np
+from loguru import logger
+
+from pipeline_report import utils
+
+MATRIX_SUFFIX = ".msa"
+NAMES_SUFFIX = ".names"
+
+# Magic bytes, format version, the number of rows and columns, then the size and mtime (in
+# ns) of the FASTA file the matrix was written from, all little-endian.
+_MAGIC = b"PRMSA"
+_VERSION = 2
+_HEADER_FORMAT = "<5sB2xQQQq"
+# The matrix starts after a fixed-size header so it stays aligned for memory mapping.
+HEADER_SIZE = 64
+
+
+def names_path(matrix_file: Path) -> Path:
+    """Returns the path of the sequence name index belonging to a matrix file."""
+    return matrix_file.with_suffix(NAMES_SUFFIX)
+
+
+def _read_header(matrix_file: Path) -> tuple[bytes, int, int, int, int, int]:
+    with matrix_file.open("rb") as handle:
+        header = handle.read(struct.calcsize(_HEADER_FORMAT))
+    return struct.unpack(_HEADER_FORMAT, header)
+
+
+def is_current(matrix_file: Path, fasta_file: Path) -> bool:
+    """Checks whether a matrix file was written from the FASTA file as it is now.
+
+    As in the ingestion cache, the FASTA file is taken to be unchanged if its size and
+    modification time are the ones recorded when the matrix was written.
+    """
+    try:
+        magic, version, _rows, _cols, size, mtime_ns = _read_header(matrix_file)
+    except (OSError, struct.error):
+        return False
+    source_stat = fasta_file.stat()
+    return (magic, version, size, mtime_ns) == (
+        _MAGIC,
+        _VERSION,
+        source_stat.st_size,
+        source_stat.st_mtime_ns,
+    )
+
+
+def write_msa_matrix(fasta_file: Path, output: Path) -> Path:
+    """Converts an aligned FASTA file into a fixed-width uint8 matrix file.
+
+    The matrix file holds a small header followed by one row of character codes per sequence.
+    The sequence names are written to a side index with one name per line. Both are written to
+    temporary files first, which are removed if the conversion fails.
+
+    Args:
+        fasta_file (Path): The aligned FASTA file.
+        output (Path): The path to write the matrix file to.
+
+    Returns:
+        Path: The matrix file.
+
+    Raises:
+        ValueError: If the sequences in the file are not all the same length.
+    """
+    partial_matrix = output.with_suffix(f".{os.getpid()}.tmp")
+    partial_names = names_path(output).with_suffix(f".{os.getpid()}.names.tmp")
+    # Taken before reading, so a file that changes during the conversion is converted again.
+    source_stat = fasta_file.stat()
+
+    rows = 0
+    width: Optional[int] = None
+    try:
+        with (
+            utils.open_input(fasta_file) as source,
+            partial_matrix.open("wb") as matrix,
+            partial_names.open("w", encoding="utf-8") as names,
+        ):
+            matrix.seek(HEADER_SIZE)
+            for name, residues in utils.iter_fasta_records(source):
+                if width is None:
+                    width = len(residues)
+                elif len(residues) != width:
+                    raise ValueError(
+                        f"Sequence {name} in {fasta_file} has length {len(residues)}, expected {width}"
+                    )
+                matrix.write(residues.tobytes())
+                names.write(f"{name}\n")
+                rows += 1
+
+            matrix.seek(0)
+            matrix.write(
+                struct.pack(
+                    _HEADER_FORMAT,
+                    _MAGIC,
+                    _VERSION,
+                    rows,
+                    width or 0,
+                    source_stat.st_size,
+                    source_stat.st_mtime_ns,
+                )
+            )
+
+        os.replace(partial_names, names_path(output))
+        os.replace(partial_matrix, output)
+    finally:
+        # Only left behind if the conversion failed part of the way through.
+        partial_names.unlink(missing_ok=True)
+        partial_matrix.unlink(missing_ok=True)
+    logger.debug(f"Wrote {rows}x{width or 0} matrix for {fasta_file} to {output}")
+
+    return output
+
+
+def load_msa_matrix(matrix_file: Path) -> tuple[list[str], np.ndarray]:
+    """Memory-maps a matrix file written by `write_msa_matrix`.
+
+    Args:
+        matrix_file (Path): The matrix file.
+
+    Returns:
+        tuple[list[str], np.ndarray]: The sequence names and a read-only uint8 memory map of the
+            alignment, which can be sliced without reading the whole file.
+
+    Raises:
+        ValueError: If the file is not a matrix file of a supported version.
+    """
+    magic, version, rows, cols, _size, _mtime_ns = _read_header(matrix_file)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f"{matrix_file} is not a version {_VERSION} MSA matrix file")
+
+    names = names_path(matrix_file).read_text(encoding="utf-8").splitlines()
+
+    # numpy can't memory-map an empty region.
+    if rows * cols == 0:
+        return names, np.empty((rows, cols), dtype=np.uint8)
+
+    matrix = np.memmap(
+        matrix_file, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(rows, cols)
+    )
+    return names, matrix
+
+
+def downsample_matrix(
+    matrix: np.ndarray,
+    max_rows: Optional[int] = None,
+    max_cols: Optional[int] = None,
+    method: Literal["sample", "block"] = "sample",
+) -> np.ndarray:
+    """Shrinks an alignment matrix, reading only the rows that are needed.
+
+    Args:
+        matrix (np.ndarray): The alignment, usually a memory map from `load_msa_matrix`.
+        max_rows (Optional[int]): The maximum number of rows to return. All rows if None.
+        max_cols (Optional[int]): The maximum number of columns to return. All columns if None.
+        method (Literal["sample", "block"]): Either keep evenly spaced rows and columns, or
+            average the character codes in blocks of the alignment.
+
+    Returns:
+        np.ndarray: The downsampled uint8 alignment.
+    """
+    rows, cols = matrix.shape
+    row_targets = utils.downsample_targets(rows, max_rows or rows, method)
+    col_targets = utils.downsample_targets(cols, max_cols or cols, method)
+
+    if method == "sample":
+        return np.asarray(
+            matrix[np.flatnonzero(row_targets >= 0)][
+                :, np.flatnonzero(col_targets >= 0)
+            ]
+        )
+
+    row_starts = np.flatnonzero(np.diff(row_targets, prepend=-1))
+    col_starts = np.flatnonzero(np.diff(col_targets, prepend=-1))
+    row_sizes = np.diff(np.append(row_starts, rows))
+    col_sizes = np.diff(np.append(col_starts, cols))
+
+    out = np.empty((len(row_starts), len(col_starts)), dtype=np.uint8)
+    for i, (start, size) in enumerate(zip(row_starts, row_sizes)):
+        # Slicing a memory map is zero-copy, so only one block of rows is read at a time.
+        block = np.add.reduceat(
+            matrix[start : start + size], col_starts, axis=1, dtype=np.uint64
+        )
+        out[i] = (block.sum(axis=0, dtype=np.float64) / (size * col_sizes)).round()
+
+    return out
+
+
+def load_msa(
+    msa_file: Path,
+    max_rows: Optional[int] = None,
+    max_cols: Optional[int] = None,
+    method: Literal["sample", "block"] = "sample",
+) -> tuple[list[str], np.ndarray]:
+    """Loads an alignment from either an aligned FASTA file or a matrix file.
+
+    Args:
+        msa_file (Path): The alignment, as FASTA or as a matrix file (by its suffix).
+        max_rows (Optional[int]): The maximum number of rows to return. All rows if None.
+        max_cols (Optional[int]): The maximum number of columns to return. All columns if None.
+        method (Literal["sample", "block"]): How to downsample the alignment.
+
+    Returns:
+        tuple[list[str], np.ndarray]: The names and the uint8 alignment. When downsampling with
+            "block", the names are those of the first sequence in each block.
+    """
+    if msa_file.suffix != MATRIX_SUFFIX:
+        return utils.msa_to_numpy(msa_file, max_rows, max_cols, method)
+
+    names, matrix = load_msa_matrix(msa_file)
+    if not (max_rows or max_cols):
+        return names, matrix
+
+    row_targets = utils.downsample_targets(len(names), max_rows or len(names), method)
+    if method == "sample":
+        kept_rows = np.flatnonzero(row_targets >= 0)
+    else:
+        kept_rows = np.flatnonzero(np.diff(row_targets, prepend=-1))
+
+    return [names[_] for _ in kept_rows], downsample_matrix(
+        matrix, max_rows, max_cols, method
+    )
+
+
+def convert_msa_dir(
+    source_dir: Path, output_dir: Path, suffix: str = ".fasta"
+) -> list[Path]:
+    """Converts every aligned FASTA file in a directory into a matrix file.
+
+    FASTA files are not converted again if their size and modification time are the ones
+    recorded in their matrix file. Matrix files for FASTA files that are missing or empty are
+    removed.
+
+    Args:
+        source_dir (Path): The directory containing the aligned FASTA files.
+        output_dir (Path): The directory to write the matrix files to.
+        suffix (str): The file type of the FASTA files, which may also be compressed.
+
+    Returns:
+        list[Path]: The matrix files, sorted by name.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    matrices = []
+    for fasta_file in utils.input_files(source_dir, suffix):
+        matrix_file = (
+            output_dir / f"{utils.uncompressed_path(fasta_file).stem}{MATRIX_SUFFIX}"
+        )
+        if utils.input_is_empty(fasta_file):
+            continue
+
+        if not is_current(matrix_file, fasta_file):
+            write_msa_matrix(fasta_file, matrix_file)
+        matrices.append(matrix_file)
+
+    for stale in set(output_dir.glob(f"*{MATRIX_SUFFIX}")) - set(matrices):
+        logger.debug(f"Removing {stale}, which no longer has a source alignment")
+        stale.unlink()
+        names_path(stale).unlink(missing_ok=True)
+
+    return matrices
@@ -1,135 +1,1049 @@
 import os
+from itertools import repeat
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import matplotlib.pyplot as plt
 import numpy as np
 import polars as pl
-from attrs import asdict, define
+from attrs import define
 from loguru import logger
 
-from pipeline_report import utils
+from pipeline_report import profiling, utils
+from pipeline_report.cache import IngestionCache
+from pipeline_report.choices import DataFormat, SampleIDSchema
+from pipeline_report.msa_matrix import NAMES_SUFFIX, load_msa
+from pipeline_report.prefetch import Prefetcher
+
+if TYPE_CHECKING:
+    from pipeline_report.incremental import SampleStore
 
 # logger.add(sys.stderr, format="{time} {level} {message}", level="INFO")
 
 
+# Compression codecs polars supports for each of the columnar formats.
+DATA_COMPRESSIONS = {
+    DataFormat.PARQUET: ["uncompressed", "snappy", "gzip", "lz4", "zstd", "brotli"],
+    DataFormat.IPC: ["uncompressed", "lz4", "zstd"],
+    DataFormat.CSV: ["uncompressed"],
+}
+
+# Low-cardinality string columns that are dictionary-encoded in the columnar formats.
+DICTIONARY_COLUMNS = [
+    "filename",
+    "pool",
+    "visit",
+    "participant",
+    "pipeline_point",
+    "sample_id",
+    "cap_id",
+    "visit_id",
+]
+
+
+@define
+class ReportSummary:
+    file_count_pre: int
+    file_count_post: int
+    seq_count_pre: int
+    seq_count_post: int
+    seq_count_lost: int
+    pct_seqs_lost: float
+
+
 @define
 class PipelineData:
     pre_post_df: pl.DataFrame
-    functional_filter_df: pl.DataFrame
+    functional_filter_df: Optional[pl.DataFrame]
     attrition_df: pl.DataFrame
+    summary: ReportSummary
+    functional_filter_counts_df: Optional[pl.DataFrame] = None
+    pre_post_files_df: Optional[pl.DataFrame] = None
+
+
+FUNCTIONAL_FILTER_SCHEMA = {
+    "seq_name": pl.String,
+    "num_stop_codons": pl.Int64,
+    "nt_length_ungapped": pl.Int64,
+    "nt_length_gapped": pl.Int64,
+    "divisible_by_3": pl.Boolean,
+    "earliest_stop_codon": pl.Int64,
+    "earliest_stop_pct": pl.Float64,
+    "loss_from_median": pl.Float64,
+    "longest_gap_length": pl.Float64,
+    "longest_gap_location": pl.Float64,
+    "passes_frameshift_filter": pl.Boolean,
+    "passes_minimum_length_filter": pl.Boolean,
+    "passes_no_stop_codon_filter": pl.Boolean,
+    "passes_early_stop_codon_filter": pl.Boolean,
+    "flag": pl.String,
+    "passes_filter": pl.Boolean,
+}
+
+# One row per pre/post FASTA file. The per-read table refers to its file by file_id, so the
+# file metadata is held once per file rather than repeated on every read.
+PRE_POST_FILES_SCHEMA = {
+    "file_id": pl.UInt32,
+    "source": pl.String,
+    "filename": pl.String,
+    "pool": pl.String,
+    "visit": pl.String,
+    "participant": pl.String,
+    "pipeline_point": utils.PIPELINE_POINT,
+}
+# The metadata columns that are stored as Enums of the values in each run. Unlike
+# Categoricals, Enums can be joined onto the reads in the streaming engine without a global
+# string cache, and they sort by value.
+FILE_METADATA_COLUMNS = ["filename", "pool", "visit", "participant"]
+PRE_POST_READS_SCHEMA = {"file_id": pl.UInt32, **utils.FASTA_READS_SCHEMA}
+# The columns of the per-read table written to the report data, with the file metadata.
+PRE_POST_COLUMNS = [
+    "name",
+    "length",
+    "pool",
+    "visit",
+    "participant",
+    "pipeline_point",
+    "filename",
+]
+
+
+def read_pre_post_file(
+    fasta_file: Path,
+    pipeline_point: str,
+    cache: Optional[IngestionCache] = None,
+    data: Optional[bytes] = None,
+    sequencing_file: Optional[utils.SequencingFile] = None,
+) -> pl.DataFrame:
+    """Reads the sequence stats of a single file from the start or end of a pipeline run.
+
+    Args:
+        fasta_file (Path): The FASTA file to read.
+        pipeline_point (str): Either "pre" or "post".
+        cache (Optional[IngestionCache]): A cache of previously parsed files to use.
+        data (Optional[bytes]): The raw contents of the file, if they have already been read.
+        sequencing_file (Optional[SequencingFile]): Metadata about the file, parsed from its
+            name if not given.
+
+    Returns:
+        pl.DataFrame: One row per sequence in the file, matching `utils.FASTA_READS_SCHEMA`.
+    """
+    file_info = sequencing_file or utils.get_file_info_from_name(
+        fasta_file, pipeline_point
+    )
 
+    def parse() -> pl.DataFrame:
+        return utils.read_fasta_reads(fasta_file, data=data)
 
-def load_pre_post_files(pre_dir: Path, post_dir: Path, ref_name: str):
+    df = cache.load(fasta_file, pipeline_point, parse) if cache else parse()
+    logger.debug(f"Read {pipeline_point} file {file_info.name} (length: {df.height})")
+    return df
+
+
+def _read_pre_post_task(
+    task: tuple[int, utils.SequencingFile, Optional[IngestionCache], Optional[bytes]],
+) -> pl.DataFrame:
+    file_id, file_info, cache, data = task
+    df = read_pre_post_file(
+        file_info.path, file_info.pipeline_point, cache, data, file_info
+    )
+    return df.select(
+        pl.lit(file_id, dtype=pl.UInt32).alias("file_id"), *utils.FASTA_READS_SCHEMA
+    )
+
+
+def pre_post_file_table(files: list[utils.SequencingFile]) -> pl.DataFrame:
+    """Builds the metadata table of the pre and post files, numbering them in order.
+
+    Args:
+        files (list[SequencingFile]): The files.
+
+    Returns:
+        pl.DataFrame: One row per file, matching `PRE_POST_FILES_SCHEMA` except that the
+            `FILE_METADATA_COLUMNS` are Enums.
+    """
+    df = pl.DataFrame(
+        {
+            "file_id": range(len(files)),
+            "source": [str(_.path.resolve()) for _ in files],
+            "filename": [_.name for _ in files],
+            "pool": [_.pool for _ in files],
+            "visit": [_.visit for _ in files],
+            "participant": [_.participant for _ in files],
+            "pipeline_point": [_.pipeline_point for _ in files],
+        },
+        schema=PRE_POST_FILES_SCHEMA,
+    )
+    return df.with_columns(
+        pl.col(_).cast(pl.Enum(df[_].unique().sort().drop_nulls()))
+        for _ in FILE_METADATA_COLUMNS
+    )
+
+
+def join_pre_post_files(reads: pl.DataFrame, files: pl.DataFrame) -> pl.LazyFrame:
+    """Puts the file metadata back onto every read, for when a flat table is needed.
+
+    Args:
+        reads (pl.DataFrame): The reads, matching `PRE_POST_READS_SCHEMA`.
+        files (pl.DataFrame): The files, matching `PRE_POST_FILES_SCHEMA`.
+
+    Returns:
+        pl.LazyFrame: One row per read with the `PRE_POST_COLUMNS`, in the order of `reads`.
+    """
+    return (
+        reads.lazy()
+        .join(files.lazy(), on="file_id", how="left", maintain_order="left")
+        .select(PRE_POST_COLUMNS)
+    )
+
+
+def load_pre_post_files(
+    pre_dir: Path,
+    post_dir: Path,
+    ref_name: str,
+    workers: int = 1,
+    cache: Optional[IngestionCache] = None,
+    prefetcher: Optional[Prefetcher] = None,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+) -> tuple[pl.DataFrame, pl.DataFrame]:
     """Parses files from the start and end points of a pipeline run.
 
     Given a set oif files fed into a pipeline run and a set of files that come out of a pipeline
     run, load all of their sequences and some stats about those sequences into a dataframe.
 
+    The metadata of each file is kept in a separate table rather than repeated on every
+    sequence, and `join_pre_post_files` combines the two when a flat table is needed.
+
     Args:
         pre_dir (Path): The directory containing the input fasta files.
         post_dir (Path): The directory containing the output fasta files.
+        workers (int): The number of processes to read the files with.
+        cache (Optional[IngestionCache]): A cache of previously parsed files to use.
+        prefetcher (Optional[Prefetcher]): Reads the files that aren't cached ahead of their
+            parsing. Each file is read when it is parsed if None.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the files are
+            named after.
 
     Returns:
-        pl.DataFrame: A dataframe matching sequences from before and after the pipeline was run.
+        tuple[pl.DataFrame, pl.DataFrame]: The sequences from before and after the pipeline
+            was run (`PRE_POST_READS_SCHEMA`) and the files they came from
+            (`PRE_POST_FILES_SCHEMA`).
+
+    Raises:
+        ValueError: If any of the file names don't follow the sample ID schema.
     """
-    df_data = []
-    files = []
+    # Every name is parsed up front, so a malformed one fails the run before any reading.
+    pre_files = utils.get_files_info(
+        utils.input_files(pre_dir, ".fasta"), "pre", sample_id_schema
+    )
+    post_files = utils.get_files_info(
+        utils.input_files(post_dir, ".fasta"), "post", sample_id_schema
+    )
+
+    names = {_.name for _ in pre_files}
+    for file_info in post_files:
+        if file_info.name not in names:
+            logger.error("This should never happen...")
 
-    logger.info("Loading all the pre files")
-    for fasta_file in pre_dir.glob("*.fasta"):
-        file_info = utils.get_file_info_from_name(fasta_file, "pre")
-        files.append(file_info.name)
-        df_data.extend(
-            utils.read_fasta_file(fasta_file, "pre", sequencing_file=file_info)
+    logger.info(f"Loading {len(pre_files)} pre files and {len(post_files)} post files")
+    files = pre_files + post_files
+    contents = repeat(None)
+    if prefetcher:
+        points = {_.path: _.pipeline_point for _ in files}
+        contents = (
+            data
+            for _, data in prefetcher.read(
+                [_.path for _ in files],
+                skip=(lambda file: cache.contains(file, points[file]))
+                if cache
+                else None,
+            )
         )
-        logger.debug(f"Read pre file {file_info.name}")
+    tasks = (
+        (file_id, file_info, cache, data)
+        for file_id, (file_info, data) in enumerate(zip(files, contents))
+    )
+    frames = profiling.map_files(
+        _read_pre_post_task,
+        tasks,
+        workers=workers,
+        describe=lambda task: (
+            f"read_{task[1].pipeline_point}:{task[1].path.name}",
+            task[1].path.stat().st_size,
+        ),
+    )
 
-    logger.info("Loading all the post files")
-    for fasta_file in post_dir.glob("*.fasta"):
-        file_info = utils.get_file_info_from_name(fasta_file, "post")
+    logger.info("Combining all the files into one dataframe")
+    with profiling.stage("concat_pre_post") as stage:
+        df = pl.concat(frames)
 
-        if file_info.name not in files:
-            files.append(file_info.name)
-            logger.error("This should never happen...")
+        if ref_name:
+            df = df.filter(pl.col("name") != ref_name)
+        stage.rows = df.height
 
-        df_data.extend(
-            utils.read_fasta_file(fasta_file, "post", sequencing_file=file_info)
-        )
-        logger.debug(f"Read post file {file_info.name} (length: {len(df_data)})")
+    return df, pre_post_file_table(files)
 
-    logger.info("Converting all the information to a dataframe")
-    df = pl.DataFrame([asdict(_) for _ in df_data])
-    df = df.drop("path")
 
-    if ref_name:
-        df = df.filter(pl.col("name") != ref_name)
+def scan_functional_filter_report(
+    report: Path, data: Optional[bytes] = None
+) -> pl.LazyFrame:
+    """Builds a lazy query over the functional filter report of a single sample.
 
+    polars can only scan plain CSV files, so a compressed report is decompressed as a stream
+    and parsed up front instead.
+
+    Args:
+        report (Path): The report CSV file, which may be compressed.
+        data (Optional[bytes]): The raw contents of the report, if they have already been read.
+
+    Returns:
+        pl.LazyFrame: The report, matching `FUNCTIONAL_FILTER_SCHEMA`.
+    """
+    if data is None and utils.input_compression(report) is None:
+        return pl.scan_csv(report, schema=FUNCTIONAL_FILTER_SCHEMA)
+
+    with utils.open_input(report, data=data) as handle:
+        return pl.read_csv(handle, schema=FUNCTIONAL_FILTER_SCHEMA).lazy()
+
+
+def read_functional_filter_report(
+    report: Path, data: Optional[bytes] = None
+) -> pl.DataFrame:
+    """Reads the functional filter report of a single sample.
+
+    Args:
+        report (Path): The report CSV file.
+        data (Optional[bytes]): The raw contents of the report, if they have already been read.
+
+    Returns:
+        pl.DataFrame: The report, with the sample ID taken from the file name.
+    """
+    logger.debug(f"Attempting to load report {report}")
+    df = (
+        scan_functional_filter_report(report, data)
+        .collect()
+        .with_columns(pl.lit(utils.sample_id_from_path(report)).alias("sample_id"))
+    )
+    logger.debug(f"Loaded report {report} successfully")
     return df
 
 
-def load_functional_filter_reports(base_dir: Path):
+def _read_functional_filter_task(task: tuple[Path, Optional[bytes]]) -> pl.DataFrame:
+    return read_functional_filter_report(*task)
+
+
+def _cache_functional_filter_task(
+    task: tuple[Path, IngestionCache, Optional[bytes]],
+) -> Path:
+    report, cache, data = task
+    return cache.ensure(
+        report, "functional_filter", lambda: read_functional_filter_report(report, data)
+    )
+
+
+def functional_filter_reports(
+    base_dir: Path, sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA
+) -> tuple[list[Path], pl.DataFrame]:
+    """Lists the functional filter reports in a directory and parses their sample IDs.
+
+    The IDs are parsed up front, so a malformed name fails the run before any reports are
+    read.
+
+    Args:
+        base_dir (Path): The directory containing the functional filter reports.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the reports
+            are named after.
+
+    Returns:
+        tuple[list[Path], pl.DataFrame]: The reports, and their sample IDs as parsed by
+            `utils.parse_sample_ids`.
+
+    Raises:
+        ValueError: If any of the report names don't follow the sample ID schema.
+    """
+    reports = utils.input_files(base_dir, ".csv")
+    sample_ids = [utils.sample_id_from_path(_) for _ in reports]
+    return reports, utils.parse_sample_ids(sample_ids, sample_id_schema)
+
+
+def scan_functional_filter_reports(
+    base_dir: Path,
+    workers: int = 1,
+    cache: Optional[IngestionCache] = None,
+    prefetcher: Optional[Prefetcher] = None,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+) -> pl.LazyFrame:
+    """Builds a lazy query over all of the functional filter reports from a pipeline run.
+
+    Nothing is read until the query is collected, so only the columns that are eventually
+    selected are parsed. With a cache, any reports that aren't cached yet are parsed up front
+    (using the worker processes) and the query scans the cached Parquet files instead. With a
+    prefetcher, the reports are also parsed up front, as they are read in.
+
+    Args:
+        base_dir (Path): The directory containing the functional filter reports.
+        workers (int): The number of processes to cache new reports with.
+        cache (Optional[IngestionCache]): A cache of previously parsed reports to use.
+        prefetcher (Optional[Prefetcher]): Reads the reports that aren't cached ahead of
+            their parsing.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the reports
+            are named after.
+
+    Returns:
+        pl.LazyFrame: All of the reports concatenated rowwise, with the sample metadata.
+
+    Raises:
+        ValueError: If any of the report names don't follow the sample ID schema.
+    """
+    # The sample IDs are parsed once per report rather than once per row.
+    reports, samples = functional_filter_reports(base_dir, sample_id_schema)
+    samples = samples.select(
+        pl.col("sample_id").cast(pl.String),
+        pl.col("participant").cast(pl.String).alias("cap_id"),
+        pl.col("visit").cast(pl.String).alias("visit_id"),
+        pl.col("pool").cast(pl.String),
+    ).unique("sample_id", maintain_order=True)
+    contents = repeat(None)
+    if prefetcher:
+        contents = (
+            data
+            for _, data in prefetcher.read(
+                reports,
+                skip=(lambda _: cache.contains(_, "functional_filter"))
+                if cache
+                else None,
+            )
+        )
+
+    if cache:
+        logger.info("Caching new reports")
+        entries = profiling.map_files(
+            _cache_functional_filter_task,
+            ((_, cache, data) for _, data in zip(reports, contents)),
+            workers=workers,
+            describe=lambda task: (
+                f"cache_functional_filter:{task[0].name}",
+                task[0].stat().st_size,
+            ),
+        )
+        sources = [pl.scan_parquet(_) for _ in entries]
+    elif prefetcher:
+        frames = profiling.map_files(
+            _read_functional_filter_task,
+            zip(reports, contents),
+            workers=workers,
+            describe=lambda task: (
+                f"read_functional_filter:{task[0].name}",
+                len(task[1]) if task[1] is not None else task[0].stat().st_size,
+            ),
+        )
+        sources = [_.lazy() for _ in frames]
+    else:
+        sources = [
+            scan_functional_filter_report(_).with_columns(
+                pl.lit(utils.sample_id_from_path(_)).alias("sample_id")
+            )
+            for _ in reports
+        ]
+
+    return pl.concat(sources).join(
+        samples.lazy(), on="sample_id", how="left", maintain_order="left"
+    )
+
+
+def load_functional_filter_reports(
+    base_dir: Path,
+    workers: int = 1,
+    cache: Optional[IngestionCache] = None,
+    columns: Optional[list[str]] = None,
+    prefetcher: Optional[Prefetcher] = None,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+):
     """Ingests all of the functional filter reports from all of the samples run through a pipeline into one dataframe.
 
     Args:
         base_dir (Path): The directory containing the functional filter reports.
+        workers (int): The number of processes to cache new reports with.
+        cache (Optional[IngestionCache]): A cache of previously parsed reports to use.
+        columns (Optional[list[str]]): The columns to load. All columns if None.
+        prefetcher (Optional[Prefetcher]): Reads the reports that aren't cached ahead of
+            their parsing.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the reports
+            are named after.
 
     Returns:
         pl.DataFrame: A DataFrame with all of the reports concatenated rowwise.
     """
-    reports: list[pl.DataFrame] = []
     logger.info("Loading reports")
-    for report in base_dir.glob("*.csv"):
-        logger.debug(f"Attempting to load report {report}")
-        sample_id = report.stem.split(".")[0]
-        reports.append(
-            pl.read_csv(
-                report,
-                schema={
-                    "seq_name": pl.String,
-                    "num_stop_codons": pl.Int64,
-                    "nt_length_ungapped": pl.Int64,
-                    "nt_length_gapped": pl.Int64,
-                    "divisible_by_3": pl.Boolean,
-                    "earliest_stop_codon": pl.Int64,
-                    "earliest_stop_pct": pl.Float64,
-                    "loss_from_median": pl.Float64,
-                    "longest_gap_length": pl.Float64,
-                    "longest_gap_location": pl.Float64,
-                    "passes_frameshift_filter": pl.Boolean,
-                    "passes_minimum_length_filter": pl.Boolean,
-                    "passes_no_stop_codon_filter": pl.Boolean,
-                    "passes_early_stop_codon_filter": pl.Boolean,
-                    "flag": pl.String,
-                    "passes_filter": pl.Boolean,
-                },
-            ).with_columns(pl.lit(sample_id).alias("sample_id"))
-        )
-        logger.debug(f"Loaded report for {sample_id} successfully")
-
-    logger.info("Concatenating all the reports.")
-    reports_all = pl.concat(reports)
-
-    # Convert the contents of the sample ID field into CAPID, Visit ID, and pool.
-    # This is ELLPACA-specific but could be parameterised.
-    logger.info("Adding sample metadata from sample name")
-    reports_all = (
-        reports_all.with_columns(
-            pl.col("sample_id")
-            .str.split_exact("-", n=1)
-            .struct.rename_fields(["id_visit", "pool"])
-            .alias("fields")
-        )
-        .unnest("fields")
-        .with_columns(
-            pl.col("id_visit")
-            .str.split_exact("_", n=1)
-            .struct.rename_fields(["cap_id", "visit_id"])
+    reports = scan_functional_filter_reports(
+        base_dir,
+        workers=workers,
+        cache=cache,
+        prefetcher=prefetcher,
+        sample_id_schema=sample_id_schema,
+    )
+    if columns:
+        reports = reports.select(columns)
+
+    return reports.collect(engine="streaming")
+
+
+# Width in nucleotides of the bins of the per-file length histograms.
+LENGTH_BIN_WIDTH = 10
+
+# Per-file aggregates of the pre/post FASTA files, keyed on the resolved path of the file.
+PRE_POST_COUNTS_SCHEMA = {
+    "source": pl.String,
+    "filename": pl.String,
+    "pool": pl.String,
+    "visit": pl.String,
+    "participant": pl.String,
+    "pipeline_point": pl.String,
+    "num_seqs": pl.UInt32,
+    "num_unmatched": pl.UInt32,
+    "length_min": pl.Int64,
+    "length_max": pl.Int64,
+    "length_sum": pl.Int64,
+    "length_histogram": pl.List(pl.UInt32),
+}
+FILTER_FLAGS = [
+    "passes_frameshift_filter",
+    "passes_minimum_length_filter",
+    "passes_no_stop_codon_filter",
+    "passes_early_stop_codon_filter",
+    "passes_filter",
+]
+# The individual filters, in the bit order of the filter combination codes.
+FILTER_CODE_FLAGS = FILTER_FLAGS[:4]
+FILTER_CODES = 1 << len(FILTER_CODE_FLAGS)
+# Per-report aggregates of the functional filter reports, keyed on the resolved path.
+FUNCTIONAL_FILTER_COUNTS_SCHEMA = {
+    "source": pl.String,
+    "sample_id": pl.String,
+    "num_seqs": pl.UInt32,
+    **{_: pl.UInt32 for _ in FILTER_FLAGS},
+    # The number of sequences with each filter code, indexed by the code.
+    "filter_combinations": pl.List(pl.UInt32),
+    "length_min": pl.Int64,
+    "length_q1": pl.Float64,
+    "length_median": pl.Float64,
+    "length_q3": pl.Float64,
+    "length_max": pl.Int64,
+    "whisker_low": pl.Int64,
+    "whisker_high": pl.Int64,
+    "num_outliers": pl.UInt32,
+    "outliers": pl.List(pl.Int64),
+}
+
+# Whiskers reach the furthest lengths within this many interquartile ranges of the box, as
+# in plotnine's stat_boxplot.
+BOXPLOT_WHISKER_IQR = 1.5
+# The most distinct outlier lengths kept per sample for the length boxplot.
+BOXPLOT_MAX_OUTLIERS = 100
+
+
+def filter_code_expr() -> pl.Expr:
+    """Packs the individual filter flags of each sequence into one small integer.
+
+    Bit i of the code is set if the sequence passes the filter `FILTER_CODE_FLAGS[i]`, so the
+    code identifies the combination of filters a sequence passes.
+
+    Returns:
+        pl.Expr: A UInt8 expression named filter_code.
+    """
+    return (
+        pl.sum_horizontal(
+            pl.col(flag).cast(pl.UInt8) * (1 << bit)
+            for bit, flag in enumerate(FILTER_CODE_FLAGS)
+        )
+        .cast(pl.UInt8)
+        .alias("filter_code")
+    )
+
+
+def filter_combination_counts(
+    data: pl.DataFrame | pl.LazyFrame, by: Optional[list[str]] = None
+) -> pl.DataFrame:
+    """Counts the sequences passing each combination of the individual filters.
+
+    Args:
+        data (pl.DataFrame | pl.LazyFrame): Functional filter results with the
+            `FILTER_CODE_FLAGS` columns, or per-report counts matching
+            `FUNCTIONAL_FILTER_COUNTS_SCHEMA`.
+        by (Optional[list[str]]): Columns to count within, e.g. ["sample_id"] for a
+            breakdown per sample. Counts over all the data if None.
+
+    Returns:
+        pl.DataFrame: The by columns, the filter_code (see `filter_code_expr`) and the count
+            of every combination that occurs, sorted by the by columns and the code.
+    """
+    by = by or []
+    data = data.lazy()
+    if "filter_combinations" in data.collect_schema().names():
+        codes = pl.int_range(FILTER_CODES, dtype=pl.UInt8).implode()
+        counts = (
+            data.select(*by, filter_code=codes, count=pl.col("filter_combinations"))
+            .explode("filter_code", "count")
+            .group_by(*by, "filter_code")
+            .agg(pl.col("count").sum())
+            .filter(pl.col("count") > 0)
         )
-        .unnest("id_visit")
+    else:
+        counts = data.group_by(*by, filter_code_expr()).agg(count=pl.len())
+
+    return counts.cast({"count": pl.UInt32}).sort(*by, "filter_code").collect()
+
+
+def length_boxplot_exprs(
+    max_outliers: int = BOXPLOT_MAX_OUTLIERS,
+) -> dict[str, pl.Expr]:
+    """Builds the boxplot statistics of the lengths of the sequences passing the filter.
+
+    The expressions aggregate a functional filter report, so they can be used in a `select`
+    over one sample or a `group_by` over many.
+
+    Args:
+        max_outliers (int): The most outliers to keep. Outliers are deduplicated first, since
+            equal lengths are drawn on top of each other, and then thinned out evenly.
+
+    Returns:
+        dict[str, pl.Expr]: Named expressions giving the quartiles, the whiskers, the number of
+            outlying sequences and a list of the outlying lengths.
+    """
+    length = pl.col("nt_length_ungapped").filter(pl.col("passes_filter"))
+    q1 = length.quantile(0.25, "linear")
+    q3 = length.quantile(0.75, "linear")
+    low = q1 - BOXPLOT_WHISKER_IQR * (q3 - q1)
+    high = q3 + BOXPLOT_WHISKER_IQR * (q3 - q1)
+    outlying = length.filter((length < low) | (length > high))
+
+    return {
+        "length_min": length.min(),
+        "length_q1": q1,
+        "length_median": length.median(),
+        "length_q3": q3,
+        "length_max": length.max(),
+        "whisker_low": length.filter(length >= low).min(),
+        "whisker_high": length.filter(length <= high).max(),
+        "num_outliers": outlying.len(),
+        "outliers": outlying.unique()
+        .sort()
+        .implode()
+        .list.eval(
+            pl.element().filter(
+                (pl.int_range(pl.len()) * max_outliers // pl.len()).is_first_distinct()
+            )
+        ),
+    }
+
+
+def length_boxplot_stats(
+    data: pl.DataFrame | pl.LazyFrame, max_outliers: int = BOXPLOT_MAX_OUTLIERS
+) -> pl.DataFrame:
+    """Computes the length boxplot statistics of every sample in one pass.
+
+    Args:
+        data (pl.DataFrame | pl.LazyFrame): Functional filter results with at least the
+            sample_id, nt_length_ungapped and passes_filter columns.
+        max_outliers (int): The most outliers to keep per sample.
+
+    Returns:
+        pl.DataFrame: One row per sample with sequences passing the filter, sorted by sample.
+    """
+    return (
+        data.lazy()
+        .group_by("sample_id")
+        .agg(**length_boxplot_exprs(max_outliers))
+        .filter(pl.col("length_median").is_not_null())
+        .sort("sample_id")
+        .collect()
     )
 
-    return reports_all
+
+def _summarise_fasta(
+    file_info: utils.SequencingFile,
+    ref_name: Optional[str],
+    pre_names: Optional[np.ndarray] = None,
+) -> tuple[dict, np.ndarray]:
+    """Streams a FASTA file into one row of `PRE_POST_COUNTS_SCHEMA` and its name hashes."""
+    fasta_file = file_info.path
+    num_seqs = 0
+    num_unmatched = 0
+    length_sum = 0
+    length_min: Optional[int] = None
+    length_max: Optional[int] = None
+    histogram = np.zeros(0, dtype=np.int64)
+    hashes = [np.empty(0, dtype=np.uint64)]
+
+    if utils.input_is_empty(fasta_file):
+        # `read_fasta_reads` gives an empty file a single row with a null name, which the
+        # reference filter in `load_pre_post_files` drops.
+        num_seqs = 0 if ref_name else 1
+    else:
+        with utils.open_input(fasta_file) as handle:
+            for names, lengths in utils.iter_fasta_stats(handle):
+                names = pl.Series(names, dtype=pl.String)
+                if ref_name:
+                    keep = (names != ref_name).to_numpy()
+                    names, lengths = names.filter(keep), lengths[keep]
+                if not len(lengths):
+                    continue
+
+                num_seqs += len(lengths)
+                length_sum += int(lengths.sum())
+                low, high = int(lengths.min()), int(lengths.max())
+                length_min = low if length_min is None else min(length_min, low)
+                length_max = high if length_max is None else max(length_max, high)
+
+                counts = np.bincount(lengths // LENGTH_BIN_WIDTH)
+                if len(counts) > len(histogram):
+                    histogram = np.pad(histogram, (0, len(counts) - len(histogram)))
+                histogram[: len(counts)] += counts
+
+                # Names are compared by hash so they never need to be held as strings.
+                name_hashes = names.hash(seed=0).to_numpy()
+                hashes.append(name_hashes)
+                if pre_names is not None:
+                    num_unmatched += int(
+                        np.count_nonzero(~np.isin(name_hashes, pre_names))
+                    )
+
+    row = {
+        "source": str(fasta_file.resolve()),
+        "filename": file_info.name,
+        "pool": file_info.pool,
+        "visit": file_info.visit,
+        "participant": file_info.participant,
+        "pipeline_point": file_info.pipeline_point,
+        "num_seqs": num_seqs,
+        "num_unmatched": None if pre_names is None else num_unmatched,
+        "length_min": length_min,
+        "length_max": length_max,
+        "length_sum": None if length_min is None else length_sum,
+        "length_histogram": histogram.tolist(),
+    }
+    return row, np.unique(np.concatenate(hashes))
+
+
+def summarise_sample_files(
+    task: tuple[
+        Optional[utils.SequencingFile], Optional[utils.SequencingFile], Optional[str]
+    ],
+) -> pl.DataFrame:
+    """Aggregates the pre and post FASTA files of a sample without keeping a row per sequence.
+
+    Both files are streamed. Only the counts, a length histogram and (for the pre file) the
+    hashes of the sequence names are kept, which are used to count the post sequences that
+    don't appear in the pre file.
+
+    Args:
+        task (tuple[Optional[SequencingFile], Optional[SequencingFile], Optional[str]]): The
+            pre file, the post file (either may be missing) and the name of the reference to
+            leave out.
+
+    Returns:
+        pl.DataFrame: One row per file, matching `PRE_POST_COUNTS_SCHEMA`.
+    """
+    pre_file, post_file, ref_name = task
+    rows = []
+    pre_names = np.empty(0, dtype=np.uint64)
+    if pre_file:
+        row, pre_names = _summarise_fasta(pre_file, ref_name)
+        rows.append(row)
+    if post_file:
+        row, _ = _summarise_fasta(post_file, ref_name, pre_names)
+        rows.append(row)
+
+    return pl.DataFrame(rows, schema=PRE_POST_COUNTS_SCHEMA)
+
+
+def sample_file_pairs(
+    pre_dir: Path, post_dir: Path
+) -> list[tuple[Optional[Path], Optional[Path]]]:
+    """Pairs up the pre and post FASTA files of each sample by file name.
+
+    Args:
+        pre_dir (Path): The directory containing the input fasta files.
+        post_dir (Path): The directory containing the output fasta files.
+
+    Returns:
+        list[tuple[Optional[Path], Optional[Path]]]: The pre and post file of each sample,
+            sorted by file name. Either is None if the sample has no such file.
+    """
+    # Compressed and plain files of the same sample are paired on their uncompressed name.
+    pre_files = {
+        utils.uncompressed_path(_).name: _ for _ in utils.input_files(pre_dir, ".fasta")
+    }
+    post_files = {
+        utils.uncompressed_path(_).name: _
+        for _ in utils.input_files(post_dir, ".fasta")
+    }
+    for name in post_files.keys() - pre_files.keys():
+        logger.error(f"Post file {name} has no matching pre file")
+
+    return [
+        (pre_files.get(_), post_files.get(_))
+        for _ in sorted(pre_files.keys() | post_files.keys())
+    ]
+
+
+def sample_files(
+    pre_dir: Path,
+    post_dir: Path,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+) -> list[tuple[Optional[utils.SequencingFile], Optional[utils.SequencingFile]]]:
+    """Pairs up the pre and post FASTA files of each sample and parses their names.
+
+    Args:
+        pre_dir (Path): The directory containing the input fasta files.
+        post_dir (Path): The directory containing the output fasta files.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the files are
+            named after.
+
+    Returns:
+        list[tuple[Optional[SequencingFile], Optional[SequencingFile]]]: The pre and post file
+            of each sample, as in `sample_file_pairs`.
+
+    Raises:
+        ValueError: If any of the file names don't follow the sample ID schema.
+    """
+    pairs = sample_file_pairs(pre_dir, post_dir)
+    # One vectorised parse per pipeline point rather than one per file.
+    columns = []
+    for point, files in zip(("pre", "post"), zip(*pairs) if pairs else ((), ())):
+        present = [_ for _ in files if _]
+        infos = iter(utils.get_files_info(present, point, sample_id_schema))
+        columns.append([next(infos) if _ else None for _ in files])
+
+    return list(zip(*columns))
+
+
+def load_pre_post_counts(
+    pre_dir: Path,
+    post_dir: Path,
+    ref_name: Optional[str],
+    workers: int = 1,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+) -> pl.DataFrame:
+    """Aggregates the files from the start and end points of a pipeline run, one row per file.
+
+    Unlike `load_pre_post_files`, no row is built per sequence, so the memory used grows with
+    the number of files rather than the number of sequences.
+
+    Args:
+        pre_dir (Path): The directory containing the input fasta files.
+        post_dir (Path): The directory containing the output fasta files.
+        ref_name (Optional[str]): The name of the reference to leave out of the counts.
+        workers (int): The number of processes to read the files with.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the files are
+            named after.
+
+    Returns:
+        pl.DataFrame: The per-file counts, matching `PRE_POST_COUNTS_SCHEMA`.
+
+    Raises:
+        ValueError: If any of the file names don't follow the sample ID schema.
+    """
+    tasks = [
+        (pre, post, ref_name)
+        for pre, post in sample_files(pre_dir, post_dir, sample_id_schema)
+    ]
+    logger.info(f"Aggregating the pre and post files of {len(tasks)} samples")
+    frames = profiling.map_files(
+        summarise_sample_files,
+        tasks,
+        workers=workers,
+        describe=lambda task: (
+            f"aggregate:{(task[0] or task[1]).path.name}",
+            sum(_.path.stat().st_size for _ in task[:2] if _),
+        ),
+    )
+    return pl.concat(frames) if frames else pl.DataFrame(schema=PRE_POST_COUNTS_SCHEMA)
+
+
+def summarise_functional_filter_report(report: Path) -> pl.DataFrame:
+    """Aggregates a functional filter report into a single row of counts, streaming the file.
+
+    Args:
+        report (Path): The report CSV file.
+
+    Returns:
+        pl.DataFrame: One row matching `FUNCTIONAL_FILTER_COUNTS_SCHEMA`, with the number of
+            sequences passing each filter and each combination of filters, and the length
+            boxplot statistics of those passing them all.
+    """
+    return (
+        scan_functional_filter_report(report)
+        .select(
+            source=pl.lit(str(report.resolve())),
+            sample_id=pl.lit(utils.sample_id_from_path(report)),
+            num_seqs=pl.len(),
+            **{_: pl.col(_).sum() for _ in FILTER_FLAGS},
+            filter_combinations=pl.concat_list(
+                (filter_code_expr() == code).sum() for code in range(FILTER_CODES)
+            ),
+            **length_boxplot_exprs(),
+        )
+        .cast(FUNCTIONAL_FILTER_COUNTS_SCHEMA)
+        .collect(engine="streaming")
+    )
+
+
+def load_functional_filter_counts(
+    base_dir: Path,
+    workers: int = 1,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+) -> pl.DataFrame:
+    """Aggregates the functional filter reports in a directory, one row per report.
+
+    Args:
+        base_dir (Path): The directory containing the functional filter reports.
+        workers (int): The number of processes to read the reports with.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the reports
+            are named after.
+
+    Returns:
+        pl.DataFrame: The per-report counts, matching `FUNCTIONAL_FILTER_COUNTS_SCHEMA`.
+
+    Raises:
+        ValueError: If any of the report names don't follow the sample ID schema.
+    """
+    reports, _ = functional_filter_reports(base_dir, sample_id_schema)
+    frames = profiling.map_files(
+        summarise_functional_filter_report,
+        reports,
+        workers=workers,
+        describe=lambda report: (f"aggregate:{report.name}", report.stat().st_size),
+    )
+    if not frames:
+        return pl.DataFrame(schema=FUNCTIONAL_FILTER_COUNTS_SCHEMA)
+    return pl.concat(frames)
+
+
+def write_table(
+    df: pl.DataFrame | pl.LazyFrame,
+    output: Path,
+    data_format: DataFormat = DataFormat.PARQUET,
+    compression: Optional[str] = None,
+) -> None:
+    """Writes a table of report data in the given format.
+
+    In the columnar formats the low-cardinality string columns are dictionary-encoded, so that
+    the repeated sample metadata takes up little space. A LazyFrame is streamed to the file
+    without being collected in memory.
+
+    Args:
+        df (pl.DataFrame | pl.LazyFrame): The table to write.
+        output (Path): The path to write it to.
+        data_format (DataFormat): The file format to use.
+        compression (Optional[str]): The compression codec. Defaults to zstd for the columnar
+            formats and "uncompressed" for CSV.
+
+    Raises:
+        ValueError: If the compression codec isn't supported by the format.
+    """
+    if compression is None:
+        compression = "uncompressed" if data_format == DataFormat.CSV else "zstd"
+
+    if compression not in DATA_COMPRESSIONS[data_format]:
+        raise ValueError(
+            f"Compression {compression} isn't supported for {data_format.value} output, "
+            f"use one of {', '.join(DATA_COMPRESSIONS[data_format])}"
+        )
+
+    lazy = isinstance(df, pl.LazyFrame)
+
+    if data_format == DataFormat.CSV:
+        # CSV has no nested types, so lists (like the length histograms) are joined up.
+        df = df.with_columns(
+            pl.col(name).cast(pl.List(pl.String)).list.join(";")
+            for name, dtype in df.collect_schema().items()
+            if isinstance(dtype, pl.List)
+        )
+        if lazy:
+            df.sink_csv(output)
+        else:
+            df.write_csv(output)
+        return
+
+    schema = df.collect_schema()
+    df = df.with_columns(
+        pl.col(_).cast(pl.Categorical)
+        for _ in DICTIONARY_COLUMNS
+        if schema.get(_) == pl.String
+    )
+    if data_format == DataFormat.PARQUET:
+        if lazy:
+            df.sink_parquet(output, compression=compression)
+        else:
+            df.write_parquet(output, compression=compression)
+    elif lazy:
+        df.sink_ipc(output, compression=compression)
+    else:
+        df.write_ipc(output, compression=compression)
+
+
+def load_table(
+    table: Path,
+    columns: Optional[list[str]] = None,
+    schema: Optional[pl.Schema] = None,
+) -> pl.DataFrame:
+    """Loads a table of report data written by `write_table`.
+
+    Args:
+        table (Path): The table, in any of the supported formats (going by its suffix).
+        columns (Optional[list[str]]): The columns to load. Only these are read from the
+            columnar formats. All columns if None.
+        schema (Optional[pl.Schema]): The types the table had before it was written. CSV
+            columns are parsed as these types rather than inferred, and dictionary-encoded
+            columns are cast back. Types are left as read if None.
+
+    Returns:
+        pl.DataFrame: The table.
+    """
+    if table.suffix == DataFormat.PARQUET.suffix:
+        lf = pl.scan_parquet(table)
+    elif table.suffix == DataFormat.IPC.suffix:
+        lf = pl.scan_ipc(table)
+    else:
+        lf = pl.scan_csv(table, schema_overrides=schema)
+
+    if columns:
+        lf = lf.select(columns)
+    if schema:
+        lf = lf.cast({_: schema[_] for _ in lf.collect_schema().names() if _ in schema})
+
+    return lf.collect()
+
+
+def summarise_attrition(attrition_df: pl.DataFrame) -> ReportSummary:
+    """Computes the run-level numbers quoted in the report from the attrition table.
+
+    Everything is derived in a single pass over the (one row per file) attrition table, rather
+    than by filtering the per-sequence data.
+
+    Args:
+        attrition_df (pl.DataFrame): The pre and post sequence counts for each file.
+
+    Returns:
+        ReportSummary: The file and sequence counts before and after the pipeline.
+    """
+    counts = attrition_df.select(
+        file_count_pre=(pl.col("pre") > 0).sum(),
+        file_count_post=(pl.col("post") > 0).sum(),
+        seq_count_pre=pl.col("pre").cast(pl.Int64).sum(),
+        seq_count_post=pl.col("post").cast(pl.Int64).sum(),
+    ).row(0, named=True)
+
+    seq_count_lost = counts["seq_count_pre"] - counts["seq_count_post"]
+    pct_seqs_lost = (
+        (seq_count_lost / counts["seq_count_pre"]) * 100
+        if counts["seq_count_pre"]
+        else 0.0
+    )
+
+    return ReportSummary(
+        **counts, seq_count_lost=seq_count_lost, pct_seqs_lost=round(pct_seqs_lost, 2)
+    )
 
 
 def generate_report_data(
@@ -140,66 +1054,222 @@ def generate_report_data(
     functional_filter_output: Path,
     attrition_output: Path,
     ref_name: str,
+    workers: int = 1,
+    cache: Optional[IngestionCache] = None,
+    data_format: DataFormat = DataFormat.PARQUET,
+    compression: Optional[str] = None,
+    functional_filter_columns: Optional[list[str]] = None,
+    store: Optional["SampleStore"] = None,
+    aggregate_only: bool = False,
+    prefetcher: Optional[Prefetcher] = None,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+    evict_cache: bool = True,
 ) -> PipelineData:
     """Generates the raw files required by the report template.
 
+    With `aggregate_only` or a `store`, the pre-post data holds one row of counts per file
+    instead of one row per sequence, and the FASTA files are streamed without building a row
+    per sequence. Likewise the functional filter data holds one row of counts per report, and
+    no per-sequence functional filter data is written or kept. With a `store`, only the input
+    files that changed since the last run are read. Otherwise the pre-post data refers to the
+    files by `file_id`, the file metadata is in `pre_post_files_df`, and the two are only
+    joined to write the pre-post data out.
 
     Args:
         input_files (Path): The directory containing the raw sequences fed into the pipeline.
         output_files (Path): The directory containing the final sequences at the end of the pipeline.
         functional_filter_files (Path): The directory containing the functional filter reports.
-        pre_post_output (Path): The path to write the pre-post CSV data
-        functional_filter_output (Path): The path to write the report output CSV data.
-        attrition_output (Path): The path to write the attrition CSV data to.
+        pre_post_output (Path): The path to write the pre-post data
+        functional_filter_output (Path): The path to write the report output data.
+        attrition_output (Path): The path to write the attrition data to.
+        workers (int): The number of processes to read the input files with.
+        cache (Optional[IngestionCache]): A cache of previously parsed input files to use.
+        data_format (DataFormat): The file format to write the data in.
+        compression (Optional[str]): The compression codec to write the data with.
+        functional_filter_columns (Optional[list[str]]): The functional filter columns to keep
+            in memory for the report. The full reports are still streamed to
+            `functional_filter_output`. All columns if None.
+        store (Optional[SampleStore]): Per-file aggregates of earlier runs to update.
+        aggregate_only (bool): Whether to only aggregate the input files.
+        prefetcher (Optional[Prefetcher]): Reads the input files ahead of their parsing. The
+            aggregate modes stream every input file, so nothing is read ahead there.
+        sample_id_schema (SampleIDSchema): The naming schema of the sample IDs the input
+            files are named after.
+        evict_cache (bool): Whether to trim the cache back to its size limit once the data
+            is written. Turn this off when other runs are reading the same cache at the same
+            time, and evict once they have all finished.
+
+    Raises:
+        ValueError: If any of the input file names don't follow the sample ID schema.
     """
     logger.info("Reading Data")
-    functional_filter_df = load_functional_filter_reports(functional_filter_files)
-    pre_post_df = load_pre_post_files(
-        pre_dir=input_files, post_dir=output_files, ref_name=ref_name
-    )
+    functional_filter_lf = None
+    functional_filter_counts_df = None
+    pre_post_files_df = None
+    if store:
+        pre_post_df, functional_filter_counts_df = store.update(
+            input_files,
+            output_files,
+            functional_filter_files,
+            ref_name=ref_name,
+            workers=workers,
+            sample_id_schema=sample_id_schema,
+        )
+        counts = pre_post_df.lazy()
+    elif aggregate_only:
+        pre_post_df = load_pre_post_counts(
+            input_files,
+            output_files,
+            ref_name=ref_name,
+            workers=workers,
+            sample_id_schema=sample_id_schema,
+        )
+        functional_filter_counts_df = load_functional_filter_counts(
+            functional_filter_files, workers=workers, sample_id_schema=sample_id_schema
+        )
+        counts = pre_post_df.lazy()
+    else:
+        functional_filter_lf = scan_functional_filter_reports(
+            functional_filter_files,
+            workers=workers,
+            cache=cache,
+            prefetcher=prefetcher,
+            sample_id_schema=sample_id_schema,
+        )
+        pre_post_df, pre_post_files_df = load_pre_post_files(
+            pre_dir=input_files,
+            post_dir=output_files,
+            ref_name=ref_name,
+            workers=workers,
+            cache=cache,
+            prefetcher=prefetcher,
+            sample_id_schema=sample_id_schema,
+        )
+        counts = (
+            pre_post_df.lazy()
+            .group_by("file_id")
+            .agg(num_seqs=pl.len())
+            .join(pre_post_files_df.lazy(), on="file_id")
+            .group_by(pl.col("filename").cast(pl.String), "pipeline_point")
+            .agg(pl.col("num_seqs").sum())
+        )
 
     logger.info("Calculating lost data between pre and post")
 
-    lost_expr = (((pl.col("pre") - pl.col("post")) / pl.col("pre")) * 100).round(2)
-    kept_expr = ((pl.col("post") / pl.col("pre")) * 100).round(2)
-    attrition_df: pl.DataFrame = (
-        pre_post_df.group_by(["pipeline_point", "filename"])
-        .len()
-        .pivot(on=["pipeline_point"], index="filename")
-        .fill_null(0)
-        .with_columns(
-            pct_lost=lost_expr,
-            num_lost=pl.col("pre") - pl.col("post"),
-            pct_kept=kept_expr,
-        )
-    )
+    with profiling.stage("attrition") as stage:
+        attrition_df = attrition_from_counts(counts)
+        stage.rows = attrition_df.height
 
-    attrition_df = attrition_df.sort(by="post")
+    with profiling.stage("write_pre_post", rows=pre_post_df.height) as stage:
+        logger.info(f"Writing pre-post sequence data to {pre_post_output}")
+        write_table(
+            pre_post_df
+            if pre_post_files_df is None
+            else join_pre_post_files(pre_post_df, pre_post_files_df),
+            pre_post_output,
+            data_format,
+            compression,
+        )
+        stage.nbytes = pre_post_output.stat().st_size
 
-    logger.info(f"Writing pre-post sequence data to {pre_post_output}")
-    pre_post_df.write_csv(pre_post_output)
+    with profiling.stage("load_functional_filter") as stage:
+        logger.info(f"Writing functional filter data to {functional_filter_output}")
+        if functional_filter_lf is None:
+            # The per-report counts are all the aggregate modes need.
+            functional_filter_df = None
+            write_table(
+                functional_filter_counts_df,
+                functional_filter_output,
+                data_format,
+                compression,
+            )
+        elif functional_filter_columns:
+            write_table(
+                functional_filter_lf, functional_filter_output, data_format, compression
+            )
+            # The columns the report needs are read back from the table just written, so the
+            # reports are only scanned and parsed once.
+            functional_filter_df = load_table(
+                functional_filter_output,
+                functional_filter_columns,
+                schema=functional_filter_lf.collect_schema(),
+            )
+        else:
+            functional_filter_df = functional_filter_lf.collect(engine="streaming")
+            write_table(
+                functional_filter_df, functional_filter_output, data_format, compression
+            )
+        stage.rows = (
+            functional_filter_counts_df
+            if functional_filter_df is None
+            else functional_filter_df
+        ).height
+        stage.nbytes = functional_filter_output.stat().st_size
 
-    logger.info(f"Writing pre-post sequence data to {functional_filter_output}")
-    functional_filter_df.write_csv(functional_filter_output)
+    with profiling.stage("write_attrition", rows=attrition_df.height) as stage:
+        logger.info(f"Writing attrition data to {attrition_output}")
+        write_table(attrition_df, attrition_output, data_format, compression)
+        stage.nbytes = attrition_output.stat().st_size
 
-    logger.info(f"Writing attrition data to {attrition_output}")
-    attrition_df.write_csv(attrition_output)
+    # Only evict once the lazy queries over the cache have been collected.
+    if cache and evict_cache:
+        cache.evict()
 
     logger.info("Done.")
     return PipelineData(
         pre_post_df=pre_post_df,
         functional_filter_df=functional_filter_df,
         attrition_df=attrition_df,
+        summary=summarise_attrition(attrition_df),
+        functional_filter_counts_df=functional_filter_counts_df,
+        pre_post_files_df=pre_post_files_df,
+    )
+
+
+def attrition_from_counts(counts: pl.LazyFrame) -> pl.DataFrame:
+    """Calculates how many sequences each file lost between the start and end of the pipeline.
+
+    Args:
+        counts (pl.LazyFrame): The number of sequences (`num_seqs`) per `filename` and
+            `pipeline_point`.
+
+    Returns:
+        pl.DataFrame: One row per filename with the pre and post counts and the loss between them.
+    """
+    lost_expr = (((pl.col("pre") - pl.col("post")) / pl.col("pre")) * 100).round(2)
+    kept_expr = ((pl.col("post") / pl.col("pre")) * 100).round(2)
+    return (
+        # Files without any sequences don't appear in the attrition table.
+        counts.filter(pl.col("num_seqs") > 0)
+        .group_by("filename")
+        .agg(
+            pre=pl.col("num_seqs").filter(pl.col("pipeline_point") == "pre").sum(),
+            post=pl.col("num_seqs").filter(pl.col("pipeline_point") == "post").sum(),
+        )
+        # Signed, since the post files can hold more sequences than the pre files (such as the
+        # reference when it isn't left out), and the loss is then negative.
+        .cast({"pre": pl.Int64, "post": pl.Int64})
+        .with_columns(
+            pct_lost=lost_expr,
+            num_lost=pl.col("pre") - pl.col("post"),
+            pct_kept=kept_expr,
+        )
+        # Break ties on filename so the row order (and so plot fingerprints) is stable.
+        .sort(by=["post", "filename"])
+        .collect()
     )
 
 
 def print_msa_grid(
     msa_dir: Path, width: Optional[int] = 4, height: Optional[int] = None
 ):
+    # Only this debugging helper draws, so the data stages don't pay for importing matplotlib.
+    import matplotlib.pyplot as plt
+
     files = []
 
-    for file in msa_dir.glob("*"):
-        if os.stat(file).st_size > 0:
+    for file in sorted(msa_dir.glob("*")):
+        if file.suffix != NAMES_SUFFIX and os.stat(file).st_size > 0:
             files.append(file)
 
     if not width:
@@ -216,7 +1286,7 @@ def print_msa_grid(
         for row in range(rows):
             if counter > len(files) - 1:
                 break
-            _, current_msa = utils.msa_to_numpy(files[counter])
+            _, current_msa = load_msa(files[counter])
 
             ax[row][col].imshow(current_msa, interpolation="none", cmap="viridis")
             ax[row][col].set_aspect("auto")
@@ -0,0 +1,73 @@
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from attrs import define
+
+# Files larger than this are left for their parser to stream rather than read into memory.
+PREFETCH_MAX_FILE_SIZE = 64 * 1024 * 1024
+
+
+@define
+class Prefetcher:
+    """Reads upcoming input files into memory while earlier ones are being parsed.
+
+    On network filesystems the latency of opening and reading each file dominates, so several
+    files are read at once on a pool of threads. The files are handed back in order, and only
+    `readahead` of them are read or held at a time.
+
+    Attributes:
+        concurrency (int): The number of files to read at once.
+        readahead (int): The number of files to read ahead of the one being parsed.
+        max_file_size (int): Files larger than this many bytes aren't read ahead, and are
+            left for their parser to stream.
+    """
+
+    concurrency: int = 4
+    readahead: int = 16
+    max_file_size: int = PREFETCH_MAX_FILE_SIZE
+
+    def _fetch(
+        self, file: Path, skip: Optional[Callable[[Path], bool]]
+    ) -> Optional[bytes]:
+        if skip and skip(file):
+            return None
+
+        with file.open("rb") as handle:
+            if os.fstat(handle.fileno()).st_size > self.max_file_size:
+                return None
+            return handle.read()
+
+    def read(
+        self, files: Iterable[Path], skip: Optional[Callable[[Path], bool]] = None
+    ) -> Iterator[tuple[Path, Optional[bytes]]]:
+        """Reads files ahead of time, yielding them in order.
+
+        Args:
+            files (Iterable[Path]): The files.
+            skip (Optional[Callable[[Path], bool]]): Whether a file doesn't need to be read,
+                for example because it is already cached. Called on the reading threads.
+
+        Yields:
+            tuple[Path, Optional[bytes]]: Each file and its contents, or None if it was
+                skipped or is too large to read ahead.
+        """
+        files = iter(files)
+        pool = ThreadPoolExecutor(
+            max_workers=max(self.concurrency, 1), thread_name_prefix="prefetch"
+        )
+
+        def submit(file: Path) -> tuple[Path, Future]:
+            return file, pool.submit(self._fetch, file, skip)
+
+        try:
+            pending = deque(submit(_) for _ in islice(files, max(self.readahead, 1)))
+            while pending:
+                file, future = pending.popleft()
+                pending.extend(submit(_) for _ in islice(files, 1))
+                yield file, future.result()
+        finally:
+            pool.shutdown(cancel_futures=True)
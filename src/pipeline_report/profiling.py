@@ -0,0 +1,219 @@
+import csv
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+from attrs import asdict, define, field, fields
+from loguru import logger
+
+from pipeline_report import utils
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Records of the stages run so far, or None while profiling is disabled.
+_records: Optional[list["StageRecord"]] = None
+
+
+@define
+class StageRecord:
+    """Resource usage of one stage of a report build.
+
+    Attributes:
+        stage (str): The name of the stage.
+        wall_s (float): Elapsed wall-clock time in seconds.
+        cpu_s (float): User and system CPU time in seconds, including any child processes
+            that finished during the stage.
+        max_rss_mb (float): The peak resident set size of the process (or of its largest
+            child) since it started, in MiB. This is cumulative, so a stage that uses less
+            memory than an earlier one reports the earlier peak.
+        peak_rss_delta_mb (float): How far the stage raised `max_rss_mb`, in MiB, which is
+            zero for a stage that stayed below the earlier peak.
+        rows (Optional[int]): The number of rows the stage produced, where that makes sense.
+        nbytes (Optional[int]): The number of bytes the stage read or wrote, where that makes
+            sense.
+        pid (int): The process the stage ran in.
+    """
+
+    stage: str
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    max_rss_mb: float = 0.0
+    peak_rss_delta_mb: float = 0.0
+    rows: Optional[int] = None
+    nbytes: Optional[int] = None
+    pid: int = field(factory=os.getpid)
+
+
+def enable() -> None:
+    """Starts recording stages, discarding anything recorded before."""
+    global _records
+    _records = []
+
+
+def disable() -> None:
+    """Stops recording stages, discarding anything recorded."""
+    global _records
+    _records = None
+
+
+def is_enabled() -> bool:
+    return _records is not None
+
+
+def records() -> list[StageRecord]:
+    """Returns the stages recorded since profiling was enabled."""
+    return list(_records or [])
+
+
+def add(record: StageRecord) -> None:
+    """Records a stage measured elsewhere, e.g. in a worker process. Ignored if disabled."""
+    if _records is not None:
+        _records.append(record)
+
+
+def _cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _max_rss_mb() -> float:
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and KiB everywhere else.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+@contextmanager
+def measure(
+    stage: str, rows: Optional[int] = None, nbytes: Optional[int] = None
+) -> Iterator[StageRecord]:
+    """Measures a block of code without recording it.
+
+    The yielded record is filled in when the block exits, and `rows` and `nbytes` can be set
+    on it inside the block.
+
+    Args:
+        stage (str): The name of the stage.
+        rows (Optional[int]): The number of rows the stage produces, if already known.
+        nbytes (Optional[int]): The number of bytes the stage processes, if already known.
+
+    Yields:
+        StageRecord: The record of the stage.
+    """
+    record = StageRecord(stage, rows=rows, nbytes=nbytes)
+    start_wall = time.perf_counter()
+    start_cpu = _cpu_time()
+    start_rss = _max_rss_mb()
+    try:
+        yield record
+    finally:
+        record.wall_s = time.perf_counter() - start_wall
+        record.cpu_s = _cpu_time() - start_cpu
+        record.max_rss_mb = _max_rss_mb()
+        record.peak_rss_delta_mb = record.max_rss_mb - start_rss
+
+
+@contextmanager
+def stage(
+    name: str, rows: Optional[int] = None, nbytes: Optional[int] = None
+) -> Iterator[StageRecord]:
+    """Measures a block of code and records it if profiling is enabled.
+
+    Args:
+        name (str): The name of the stage.
+        rows (Optional[int]): The number of rows the stage produces, if already known.
+        nbytes (Optional[int]): The number of bytes the stage processes, if already known.
+
+    Yields:
+        StageRecord: The record of the stage.
+    """
+    with measure(name, rows, nbytes) as record:
+        try:
+            yield record
+        finally:
+            add(record)
+
+
+def _measured_call(func: Callable[[T], R], name: str, item: T) -> tuple[R, StageRecord]:
+    with measure(name) as record:
+        result = func(item)
+        record.rows = getattr(result, "height", None)
+    return result, record
+
+
+def _measured_task(task: tuple[Callable[[T], R], str, T]) -> tuple[R, StageRecord]:
+    return _measured_call(*task)
+
+
+def map_files(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    workers: int = 1,
+    describe: Optional[Callable[[T], tuple[str, Optional[int]]]] = None,
+) -> list[R]:
+    """Like `utils.map_files`, but records a stage for every item when profiling is enabled.
+
+    Each item is measured in the process that handles it and the records are sent back.
+
+    Args:
+        func (Callable[[T], R]): A module-level (picklable) function to apply.
+        items (Iterable[T]): The items to apply the function to.
+        workers (int): The number of processes to use.
+        describe (Optional[Callable[[T], tuple[str, Optional[int]]]]): Gives the stage name
+            and the number of input bytes for an item. Called in this process.
+
+    Returns:
+        list[R]: The result for each item.
+    """
+    if not is_enabled():
+        return utils.map_files(func, items, workers=workers)
+
+    # Describe the items as they are taken, so lazily produced items stay lazy.
+    described = []
+
+    def tasks() -> Iterator[tuple[Callable[[T], R], str, T]]:
+        for item in items:
+            described.append(describe(item) if describe else (func.__name__, None))
+            yield func, described[-1][0], item
+
+    results = utils.map_files(_measured_task, tasks(), workers=workers)
+
+    for (_, size), (_, record) in zip(described, results):
+        record.nbytes = size
+        add(record)
+
+    return [result for result, _ in results]
+
+
+def write(output_dir: Path) -> tuple[Path, Path]:
+    """Writes the recorded stages as JSON and CSV.
+
+    Args:
+        output_dir (Path): The directory to write profile.json and profile.csv to.
+
+    Returns:
+        tuple[Path, Path]: The JSON and CSV files.
+    """
+    json_path = output_dir / "profile.json"
+    csv_path = output_dir / "profile.csv"
+    rows = [asdict(_) for _ in records()]
+
+    json_path.write_text(json.dumps(rows, indent=4))
+    with csv_path.open("w", newline="") as handle:
+        writer = csv.DictWriter(
+            handle, fieldnames=[_.name for _ in fields(StageRecord)]
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+    logger.info(f"Wrote profile of {len(rows)} stages to {json_path} and {csv_path}")
+    return json_path, csv_path
@@ -1,23 +1,182 @@
+import io
 import json
+import multiprocessing
 import shlex
 import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from importlib import resources
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Optional
 
 import polars as pl
+from attrs import asdict, define, evolve, field
 from loguru import logger
 
 from pipeline_report import create_plots as plotter
-from pipeline_report import parse_data, templates
+from pipeline_report import lineage, msa_matrix, parse_data, profiling, templates
+from pipeline_report.cache import (
+    IngestionCache,
+    PlotCache,
+    directory_fingerprint,
+    frame_fingerprint,
+    plot_fingerprint,
+    report_fingerprint,
+)
+from pipeline_report.choices import SampleIDSchema
+from pipeline_report.incremental import SampleStore
+from pipeline_report.prefetch import Prefetcher
 
 logger.add(
     sys.stderr, format="{time} {level} {message}", filter="prep_data", level="INFO"
 )
 
 
+@define
+class PlotJob:
+    """A plot to draw for the report.
+
+    Attributes:
+        name (str): A short name for the plot.
+        func (str): The name of the function in `create_plots` that draws it.
+        output (Path): The path the plot is written to.
+        data (pl.DataFrame | Path): The dataframe the plot is drawn from, or a directory of
+            alignments for the MSA grid.
+        columns (Optional[list[str]]): The columns of `data` that the plot reads.
+        plot_output (plotter.PlotOutput): How the plot is written.
+    """
+
+    name: str
+    func: str
+    output: Path
+    data: pl.DataFrame | Path
+    columns: Optional[list[str]] = None
+    plot_output: plotter.PlotOutput = field(factory=plotter.PlotOutput)
+
+    @property
+    def outputs(self) -> list[Path]:
+        """All of the files the plot writes."""
+        return self.plot_output.paths(self.output)
+
+    def fingerprint(self) -> str:
+        """Fingerprints the data and parameters the plot would currently be drawn with."""
+        if isinstance(self.data, Path):
+            data_fingerprint = directory_fingerprint(self.data, "*")
+        else:
+            data_fingerprint = frame_fingerprint(self.data, self.columns)
+
+        return plot_fingerprint(
+            data_fingerprint,
+            func=self.func,
+            outputs=[str(_) for _ in self.outputs],
+            plot_output=asdict(self.plot_output),
+        )
+
+    def payload(self) -> bytes | Path:
+        """Serialises the columns the plot reads as Arrow IPC, to send to a worker process."""
+        if isinstance(self.data, Path):
+            return self.data
+        return self.data.select(self.columns).write_ipc(None).getvalue()
+
+
+def _init_plot_worker() -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _draw_plot(
+    name: str,
+    func: str,
+    data: bytes | pl.DataFrame | Path,
+    output: Path,
+    plot_output: plotter.PlotOutput,
+) -> profiling.StageRecord:
+    with profiling.measure(f"plot:{name}") as record:
+        if isinstance(data, bytes):
+            data = pl.read_ipc(io.BytesIO(data))
+        getattr(plotter, func)(data, output, plot_output=plot_output)
+        if isinstance(data, pl.DataFrame):
+            record.rows = data.height
+    return record
+
+
+def draw_plots(jobs: list[PlotJob], plot_cache: PlotCache, workers: int = 1) -> None:
+    """Draws every plot whose data or parameters changed since it was last drawn.
+
+    With more than one worker the plots are drawn concurrently in separate processes using the
+    Agg backend, each receiving only the columns it reads. A failing plot doesn't stop the
+    others from being drawn.
+
+    Args:
+        jobs (list[PlotJob]): The plots to draw.
+        plot_cache (PlotCache): Where the fingerprints of previously drawn plots are kept.
+        workers (int): The number of processes to draw the plots with.
+
+    Raises:
+        RuntimeError: If any of the plots failed to draw.
+    """
+    stale: list[tuple[PlotJob, str]] = []
+    for job in jobs:
+        fingerprint = job.fingerprint()
+        if plot_cache.is_current(job.name, fingerprint, job.outputs):
+            logger.info(f"Plot {job.name} is up to date, skipping")
+        else:
+            stale.append((job, fingerprint))
+
+    errors: dict[str, BaseException] = {}
+
+    def finish(
+        job: PlotJob,
+        fingerprint: str,
+        error: Optional[BaseException],
+        record: Optional[profiling.StageRecord] = None,
+    ):
+        if error:
+            logger.opt(exception=error).error(f"Failed to draw plot {job.name}")
+            errors[job.name] = error
+        else:
+            plot_cache.record(job.name, fingerprint)
+            profiling.add(record)
+
+    if workers <= 1 or len(stale) <= 1:
+        for job, fingerprint in stale:
+            try:
+                record = _draw_plot(
+                    job.name, job.func, job.data, job.output, job.plot_output
+                )
+                finish(job, fingerprint, None, record)
+            except Exception as e:
+                finish(job, fingerprint, e)
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(stale)),
+            mp_context=context,
+            initializer=_init_plot_worker,
+        ) as pool:
+            futures = [
+                pool.submit(
+                    _draw_plot,
+                    job.name,
+                    job.func,
+                    job.payload(),
+                    job.output,
+                    job.plot_output,
+                )
+                for job, _ in stale
+            ]
+            for (job, fingerprint), future in zip(stale, futures):
+                error = future.exception()
+                finish(job, fingerprint, error, None if error else future.result())
+
+    if errors:
+        raise RuntimeError(f"Failed to draw plots: {', '.join(errors)}") from next(
+            iter(errors.values())
+        )
+
+
 def create_report_json(
     pre_dir: Path,
     post_dir: Path,
@@ -30,16 +189,35 @@ def create_report_json(
     graphic_filetype: Literal["png", "svg"],
     pipeline_params_fp: Path,
     ref_name: str,
+    workers: int = 1,
+    cache: Optional[IngestionCache] = None,
+    convert_msas: bool = False,
+    data_format: parse_data.DataFormat = parse_data.DataFormat.PARQUET,
+    data_compression: Optional[str] = None,
+    store: Optional[SampleStore] = None,
+    aggregate_only: bool = False,
+    plot_output: Optional[plotter.PlotOutput] = None,
+    read_lineage: bool = False,
+    prefetcher: Optional[Prefetcher] = None,
+    sample_id_schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+    evict_cache: bool = True,
 ):
+    # The plots are written in the format the template embeds, plus any others asked for.
+    plot_output = plot_output or plotter.PlotOutput()
+    plot_output = evolve(
+        plot_output,
+        formats=list(dict.fromkeys([graphic_filetype, *(plot_output.formats or [])])),
+    )
     report_output_dir.mkdir(exist_ok=True, parents=True)
     report_data_dir = report_output_dir / "data"
     report_json_path = report_data_dir / "data.json"
     report_data_dir.mkdir(exist_ok=True)
 
     logger.info("Reading in data")
-    pre_post_output = report_data_dir / f"{run_name}_pre_post.csv"
-    functional_filter_output = report_data_dir / f"{run_name}_functional_filter.csv"
-    attrition_output = report_data_dir / f"{run_name}_attrition.csv"
+    suffix = data_format.suffix
+    pre_post_output = report_data_dir / f"{run_name}_pre_post{suffix}"
+    functional_filter_output = report_data_dir / f"{run_name}_functional_filter{suffix}"
+    attrition_output = report_data_dir / f"{run_name}_attrition{suffix}"
 
     pipeline_data = parse_data.generate_report_data(
         pre_dir,
@@ -49,48 +227,120 @@ def create_report_json(
         functional_filter_output=functional_filter_output,
         attrition_output=attrition_output,
         ref_name=ref_name,
+        workers=workers,
+        cache=cache,
+        data_format=data_format,
+        compression=data_compression,
+        functional_filter_columns=list(
+            dict.fromkeys(plotter.UPSET_COLUMNS + plotter.LENGTH_BOXPLOT_COLUMNS)
+        ),
+        store=store,
+        aggregate_only=aggregate_only,
+        prefetcher=prefetcher,
+        sample_id_schema=sample_id_schema,
+        evict_cache=evict_cache,
     )
 
-    pre_post_df = pipeline_data.pre_post_df
+    if read_lineage:
+        with profiling.stage("lineage"):
+            survival_df = lineage.write_lineage(
+                pre_dir,
+                post_dir,
+                functional_filter_dir,
+                report_data_dir / f"{run_name}_lineage{suffix}",
+                data_format,
+                data_compression,
+                ref_name=ref_name,
+                workers=workers,
+                sample_id_schema=sample_id_schema,
+            )
+            parse_data.write_table(
+                survival_df,
+                report_data_dir / f"{run_name}_survival{suffix}",
+                data_format,
+                data_compression,
+            )
+
     func_filter_df = pipeline_data.functional_filter_df
     attrition_df = pipeline_data.attrition_df
-
-    logger.info("Calculating inline variables")
-
-    file_count_pre = len(
-        pre_post_df.filter(pl.col("pipeline_point") == "pre")["filename"].unique()
-    )
-
-    file_count_post = len(
-        pre_post_df.filter(pl.col("pipeline_point") == "post")["filename"].unique()
+    # The aggregate modes already hold the boxplot statistics and filter counts of each
+    # sample.
+    length_stats_df = pipeline_data.functional_filter_counts_df
+    if length_stats_df is None:
+        length_stats_df = parse_data.length_boxplot_stats(func_filter_df)
+    filter_combination_df = parse_data.filter_combination_counts(
+        pipeline_data.functional_filter_counts_df
+        if pipeline_data.functional_filter_counts_df is not None
+        else func_filter_df
     )
 
-    seq_count_pre = len(pre_post_df.filter(pl.col("pipeline_point") == "pre"))
-    seq_count_post = len(pre_post_df.filter(pl.col("pipeline_point") == "post"))
-
-    num_lost_seqs = seq_count_pre - seq_count_post
-    pct_lost_seqs = (num_lost_seqs / seq_count_pre) * 100
-
     logger.info("Producing plots.")
-    msa_gridplot_fp = report_data_dir / f"{run_name}_msaGridPlot.png"
-    upsetplot_fp = report_data_dir / f"{run_name}_UpSetPlot.svg"
-    seq_length_boxplot_fp = report_data_dir / f"{run_name}_sequenceLengthBoxplot.svg"
-    seq_count_bubbleplot_fp = report_data_dir / f"{run_name}_seqCountBubblePlot.png"
-
-    seq_count_barplot_fp = report_data_dir / f"{run_name}_seqCountBarPlot.png"
+    graphic_suffix = f".{graphic_filetype}"
+    msa_gridplot_fp = report_data_dir / f"{run_name}_msaGridPlot{graphic_suffix}"
+    upsetplot_fp = report_data_dir / f"{run_name}_UpSetPlot{graphic_suffix}"
+    seq_length_boxplot_fp = (
+        report_data_dir / f"{run_name}_sequenceLengthBoxplot{graphic_suffix}"
+    )
+    seq_count_bubbleplot_fp = (
+        report_data_dir / f"{run_name}_seqCountBubblePlot{graphic_suffix}"
+    )
 
-    if not msa_gridplot_fp.exists():
-        plotter.create_msa_gridplot(post_dir, msa_gridplot_fp)
+    seq_count_barplot_fp = (
+        report_data_dir / f"{run_name}_seqCountBarPlot{graphic_suffix}"
+    )
 
-    if not upsetplot_fp.exists():
-        plotter.create_filter_upset_plot(func_filter_df, upsetplot_fp)
-    if not seq_length_boxplot_fp.exists():
-        plotter.create_seq_length_boxplot(func_filter_df, seq_length_boxplot_fp)
-    if not seq_count_bubbleplot_fp.exists():
-        plotter.create_seq_count_bubbleplot(attrition_df, seq_count_bubbleplot_fp)
+    msa_dir = post_dir
+    if convert_msas:
+        logger.info("Converting post-pipeline alignments to matrix files")
+        msa_dir = report_data_dir / "msa"
+        with profiling.stage("convert_msas") as stage:
+            stage.rows = len(msa_matrix.convert_msa_dir(post_dir, msa_dir))
 
-    if not seq_count_barplot_fp.exists():
-        plotter.create_seq_count_barplot(attrition_df, seq_count_barplot_fp)
+    plot_jobs = [
+        PlotJob(
+            "msa_gridplot",
+            "create_msa_gridplot",
+            msa_gridplot_fp,
+            msa_dir,
+            plot_output=plot_output,
+        ),
+        PlotJob(
+            "upsetplot",
+            "create_filter_upset_plot",
+            upsetplot_fp,
+            filter_combination_df,
+            plotter.UPSET_COUNTS_COLUMNS,
+            plot_output,
+        ),
+        PlotJob(
+            "seq_length_boxplot",
+            "create_seq_length_boxplot",
+            seq_length_boxplot_fp,
+            length_stats_df,
+            plotter.LENGTH_BOXPLOT_STATS_COLUMNS,
+            plot_output,
+        ),
+        PlotJob(
+            "seq_count_bubbleplot",
+            "create_seq_count_bubbleplot",
+            seq_count_bubbleplot_fp,
+            attrition_df,
+            plotter.BUBBLEPLOT_COLUMNS,
+            plot_output,
+        ),
+        PlotJob(
+            "seq_count_barplot",
+            "create_seq_count_barplot",
+            seq_count_barplot_fp,
+            attrition_df,
+            plotter.BARPLOT_COLUMNS,
+            plot_output,
+        ),
+    ]
+    with profiling.stage("plots"):
+        draw_plots(
+            plot_jobs, PlotCache(report_data_dir / "plots.json"), workers=workers
+        )
 
     logger.info("Done with plots.")
     logger.info("Reading pipeline parameters")
@@ -104,12 +354,7 @@ def create_report_json(
         "run_name": run_name,
         "run_date": run_date.strftime("%Y-%m-%d"),
         "pipeline_version": pipeline_version,
-        "file_count_pre": file_count_pre,
-        "file_count_post": file_count_post,
-        "seq_count_pre": seq_count_pre,
-        "seq_count_post": seq_count_post,
-        "seq_count_lost": num_lost_seqs,
-        "pct_seqs_lost": round(pct_lost_seqs, 2),
+        **asdict(pipeline_data.summary),
         "git_commit_hash": pipeline_commit_hash,
         "nf_param_dump": nextflow_params,
         "img_msa_gridplot": msa_gridplot_fp,
@@ -128,17 +373,54 @@ def create_report_json(
     json.dump(output_df, report_json_path.open("w"), indent=4)
 
 
-def render(
-    report_output_dir: Path,
-    run_name: str,
-):
-    template_file = resources.files(templates) / "template.typ"
+def render(report_output_dir: Path, run_name: str, force: bool = False) -> Path:
+    """Compiles the report of a run with typst, unless nothing it's made from has changed.
+
+    typst's messages are logged, and the time it took is recorded as the typst_compile stage.
+
+    Args:
+        report_output_dir (Path): The directory `create_report_json` wrote the run to.
+        run_name (str): The name of the run.
+        force (bool): Compile even if the template, data and plots are unchanged.
+
+    Returns:
+        Path: The report PDF.
+
+    Raises:
+        RuntimeError: If typst fails, with its error messages.
+    """
+    template = (resources.files(templates) / "template.typ").read_bytes()
     template_output_path = report_output_dir / f"{run_name}_report.typ"
-    logger.info(f"Copying template at {template_file} to {template_output_path}")
-    template_output_path.write_bytes(template_file.read_bytes())
-    logger.info("Done")
-
-    compile_command = f"typst compile {template_output_path}"
-    logger.info(f"Running {compile_command}")
-    subprocess.run(shlex.split(compile_command), shell=False, check=True)
-    logger.success(f"Done - wrote output to {template_output_path.with_suffix('.pdf')}")
+    pdf_path = template_output_path.with_suffix(".pdf")
+    # Only rewrite the template when it changed, so typst sees an untouched file otherwise.
+    if (
+        not template_output_path.exists()
+        or template_output_path.read_bytes() != template
+    ):
+        logger.info(f"Copying template to {template_output_path}")
+        template_output_path.write_bytes(template)
+
+    render_cache = PlotCache(report_output_dir / "data" / "render.json")
+    fingerprint = report_fingerprint(report_output_dir, template)
+    if not force and render_cache.is_current(run_name, fingerprint, [pdf_path]):
+        logger.info(f"Report {pdf_path} is up to date, skipping compilation")
+        return pdf_path
+
+    command = ["typst", "compile", str(template_output_path)]
+    logger.info(f"Running {shlex.join(command)}")
+    with profiling.stage("typst_compile") as stage:
+        result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"typst failed to compile {template_output_path} "
+            f"(exit code {result.returncode}): {result.stderr.strip()}"
+        )
+    # typst writes its warnings to stderr even when it succeeds.
+    for line in result.stderr.splitlines():
+        if line.strip():
+            logger.warning(f"typst: {line}")
+
+    stage.nbytes = pdf_path.stat().st_size
+    render_cache.record(run_name, fingerprint)
+    logger.success(f"Done - wrote output to {pdf_path} in {stage.wall_s:.1f}s")
+    return pdf_path
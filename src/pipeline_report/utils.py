@@ -1,12 +1,52 @@
-import enum
+import io
+import multiprocessing
 import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, islice
 from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, Literal, TypeVar
 
 import numpy as np
+import polars as pl
+import pyarrow as pa
 from attrs import define
-from Bio import SeqIO
 from typing_extensions import Optional
 
+from pipeline_report.choices import SampleIDSchema
+
+# Number of bytes read from a FASTA file at a time when scanning it.
+FASTA_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Inputs may be compressed, in which case the compression suffix follows the file type, e.g.
+# sample.fasta.gz. The compression itself is recognised from the start of the file.
+COMPRESSION_SUFFIXES = (".gz", ".bgz", ".zst")
+# Number of threads inflating the blocks of a BGZF file, and how many blocks each reads ahead.
+BGZF_THREADS = min(4, os.cpu_count() or 1)
+BGZF_BATCH_BLOCKS = 64
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_GZIP_FEXTRA = 4
+
+_HEADER_BYTE = ord(">")
+_NEWLINE_BYTE = ord("\n")
+# Any byte at or below the space character is treated as whitespace.
+_WHITESPACE_MAX_BYTE = ord(" ")
+
+# The points in the pipeline that sequences are read from, in pipeline order.
+PIPELINE_POINTS = ["pre", "post"]
+PIPELINE_POINT = pl.Enum(PIPELINE_POINTS)
+
+# The per-read columns of a FASTA file. Lengths are narrowed to 32 bits, since no read comes
+# close to 4 Gbp.
+FASTA_READS_SCHEMA = {"name": pl.String, "length": pl.UInt32}
+
+T = TypeVar("T")
+R = TypeVar("R")
+
 
 @define
 class FileStats:
@@ -28,110 +68,640 @@ class SequencingFile:
 
 
 @define
-class Sequence:
-    name: str
-    length: int
-    pool: str
-    visit: str
-    participant: str
-    path: Path
-    pipeline_point: str
-    filename: str
+class SampleIDPattern:
+    """How the fields of a sample ID are laid out under a naming schema.
+
+    Attributes:
+        pattern (str): A regular expression matching a whole sample ID, with a named group for
+            each of `SAMPLE_ID_FIELDS`.
+        example (str): A well-formed sample ID, shown when a name doesn't match.
+    """
+
+    pattern: str
+    example: str
+
+
+# The fields every sample ID schema splits an ID into.
+SAMPLE_ID_FIELDS = ["participant", "visit", "pool"]
+
+# How sample IDs are parsed under each schema. Support for a new naming scheme is added with a
+# `SampleIDSchema` member and an entry here.
+SAMPLE_ID_PATTERNS = {
+    # e.g. CAP100_1000-A, for participant CAP100, visit 1000 and pool A.
+    SampleIDSchema.ELLPACA: SampleIDPattern(
+        r"(?P<participant>[A-Z]{3}\d{3})_(?P<visit>\d{4})-(?P<pool>[A-Za-z0-9]+)",
+        "CAP100_1000-A",
+    ),
+}
+
+
+def map_files(func: Callable[[T], R], items: Iterable[T], workers: int = 1) -> list[R]:
+    """Applies a function to every item, optionally spread over a pool of processes.
+
+    Results are always returned in the same order as the items, regardless of the order in
+    which the workers finish. Items are taken from the iterable only a few at a time, so items
+    that are produced lazily (like prefetched files) aren't all held in memory at once.
+
+    Args:
+        func (Callable[[T], R]): A module-level (picklable) function to apply.
+        items (Iterable[T]): The items to apply the function to.
+        workers (int): The number of processes to use. 1 runs everything in this process.
+
+    Returns:
+        list[R]: The result for each item.
+    """
+    items = iter(items)
+    head = list(islice(items, 2 * workers))
+    if workers <= 1 or len(head) <= 1:
+        return [func(item) for item in chain(head, items)]
+
+    # Polars is multithreaded, so forking a process that has already used it can deadlock.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(head)), mp_context=context
+    ) as pool:
+        pending = deque(pool.submit(func, _) for _ in head)
+        results = []
+        while pending:
+            results.append(pending.popleft().result())
+            pending.extend(pool.submit(func, _) for _ in islice(items, 1))
+        return results
+
+
+def sample_id_from_path(file: Path) -> str:
+    """Takes the sample ID of an input file from its name, which is everything before the first dot."""
+    return file.name.split(".")[0]
+
+
+def parse_sample_ids(
+    sample_ids: Iterable[str], schema: SampleIDSchema = SampleIDSchema.ELLPACA
+) -> pl.DataFrame:
+    """Splits sample IDs into their fields, matching all of them in one vectorised pass.
+
+    Args:
+        sample_ids (Iterable[str]): The sample IDs.
+        schema (SampleIDSchema): The naming schema the IDs follow.
+
+    Returns:
+        pl.DataFrame: One row per ID, with the `sample_id` and each of `SAMPLE_ID_FIELDS` as
+            categorical columns.
+
+    Raises:
+        ValueError: If any of the IDs don't follow the schema.
+    """
+    pattern = SAMPLE_ID_PATTERNS[schema]
+    ids = pl.Series("sample_id", list(sample_ids), dtype=pl.String)
+    df = ids.to_frame().with_columns(
+        pl.col("sample_id")
+        .str.extract_groups(f"^(?:{pattern.pattern})$")
+        .struct.field(*SAMPLE_ID_FIELDS)
+    )
+
+    malformed = df.filter(pl.any_horizontal(pl.col(SAMPLE_ID_FIELDS).is_null()))
+    if malformed.height:
+        shown = ", ".join(malformed["sample_id"].head(5))
+        raise ValueError(
+            f"{malformed.height} sample IDs don't follow the {schema.value} schema "
+            f"(like {pattern.example}): {shown}"
+        )
 
+    return df.cast(pl.Categorical)
 
-class SampleIDSchema(enum.Enum):
-    ELLPACA = "ELLPACA"
+
+def get_files_info(
+    files: list[Path],
+    pipeline_point: Optional[str],
+    schema: SampleIDSchema = SampleIDSchema.ELLPACA,
+) -> list[SequencingFile]:
+    """Parses the sample IDs in the names of many input files at once.
+
+    Args:
+        files (list[Path]): The files.
+        pipeline_point (Optional[str]): The point in the pipeline the files come from.
+        schema (SampleIDSchema): The naming schema the sample IDs follow.
+
+    Returns:
+        list[SequencingFile]: Metadata about each file. Files are reported under the name of
+            their participant.
+
+    Raises:
+        ValueError: If any of the file names don't follow the schema.
+    """
+    fields = parse_sample_ids([sample_id_from_path(_) for _ in files], schema)
+    return [
+        SequencingFile(
+            name=row["participant"],
+            pool=row["pool"],
+            visit=row["visit"],
+            participant=row["participant"],
+            path=file,
+            pipeline_point=pipeline_point,
+        )
+        for file, row in zip(files, fields.iter_rows(named=True))
+    ]
 
 
 def get_file_info_from_name(
-    file: Path, pipeline_point: Optional[str]
+    file: Path,
+    pipeline_point: Optional[str],
+    schema: SampleIDSchema = SampleIDSchema.ELLPACA,
 ) -> SequencingFile:
-    file_name = file.stem
-    participant_id = file_name.split("_")[0]
-    visit_id = file_name[7:11]
-    pool_id = ""
-    # pool_section = file_name.split("-").get(1)
-    # print(pool_section)
-    # if pool_section:
-    #     pool_id = pool_section.split(".").get(0)
-
-    return SequencingFile(
-        name=file_name[0:6],
-        pool=pool_id,
-        visit=visit_id,
-        participant=participant_id,
-        path=file,
-        pipeline_point=pipeline_point,
+    return get_files_info([file], pipeline_point, schema)[0]
+
+
+def input_files(directory: Path, suffix: str) -> list[Path]:
+    """Lists the input files in a directory with a file type, whether compressed or not.
+
+    Args:
+        directory (Path): The directory.
+        suffix (str): The file type, e.g. ".fasta", which matches sample.fasta as well as
+            sample.fasta.gz, sample.fasta.bgz and sample.fasta.zst.
+
+    Returns:
+        list[Path]: The files, sorted by name.
+
+    Raises:
+        ValueError: If a file is there both compressed and uncompressed (or compressed in
+            more than one way), which would count its sample twice.
+    """
+    # List the directory once, as every listing is a round trip on a network filesystem.
+    suffixes = (suffix, *(f"{suffix}{_}" for _ in COMPRESSION_SUFFIXES))
+    with os.scandir(directory) as entries:
+        files = sorted(Path(_.path) for _ in entries if _.name.endswith(suffixes))
+
+    copies: dict[str, list[str]] = {}
+    for file in files:
+        copies.setdefault(uncompressed_path(file).name, []).append(file.name)
+    duplicates = [names for names in copies.values() if len(names) > 1]
+    if duplicates:
+        shown = "; ".join(", ".join(_) for _ in duplicates[:5])
+        raise ValueError(
+            f"{len(duplicates)} input file(s) in {directory} are present both compressed "
+            f"and uncompressed, keep one copy of each: {shown}"
+        )
+
+    return files
+
+
+def uncompressed_path(file: Path) -> Path:
+    """Drops the compression suffix from an input file's path, if it has one."""
+    return file.with_suffix("") if file.suffix in COMPRESSION_SUFFIXES else file
+
+
+def input_compression(file: Path) -> Optional[Literal["gzip", "bgzf", "zstd"]]:
+    """Recognises how an input file is compressed from its first bytes.
+
+    Args:
+        file (Path): The file.
+
+    Returns:
+        Optional[Literal["gzip", "bgzf", "zstd"]]: The compression, or None for a plain file.
+    """
+    with file.open("rb") as handle:
+        return _detect_compression(handle.read(16))
+
+
+def _detect_compression(head: bytes) -> Optional[Literal["gzip", "bgzf", "zstd"]]:
+    if head.startswith(_ZSTD_MAGIC):
+        return "zstd"
+    if head.startswith(_GZIP_MAGIC):
+        # BGZF is gzip whose members each carry their compressed size in a BC extra field.
+        if len(head) == 16 and head[3] & _GZIP_FEXTRA and head[12:14] == b"BC":
+            return "bgzf"
+        return "gzip"
+    return None
+
+
+def _inflate_bgzf_block(block: bytes) -> bytes:
+    data = zlib.decompress(block[:-8], wbits=-zlib.MAX_WBITS)
+    crc, size = struct.unpack("<II", block[-8:])
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ValueError("BGZF block failed its integrity check")
+    return data
+
+
+class _BgzfReader(io.RawIOBase):
+    """Streams a BGZF file, inflating its blocks in parallel.
+
+    The blocks are independent deflate streams of at most 64 KiB, so batches of them are read
+    ahead and inflated on a pool of threads (zlib releases the GIL while it works), and the
+    output is handed back in file order.
+    """
+
+    def __init__(self, handle: BinaryIO, name: str, threads: int):
+        self._name = name
+        self._handle = handle
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._batches: deque[list[Future]] = deque()
+        self._buffer = memoryview(b"")
+        self._exhausted = False
+        self._queue_batches()
+
+    def readable(self) -> bool:
+        return True
+
+    def _read_block(self) -> Optional[bytes]:
+        header = self._handle.read(12)
+        if not header:
+            return None
+
+        extra_length = struct.unpack("<H", header[10:12])[0]
+        extra = self._handle.read(extra_length)
+        block_size = None
+        offset = 0
+        while offset + 4 <= len(extra):
+            subfield_length = struct.unpack("<H", extra[offset + 2 : offset + 4])[0]
+            if extra[offset : offset + 2] == b"BC":
+                block_size = struct.unpack("<H", extra[offset + 4 : offset + 6])[0] + 1
+            offset += 4 + subfield_length
+        if header[:2] != _GZIP_MAGIC or block_size is None:
+            raise ValueError(f"{self._name} is not a valid BGZF file")
+
+        # What's left of the block is the deflate stream, its CRC32 and its size.
+        return self._handle.read(block_size - 12 - extra_length)
+
+    def _queue_batches(self) -> None:
+        # Keep a second batch in flight so reading the file overlaps inflating it.
+        while len(self._batches) < 2 and not self._exhausted:
+            batch = []
+            while len(batch) < BGZF_BATCH_BLOCKS:
+                block = self._read_block()
+                if block is None:
+                    self._exhausted = True
+                    break
+                batch.append(self._pool.submit(_inflate_bgzf_block, block))
+            if batch:
+                self._batches.append(batch)
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            if not self._batches:
+                return 0
+            batch = self._batches.popleft()
+            self._buffer = memoryview(b"".join(_.result() for _ in batch))
+            self._queue_batches()
+
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            self._pool.shutdown(cancel_futures=True)
+            self._handle.close()
+        super().close()
+
+
+def open_input(
+    file: Path, threads: int = BGZF_THREADS, data: Optional[bytes] = None
+) -> BinaryIO:
+    """Opens an input file for reading in binary mode, decompressing it as it is read.
+
+    gzip and zstd files are decompressed as a stream by pyarrow, outside of the GIL, and BGZF
+    files have their blocks inflated in parallel. Anything else is read as it is.
+
+    Args:
+        file (Path): The file, which may be plain or gzip, BGZF or zstd compressed.
+        threads (int): The number of threads to inflate the blocks of a BGZF file with.
+        data (Optional[bytes]): The raw contents of the file, if they have already been read,
+            in which case the file isn't opened.
+
+    Returns:
+        BinaryIO: The decompressed contents of the file.
+    """
+    handle = file.open("rb") if data is None else io.BytesIO(data)
+    compression = _detect_compression(handle.read(16))
+    handle.seek(0)
+
+    if compression is None:
+        return handle
+    if compression == "bgzf":
+        return io.BufferedReader(
+            _BgzfReader(handle, str(file), threads), FASTA_CHUNK_SIZE
+        )
+
+    # Let pyarrow read the file itself, so the reads happen outside of the GIL too.
+    handle.close()
+    source = str(file) if data is None else pa.BufferReader(data)
+    return io.BufferedReader(pa.CompressedInputStream(source, compression))
+
+
+def input_is_empty(file: Path, data: Optional[bytes] = None) -> bool:
+    """Checks whether an input file (or its already read contents) is empty once decompressed."""
+    if data is None:
+        if file.stat().st_size == 0:
+            return True
+        if input_compression(file) is None:
+            return False
+    else:
+        if not data:
+            return True
+        if _detect_compression(data[:16]) is None:
+            return False
+
+    with open_input(file, data=data) as handle:
+        return not handle.read(1)
+
+
+def _scan_fasta_lines(buffer: bytes) -> tuple[pa.Array, np.ndarray, int]:
+    """Extracts record IDs and lengths from a buffer of complete FASTA lines.
+
+    Args:
+        buffer (bytes): One or more complete lines of a FASTA file, ending in a newline.
+
+    Returns:
+        tuple[pa.Array, np.ndarray, int]: The IDs of the records starting in the buffer, their
+            lengths within the buffer, and the number of residues before the first header (which
+            belong to the record started in the previous buffer).
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    line_ends = np.flatnonzero(data == _NEWLINE_BYTE)
+    line_starts = np.empty_like(line_ends)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+
+    is_header = data[line_starts] == _HEADER_BYTE
+    line_lengths = np.add.reduceat(
+        data > _WHITESPACE_MAX_BYTE, line_starts, dtype=np.int64
     )
+    line_lengths[is_header] = 0
 
+    # Lines before the first header get record index 0 and are returned separately.
+    record_index = np.cumsum(is_header)
+    header_starts = line_starts[is_header]
+    lengths = np.bincount(
+        record_index, weights=line_lengths, minlength=len(header_starts) + 1
+    ).astype(np.int64)
 
-def read_fasta_file(
-    file: Path,
-    sequencing_timepoint: str,
-    sequencing_file: Optional[SequencingFile] = None,
-    name: Optional[str] = None,
-    participant: Optional[str] = None,
-    visit: Optional[str] = None,
-    pool: Optional[str] = None,
-) -> list[Sequence]:
-    if not sequencing_file:
-        sequencing_file: SequencingFile = SequencingFile(
-            name=name,
-            pool=pool,
-            visit=visit,
-            participant=participant,
-            path=file,
-            pipeline_point=sequencing_timepoint,
+    # Like Biopython, the record ID is the title up to the first whitespace character.
+    whitespace = np.flatnonzero(data <= _WHITESPACE_MAX_BYTE)
+    name_starts = header_starts + 1
+    name_ends = whitespace[np.searchsorted(whitespace, name_starts)]
+    name_lengths = name_ends - name_starts
+    offsets = np.zeros(len(name_starts) + 1, dtype=np.int64)
+    np.cumsum(name_lengths, out=offsets[1:])
+    gather = np.repeat(name_starts - offsets[:-1], name_lengths) + np.arange(
+        offsets[-1]
+    )
+    names = pa.Array.from_buffers(
+        pa.large_string(),
+        len(name_starts),
+        [None, pa.py_buffer(offsets), pa.py_buffer(data[gather])],
+    )
+
+    return names, lengths[1:], int(lengths[0])
+
+
+def iter_fasta_stats(
+    handle: BinaryIO, chunk_size: int = FASTA_CHUNK_SIZE
+) -> Iterator[tuple[pa.Array, np.ndarray]]:
+    """Streams the ID and length of every record in a FASTA file, a chunk at a time.
+
+    The file is read in large chunks which are parsed with vectorised numpy operations, so no
+    per-record Python objects are created. Lengths count every non-whitespace character on
+    the sequence lines of a record. Only one chunk of records is held in memory at a time.
+
+    Args:
+        handle (BinaryIO): A FASTA file opened in binary mode.
+        chunk_size (int): The number of bytes to read at a time.
+
+    Yields:
+        tuple[pa.Array, np.ndarray]: The IDs and lengths of the records in each chunk.
+    """
+    # A record can continue into later chunks, so the last chunk with records is held back
+    # until the next one starts.
+    pending: Optional[tuple[pa.Array, np.ndarray]] = None
+    carry = b""
+
+    while True:
+        block = handle.read(chunk_size)
+        if block:
+            buffer = carry + block
+            cut = buffer.rfind(b"\n") + 1
+            buffer, carry = buffer[:cut], buffer[cut:]
+        else:
+            buffer, carry = (carry + b"\n" if carry else b""), b""
+
+        if buffer:
+            names, lengths, leading = _scan_fasta_lines(buffer)
+            if leading and pending is not None:
+                # Residues that continue a record started in an earlier buffer.
+                pending[1][-1] += leading
+            if len(names):
+                if pending is not None:
+                    yield pending
+                pending = (names, lengths)
+
+        if not block:
+            break
+
+    if pending is not None:
+        yield pending
+
+
+def scan_fasta_stats(
+    handle: BinaryIO, chunk_size: int = FASTA_CHUNK_SIZE
+) -> tuple[pa.ChunkedArray, np.ndarray]:
+    """Streams a FASTA file and returns the ID and length of every record.
+
+    Args:
+        handle (BinaryIO): A FASTA file opened in binary mode.
+        chunk_size (int): The number of bytes to read at a time.
+
+    Returns:
+        tuple[pa.ChunkedArray, np.ndarray]: The record IDs and the record lengths.
+    """
+    chunks = list(iter_fasta_stats(handle, chunk_size))
+
+    names = pa.chunked_array([names for names, _ in chunks], type=pa.large_string())
+    if chunks:
+        lengths = np.concatenate([lengths for _, lengths in chunks])
+    else:
+        lengths = np.empty(0, dtype=np.int64)
+
+    return names, lengths
+
+
+def read_fasta_reads(file: Path, data: Optional[bytes] = None) -> pl.DataFrame:
+    """Reads the name and length of every sequence in a FASTA file, without any file metadata.
+
+    Args:
+        file (Path): The FASTA file to read.
+        data (Optional[bytes]): The raw contents of the file, if they have already been read.
+
+    Returns:
+        pl.DataFrame: One row per sequence, matching `FASTA_READS_SCHEMA`. An empty file
+            produces a single row with a null name and length.
+    """
+    if input_is_empty(file, data):
+        return pl.DataFrame(
+            {"name": [None], "length": [None]}, schema=FASTA_READS_SCHEMA
         )
 
-    if os.stat(file).st_size == 0:
-        return [
-            Sequence(
-                name=None,
-                length=None,
-                pool=sequencing_file.pool,
-                visit=sequencing_file.visit,
-                participant=sequencing_file.participant,
-                path=sequencing_file.path,
-                pipeline_point=sequencing_file.pipeline_point,
-                filename=sequencing_file.name,
-            )
+    with open_input(file, data=data) as handle:
+        names, lengths = scan_fasta_stats(handle)
+    return pl.DataFrame(
+        [
+            pl.Series("name", names, dtype=pl.String),
+            pl.Series("length", lengths.astype(np.uint32), dtype=pl.UInt32),
         ]
-    reader = SeqIO.parse(file.open("r", encoding="utf-8"), "fasta")
-
-    seqs = []
-    for sequence in reader:
-        seq_stats = Sequence(
-            name=sequence.id,
-            length=len(sequence.seq),
-            pool=sequencing_file.pool,
-            visit=sequencing_file.visit,
-            participant=sequencing_file.participant,
-            path=sequencing_file.path,
-            pipeline_point=sequencing_file.pipeline_point,
-            filename=sequencing_file.name,
-        )
-        seqs.append(seq_stats)
+    )
+
+
+def count_fasta_records(file: Path) -> int:
+    """Counts the records in a FASTA file without parsing them.
+
+    Args:
+        file (Path): The FASTA file.
+
+    Returns:
+        int: The number of header lines in the file.
+    """
+    count = 0
+    previous = b"\n"
+    with open_input(file) as handle:
+        while block := handle.read(FASTA_CHUNK_SIZE):
+            count += block.count(b"\n>")
+            # A header at the very start of this block follows the last byte of the previous.
+            count += previous == b"\n" and block[:1] == b">"
+            previous = block[-1:]
+
+    return count
+
+
+def iter_fasta_records(handle: BinaryIO) -> Iterator[tuple[str, np.ndarray]]:
+    """Yields the ID and residues of each record in a FASTA file.
 
-    return seqs
+    Args:
+        handle (BinaryIO): A FASTA file opened in binary mode.
 
+    Yields:
+        tuple[str, np.ndarray]: The record ID and its residues as a uint8 array of character
+            codes, with whitespace removed.
+    """
+    name: Optional[str] = None
+    lines: list[bytes] = []
 
-def msa_to_numpy(msa_file: Path):
-    """Reads a multiple sequence alignment into a numpy array"""
-    msa_array = []
-    seq_names = []
+    def residues() -> np.ndarray:
+        data = np.frombuffer(b"".join(lines), dtype=np.uint8)
+        return data[data > _WHITESPACE_MAX_BYTE]
 
-    reader = SeqIO.parse(msa_file, "fasta")
+    for line in handle:
+        if line[:1] == b">":
+            if name is not None:
+                yield name, residues()
+            title = line[1:].split(None, 1)
+            name = title[0].decode() if title else ""
+            lines = []
+        elif name is not None:
+            lines.append(line)
+
+    if name is not None:
+        yield name, residues()
+
+
+def downsample_targets(
+    size: int, limit: int, method: Literal["sample", "block"]
+) -> np.ndarray:
+    """Maps each of `size` positions to the output position it is drawn into.
+
+    Args:
+        size (int): The number of input positions.
+        limit (int): The maximum number of output positions.
+        method (Literal["sample", "block"]): "sample" keeps evenly spaced positions and maps the
+            rest to -1, "block" maps runs of neighbouring positions to the same output.
+
+    Returns:
+        np.ndarray: The output position of each input position, or -1 if it is dropped.
+    """
+    out = min(limit, size)
+    if method == "block":
+        return (np.arange(size) * out) // size
+
+    targets = np.full(size, -1)
+    keep = np.unique(np.linspace(0, size - 1, out).round().astype(np.int64))
+    targets[keep] = np.arange(len(keep))
+    return targets
+
+
+def msa_to_numpy(
+    msa_file: Path,
+    max_rows: Optional[int] = None,
+    max_cols: Optional[int] = None,
+    method: Literal["sample", "block"] = "sample",
+) -> tuple[list[str], np.ndarray]:
+    """Reads a multiple sequence alignment into a numpy array of character codes.
+
+    The alignment can be downsampled while it is read, so that only the downsampled matrix is
+    ever held in memory. With the "sample" method evenly spaced rows and columns are kept; with
+    "block" the alignment is divided into blocks and the character codes in each are averaged.
+
+    Args:
+        msa_file (Path): The aligned FASTA file.
+        max_rows (Optional[int]): The maximum number of rows to return. All rows if None.
+        max_cols (Optional[int]): The maximum number of columns to return. All columns if None.
+        method (Literal["sample", "block"]): How to downsample the alignment.
+
+    Returns:
+        tuple[list[str], np.ndarray]: The names of the returned rows (the first sequence of each
+            block when using "block") and a uint8 matrix of the alignment.
+
+    Raises:
+        ValueError: If the sequences in the file are not all the same length.
+    """
+    row_targets = None
+    if max_rows:
+        row_targets = downsample_targets(
+            count_fasta_records(msa_file), max_rows, method
+        )
+
+    seq_names: list[str] = []
+    rows: list[np.ndarray] = []
+    block_sizes: list[int] = []
+    width: Optional[int] = None
+
+    with open_input(msa_file) as handle:
+        for record_number, (name, residues) in enumerate(iter_fasta_records(handle)):
+            if width is None:
+                width = len(residues)
+                if max_cols:
+                    col_targets = downsample_targets(width, max_cols, method)
+                    if method == "block":
+                        col_sizes = np.bincount(col_targets)
+                    else:
+                        col_keep = np.flatnonzero(col_targets >= 0)
+            elif len(residues) != width:
+                raise ValueError(
+                    f"Sequence {name} in {msa_file} has length {len(residues)}, expected {width}"
+                )
+
+            target = (
+                record_number if row_targets is None else row_targets[record_number]
+            )
+            if target < 0:
+                continue
 
-    for record in reader:
-        new_seq = []
+            if not max_cols:
+                row = residues
+            elif method == "block":
+                row = np.bincount(col_targets, weights=residues) / col_sizes
+            else:
+                row = residues[col_keep]
 
-        for char in record.seq:
-            new_seq.append(ord(char))
+            if target == len(rows):
+                seq_names.append(name)
+                rows.append(row.astype(np.float64) if method == "block" else row)
+                block_sizes.append(1)
+            else:
+                rows[target] = rows[target] + row
+                block_sizes[target] += 1
 
-        msa_array.append(new_seq)
-        seq_names.append(record.id)
+    if not rows:
+        return seq_names, np.empty((0, 0), dtype=np.uint8)
 
-    msa_np = np.asarray(msa_array)
+    msa_np = np.stack(rows)
+    if method == "block":
+        msa_np = (msa_np / np.asarray(block_sizes)[:, None]).round().astype(np.uint8)
 
     return seq_names, msa_np
@@ -0,0 +1,12 @@
+import pytest
+
+from pipeline_report import benchmark
+
+
+@pytest.fixture
+def cohort(tmp_path):
+    """A small synthetic cohort, with the pipeline's directory layout."""
+    spec = benchmark.CohortSpec(
+        samples=4, reads_per_sample=200, alignment_length=60, seed=1
+    )
+    return benchmark.generate_cohort(spec, tmp_path / "cohort")
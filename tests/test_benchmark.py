@@ -0,0 +1,18 @@
+import json
+from importlib import metadata
+
+from pipeline_report import benchmark
+
+
+def test_write_results_without_an_installed_package(monkeypatch, tmp_path):
+    def version(name):
+        raise metadata.PackageNotFoundError(name)
+
+    monkeypatch.setattr(metadata, "version", version)
+    output = tmp_path / "results.json"
+
+    benchmark.write_results([], output)
+
+    payload = json.loads(output.read_text())
+    assert payload["pipeline_report"] == "unknown"
+    assert payload["results"] == []
@@ -0,0 +1,106 @@
+import os
+
+import polars as pl
+import pytest
+
+from pipeline_report.cache import IngestionCache
+
+
+@pytest.fixture
+def source(tmp_path):
+    source = tmp_path / "S1.fasta"
+    source.write_text(">a\nACGT\n")
+    return source
+
+
+class CountingLoader:
+    def __init__(self, df: pl.DataFrame):
+        self.df = df
+        self.calls = 0
+
+    def __call__(self) -> pl.DataFrame:
+        self.calls += 1
+        return self.df
+
+
+def test_second_load_is_a_hit(tmp_path, source):
+    cache = IngestionCache(tmp_path / "cache")
+    loader = CountingLoader(pl.DataFrame({"name": ["a"]}))
+
+    first = cache.load(source, "pre", loader)
+    second = cache.load(source, "pre", loader)
+
+    assert loader.calls == 1
+    assert cache.contains(source, "pre")
+    assert second.equals(first)
+
+
+def test_kinds_are_cached_apart(tmp_path, source):
+    cache = IngestionCache(tmp_path / "cache")
+    cache.load(source, "pre", CountingLoader(pl.DataFrame({"name": ["a"]})))
+
+    assert not cache.contains(source, "post")
+
+
+def test_modified_file_is_a_miss(tmp_path, source):
+    cache = IngestionCache(tmp_path / "cache")
+    cache.load(source, "pre", CountingLoader(pl.DataFrame({"name": ["a"]})))
+
+    source.write_text(">a\nACGT\n>b\nAC\n")
+    loader = CountingLoader(pl.DataFrame({"name": ["a", "b"]}))
+    df = cache.load(source, "pre", loader)
+
+    assert loader.calls == 1
+    assert df["name"].to_list() == ["a", "b"]
+
+
+def test_content_hash_catches_changes_that_keep_size_and_mtime(tmp_path, source):
+    cache = IngestionCache(tmp_path / "cache", hash_contents=True)
+    cache.load(source, "pre", CountingLoader(pl.DataFrame({"name": ["a"]})))
+
+    stat = source.stat()
+    source.write_text(">b\nACGT\n")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert not cache.contains(source, "pre")
+
+
+def test_unreadable_entry_is_replaced(tmp_path, source):
+    cache = IngestionCache(tmp_path / "cache")
+    entry = cache.ensure(source, "pre", CountingLoader(pl.DataFrame({"name": ["a"]})))
+    entry.write_bytes(b"not parquet")
+
+    loader = CountingLoader(pl.DataFrame({"name": ["a"]}))
+    df = cache.load(source, "pre", loader)
+
+    assert loader.calls == 1
+    assert df["name"].to_list() == ["a"]
+    assert pl.read_parquet(entry).equals(df)
+
+
+def test_evict_removes_least_recently_used_entries(tmp_path):
+    cache_dir = tmp_path / "cache"
+    entries = []
+    for index in range(3):
+        source = tmp_path / f"S{index}.fasta"
+        source.write_text(f">{index}\nACGT\n")
+        entry = IngestionCache(cache_dir).ensure(
+            source, "pre", CountingLoader(pl.DataFrame({"name": [str(index)] * 100}))
+        )
+        # Used in order S0, S1, S2, a second apart.
+        os.utime(entry, (index, index))
+        entries.append(entry)
+
+    entry_size = entries[0].stat().st_size
+    IngestionCache(cache_dir, max_size_bytes=2 * entry_size).evict()
+
+    assert [_.exists() for _ in entries] == [False, True, True]
+
+
+def test_evict_without_limit_keeps_everything(tmp_path, source):
+    cache = IngestionCache(tmp_path / "cache")
+    entry = cache.ensure(source, "pre", CountingLoader(pl.DataFrame({"name": ["a"]})))
+
+    cache.evict()
+
+    assert entry.exists()
@@ -0,0 +1,71 @@
+import json
+
+import typer
+from typer.testing import CliRunner
+
+from pipeline_report import benchmark, cli
+
+# The options of render that are given per run in the manifest of render-batch.
+PER_RUN_OPTIONS = {
+    "pipeline_version",
+    "pipeline_commit_hash",
+    "run_date",
+    "nextflow_params_fp",
+    "ref_name",
+}
+
+
+def _options(command: str) -> dict[str, tuple]:
+    params = typer.main.get_command(cli.app).commands[command].params
+    return {
+        _.name: (tuple(_.opts), tuple(_.secondary_opts), _.default)
+        for _ in params
+        if _.param_type_name == "option"
+    }
+
+
+def test_render_batch_has_the_options_of_render():
+    render = _options("render")
+    batch = _options("render-batch")
+
+    shared = render.keys() - PER_RUN_OPTIONS
+    assert shared <= batch.keys()
+    # The cache defaults to a different directory, but everything else matches.
+    assert {name: render[name] for name in shared if name != "cache_dir"} == {
+        name: batch[name] for name in shared if name != "cache_dir"
+    }
+
+
+def test_render_batch_forwards_the_options(cohort, tmp_path):
+    manifest = tmp_path / "runs.csv"
+    manifest.write_text(
+        "run_name,pre_dir,post_dir,functional_filter_dir,ref_name\n"
+        f"run,{cohort.pre_dir},{cohort.post_dir},{cohort.functional_filter_dir},"
+        f"{benchmark.REF_NAME}\n"
+    )
+    output_dir = tmp_path / "reports"
+
+    result = CliRunner().invoke(
+        cli.app,
+        [
+            "render-batch",
+            str(manifest),
+            str(output_dir),
+            "--no-compile",
+            "--incremental",
+            "--profile",
+            "--lineage",
+            "--data-format",
+            "csv",
+            "--plot-format",
+            "svg",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    data_dir = output_dir / "run" / "data"
+    assert (data_dir / "incremental" / "manifest.json").exists()
+    assert (data_dir / "run_lineage.csv").exists()
+    assert list(data_dir.glob("*.svg"))
+    stages = [_["stage"] for _ in json.loads((data_dir / "profile.json").read_text())]
+    assert "create_report_json" in stages
@@ -0,0 +1,58 @@
+import io
+
+import pytest
+
+from pipeline_report import utils
+
+FASTA_FILES = {
+    "simple": b">seq1 first\nACGT\nAC\n>seq2\nGGGG\n",
+    "crlf": b">seq1 first\r\nACGT\r\nAC\r\n>seq2\r\nGGGG\r\n",
+    "blank_lines": b"\n>seq1\nACGT\n\nAC\n\n>seq2\n\nGG\n\n",
+    "empty_record": b">seq1\n>seq2 no sequence\n>seq3\nACG\n",
+    "empty_last_record": b">seq1\nACG\n>seq2\n",
+    "no_trailing_newline": b">seq1\nACGT\n>seq2\nAC",
+    "no_trailing_newline_header": b">seq1\nACGT\n>seq2",
+    "tabs_and_spaces": b">seq1\tdescription here\nAC GT\n AC\t\n",
+    "long_header": b">" + b"x" * 50 + b" " + b"y" * 50 + b"\nACGT\n>s\nA\n",
+    "leading_sequence": b"ACGT\n>seq1\nAC\n",
+    "single_record": b">only\n" + b"ACGTACGTAC\n" * 20,
+}
+
+
+def naive_fasta_stats(content: bytes) -> tuple[list[str], list[int]]:
+    """Parses a FASTA file a line at a time, as a reference for the vectorised scanner."""
+    names = []
+    lengths = []
+    for line in content.splitlines():
+        if line.startswith(b">"):
+            fields = line[1:].split()
+            names.append(fields[0].decode() if fields else "")
+            lengths.append(0)
+        elif names:
+            lengths[-1] += len(b"".join(line.split()))
+    return names, lengths
+
+
+@pytest.mark.parametrize("content", FASTA_FILES.values(), ids=FASTA_FILES.keys())
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 16, 1024])
+def test_scan_fasta_stats_matches_naive_parser(content: bytes, chunk_size: int):
+    # Small chunks split headers and sequence lines across chunk boundaries.
+    names, lengths = utils.scan_fasta_stats(io.BytesIO(content), chunk_size)
+
+    assert (names.to_pylist(), lengths.tolist()) == naive_fasta_stats(content)
+
+
+@pytest.mark.parametrize("content", FASTA_FILES.values(), ids=FASTA_FILES.keys())
+def test_iter_fasta_stats_chunks_cover_every_record(content: bytes):
+    chunks = list(utils.iter_fasta_stats(io.BytesIO(content), chunk_size=4))
+
+    names = [_ for chunk, _lengths in chunks for _ in chunk.to_pylist()]
+    lengths = [int(_) for _names, chunk in chunks for _ in chunk]
+    assert (names, lengths) == naive_fasta_stats(content)
+
+
+def test_scan_fasta_stats_empty_file():
+    names, lengths = utils.scan_fasta_stats(io.BytesIO(b""))
+
+    assert len(names) == 0
+    assert len(lengths) == 0
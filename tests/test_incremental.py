@@ -0,0 +1,117 @@
+import shutil
+
+import polars as pl
+import pytest
+
+from pipeline_report import benchmark, parse_data
+from pipeline_report.incremental import SampleStore
+
+
+def _update(store: SampleStore, cohort, summarised: list[str]) -> list[str]:
+    """Updates the store, checks it against a full aggregation and returns what it read."""
+    summarised.clear()
+    pre_post_counts, functional_filter_counts = store.update(
+        cohort.pre_dir,
+        cohort.post_dir,
+        cohort.functional_filter_dir,
+        ref_name=benchmark.REF_NAME,
+    )
+    read = sorted(summarised)
+
+    expected_pre_post = parse_data.load_pre_post_counts(
+        cohort.pre_dir, cohort.post_dir, ref_name=benchmark.REF_NAME
+    )
+    expected_functional_filter = parse_data.load_functional_filter_counts(
+        cohort.functional_filter_dir
+    )
+    assert pre_post_counts.equals(expected_pre_post.sort("source"))
+    assert functional_filter_counts.equals(expected_functional_filter.sort("source"))
+    return read
+
+
+@pytest.fixture
+def summarised(monkeypatch):
+    """Records the files the store aggregates."""
+    summarised = []
+    summarise_sample_files = parse_data.summarise_sample_files
+    summarise_report = parse_data.summarise_functional_filter_report
+
+    def sample_files(task):
+        summarised.extend(_.path.name for _ in task[:2] if _)
+        return summarise_sample_files(task)
+
+    def report(report):
+        summarised.append(report.name)
+        return summarise_report(report)
+
+    monkeypatch.setattr(parse_data, "summarise_sample_files", sample_files)
+    monkeypatch.setattr(parse_data, "summarise_functional_filter_report", report)
+    return summarised
+
+
+def test_update_only_reads_added_changed_and_removed_files(
+    cohort, tmp_path, summarised
+):
+    store = SampleStore(tmp_path / "store")
+    directories = [cohort.pre_dir, cohort.post_dir, cohort.functional_filter_dir]
+    held_back = tmp_path / "held_back"
+    added = benchmark.sample_id(3)
+    for directory in directories:
+        (held_back / directory.name).mkdir(parents=True)
+        for file in directory.glob(f"{added}.*"):
+            shutil.move(file, held_back / directory.name / file.name)
+
+    assert len(_update(store, cohort, summarised)) == 9
+    assert _update(store, cohort, summarised) == []
+
+    for directory in directories:
+        for file in (held_back / directory.name).iterdir():
+            shutil.move(file, directory / file.name)
+    assert _update(store, cohort, summarised) == [
+        f"{added}.fasta",
+        f"{added}.fasta",
+        f"{added}.report.csv",
+    ]
+
+    # The pre and post files are aggregated together, so a changed post file redoes both.
+    changed = benchmark.sample_id(1)
+    post_file = cohort.post_dir / f"{changed}.fasta"
+    post_file.write_text("".join(post_file.read_text().splitlines(True)[:-4]))
+    report = cohort.functional_filter_dir / f"{changed}.report.csv"
+    report.write_text("".join(report.read_text().splitlines(True)[:-10]))
+    assert _update(store, cohort, summarised) == [
+        f"{changed}.fasta",
+        f"{changed}.fasta",
+        f"{changed}.report.csv",
+    ]
+
+    removed = benchmark.sample_id(0)
+    for directory in directories:
+        for file in directory.glob(f"{removed}.*"):
+            file.unlink()
+    assert _update(store, cohort, summarised) == []
+    counts = pl.read_parquet(store.store_dir / "functional_filter_counts.parquet")
+    assert removed not in counts["sample_id"].to_list()
+
+
+def test_update_rebuilds_when_the_reference_changes(cohort, tmp_path, summarised):
+    store = SampleStore(tmp_path / "store")
+    _update(store, cohort, summarised)
+    summarised.clear()
+
+    store.update(
+        cohort.pre_dir, cohort.post_dir, cohort.functional_filter_dir, ref_name=None
+    )
+
+    assert len(summarised) == 12
+
+
+def test_update_rejects_report_names_off_the_schema(tmp_path):
+    for point in ["pre", "post", "ff"]:
+        (tmp_path / point).mkdir()
+    (tmp_path / "ff" / "junk.report.csv").touch()
+
+    with pytest.raises(ValueError, match="junk"):
+        SampleStore(tmp_path / "store").update(
+            tmp_path / "pre", tmp_path / "post", tmp_path / "ff", ref_name=None
+        )
@@ -0,0 +1,114 @@
+import gzip
+import struct
+import zlib
+
+import pyarrow as pa
+import pytest
+
+from pipeline_report import utils
+
+FASTA = b"".join(
+    b">read%d some description\n%s\n" % (_, b"ACGT" * (_ % 50)) for _ in range(3000)
+)
+
+
+def bgzf_compress(data: bytes, block_size: int = 1 << 14) -> bytes:
+    """Compresses data as BGZF, as bgzip does: independent gzip members with a BC field."""
+    blocks = []
+    # The empty block at the end is the EOF marker bgzip writes.
+    for start in [*range(0, len(data), block_size), len(data)]:
+        chunk = data[start : start + block_size]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(chunk) + compressor.flush()
+        header = (
+            b"\x1f\x8b\x08\x04"
+            + bytes(4)
+            + b"\x00\xff"
+            + struct.pack("<H2sHH", 6, b"BC", 2, 12 + 6 + len(deflated) + 8 - 1)
+        )
+        blocks.append(
+            header + deflated + struct.pack("<II", zlib.crc32(chunk), len(chunk))
+        )
+    return b"".join(blocks)
+
+
+def zstd_compress(data: bytes) -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.CompressedOutputStream(sink, "zstd") as stream:
+        stream.write(data)
+    return sink.getvalue().to_pybytes()
+
+
+def test_input_files_matches_compressed_files(tmp_path):
+    for name in ["a.fasta", "b.fasta.gz", "c.fasta.zst", "d.csv", "e.fasta.bak"]:
+        (tmp_path / name).touch()
+
+    files = utils.input_files(tmp_path, ".fasta")
+
+    assert [_.name for _ in files] == ["a.fasta", "b.fasta.gz", "c.fasta.zst"]
+
+
+def test_input_files_rejects_compressed_and_plain_copies(tmp_path):
+    for name in ["a.fasta", "a.fasta.gz", "b.fasta"]:
+        (tmp_path / name).touch()
+
+    with pytest.raises(ValueError, match="a.fasta, a.fasta.gz"):
+        utils.input_files(tmp_path, ".fasta")
+
+
+@pytest.mark.parametrize(
+    ("compress", "compression"),
+    [
+        (lambda data: data, None),
+        (gzip.compress, "gzip"),
+        (bgzf_compress, "bgzf"),
+        (zstd_compress, "zstd"),
+    ],
+    ids=["plain", "gzip", "bgzf", "zstd"],
+)
+@pytest.mark.parametrize("threads", [1, 4])
+def test_open_input_decompresses_every_format(tmp_path, compress, compression, threads):
+    file = tmp_path / "S1.fasta.gz"
+    file.write_bytes(compress(FASTA))
+
+    assert utils.input_compression(file) == compression
+    with utils.open_input(file, threads=threads) as handle:
+        assert handle.read() == FASTA
+    with utils.open_input(file, threads=threads, data=file.read_bytes()) as handle:
+        assert handle.read() == FASTA
+
+
+def test_bgzf_fasta_stats_match_plain(tmp_path):
+    plain = tmp_path / "S1.fasta"
+    plain.write_bytes(FASTA)
+    compressed = tmp_path / "S2.fasta.gz"
+    compressed.write_bytes(bgzf_compress(FASTA, block_size=1000))
+
+    with utils.open_input(plain) as handle:
+        plain_names, plain_lengths = utils.scan_fasta_stats(handle)
+    with utils.open_input(compressed) as handle:
+        names, lengths = utils.scan_fasta_stats(handle)
+
+    assert names.equals(plain_names)
+    assert lengths.tolist() == plain_lengths.tolist()
+
+
+def test_bgzf_with_only_the_eof_block_is_empty(tmp_path):
+    file = tmp_path / "S1.fasta.gz"
+    file.write_bytes(bgzf_compress(b""))
+
+    assert utils.input_compression(file) == "bgzf"
+    assert utils.input_is_empty(file)
+
+
+def test_corrupt_bgzf_block_is_rejected(tmp_path):
+    data = bytearray(bgzf_compress(FASTA))
+    # Flip a bit of the first block's CRC32, which sits just before its size.
+    first_block_size = struct.unpack("<H", data[16:18])[0] + 1
+    data[first_block_size - 8] ^= 1
+    file = tmp_path / "S1.fasta.gz"
+    file.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match="integrity"):
+        with utils.open_input(file) as handle:
+            handle.read()
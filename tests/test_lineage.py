@@ -0,0 +1,90 @@
+import polars as pl
+import pytest
+
+from pipeline_report import lineage
+
+REPORT_COLUMNS = [
+    "seq_name",
+    "num_stop_codons",
+    "nt_length_ungapped",
+    "nt_length_gapped",
+    "divisible_by_3",
+    "earliest_stop_codon",
+    "earliest_stop_pct",
+    "loss_from_median",
+    "longest_gap_length",
+    "longest_gap_location",
+    "passes_frameshift_filter",
+    "passes_minimum_length_filter",
+    "passes_no_stop_codon_filter",
+    "passes_early_stop_codon_filter",
+    "flag",
+    "passes_filter",
+]
+REPORT = (
+    ",".join(REPORT_COLUMNS)
+    + "\nr1,0,4,4,false,0,0.0,0.0,0.0,0.0,true,true,true,true,x,true\n"
+)
+
+
+def test_survival_breakdown_of_sample_without_pre_reads():
+    reads = pl.DataFrame(
+        {
+            "sample_id": ["both", "both", "post_only"],
+            "read_key": [0, 1, None],
+            "name": ["a", "b", "c"],
+            "length": [10, 12, 11],
+            "in_post": [True, False, True],
+            "filter_code": [15, None, 15],
+            "passes_filter": [True, None, True],
+            "fate": ["passed_filter", "removed", "unmatched"],
+        },
+        schema=lineage.LINEAGE_SCHEMA,
+    )
+
+    breakdown = {
+        row["sample_id"]: row
+        for row in lineage.survival_breakdown(reads).iter_rows(named=True)
+    }
+
+    assert breakdown["both"]["pct_survived"] == 50.0
+    assert breakdown["both"]["pct_passed"] == 50.0
+    assert breakdown["post_only"]["num_pre"] == 0
+    assert breakdown["post_only"]["pct_survived"] is None
+    assert breakdown["post_only"]["pct_passed"] is None
+
+
+def test_write_lineage_names_samples_like_the_other_tables(tmp_path):
+    for point in ["pre", "post", "ff"]:
+        (tmp_path / point).mkdir()
+    (tmp_path / "pre" / "CAP100_1000-A.trimmed.fasta").write_text(
+        ">r1\nACGT\n>r2\nAC\n"
+    )
+    (tmp_path / "post" / "CAP100_1000-A.trimmed.fasta").write_text(">r1\nACGT\n")
+    (tmp_path / "ff" / "CAP100_1000-A.report.csv").write_text(REPORT)
+
+    survival = lineage.write_lineage(
+        tmp_path / "pre",
+        tmp_path / "post",
+        tmp_path / "ff",
+        tmp_path / "lineage.parquet",
+    )
+    reads = pl.read_parquet(tmp_path / "lineage.parquet").sort("name")
+
+    assert reads["sample_id"].to_list() == ["CAP100_1000-A"] * 2
+    assert reads["fate"].to_list() == ["passed_filter", "removed"]
+    assert survival["sample_id"].to_list() == ["CAP100_1000-A"]
+
+
+def test_write_lineage_rejects_sample_ids_off_the_schema(tmp_path):
+    for point in ["pre", "post", "ff"]:
+        (tmp_path / point).mkdir()
+    (tmp_path / "pre" / "not-a-sample.fasta").write_text(">r1\nACGT\n")
+
+    with pytest.raises(ValueError, match="not-a-sample"):
+        lineage.write_lineage(
+            tmp_path / "pre",
+            tmp_path / "post",
+            tmp_path / "ff",
+            tmp_path / "lineage.parquet",
+        )
@@ -0,0 +1,71 @@
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+from pipeline_report import msa_matrix, utils
+
+ALIGNMENT = b">ref\nACGT-ACGT\n>s1\nACG--ACGA\n>s2 with a description\nTCGTAAC\nGT\n"
+
+
+@pytest.fixture
+def fasta_file(tmp_path):
+    fasta_file = tmp_path / "alignment.fasta"
+    fasta_file.write_bytes(ALIGNMENT)
+    return fasta_file
+
+
+def test_matrix_round_trips_the_alignment(fasta_file, tmp_path):
+    matrix_file = msa_matrix.write_msa_matrix(fasta_file, tmp_path / "alignment.msa")
+
+    names, matrix = msa_matrix.load_msa_matrix(matrix_file)
+    expected_names, expected = utils.msa_to_numpy(fasta_file)
+
+    assert names == expected_names == ["ref", "s1", "s2"]
+    np.testing.assert_array_equal(matrix, expected)
+
+
+@pytest.mark.parametrize("method", ["sample", "block"])
+def test_downsampled_matrix_matches_downsampled_fasta(fasta_file, tmp_path, method):
+    matrix_file = msa_matrix.write_msa_matrix(fasta_file, tmp_path / "alignment.msa")
+
+    names, matrix = msa_matrix.load_msa(matrix_file, 2, 4, method)
+    expected_names, expected = msa_matrix.load_msa(fasta_file, 2, 4, method)
+
+    assert names == expected_names
+    np.testing.assert_array_equal(matrix, expected)
+
+
+def test_ragged_alignment_leaves_no_partial_files(tmp_path):
+    fasta_file = tmp_path / "ragged.fasta"
+    fasta_file.write_bytes(b">a\nACGT\n>b\nACG\n")
+
+    with pytest.raises(ValueError, match="expected 4"):
+        msa_matrix.write_msa_matrix(fasta_file, tmp_path / "ragged.msa")
+
+    assert sorted(_.name for _ in tmp_path.iterdir()) == ["ragged.fasta"]
+
+
+def test_convert_msa_dir_redoes_files_that_changed_size(tmp_path):
+    source_dir = tmp_path / "post"
+    source_dir.mkdir()
+    fasta_file = source_dir / "S1.fasta.gz"
+    fasta_file.write_bytes(gzip.compress(b">a\nACGT\n"))
+    (source_dir / "S2.fasta").write_bytes(b">a\nAC\n")
+
+    matrices = msa_matrix.convert_msa_dir(source_dir, tmp_path / "msa")
+    assert [_.name for _ in matrices] == ["S1.msa", "S2.msa"]
+
+    # Rewritten with the same modification time, so only the size gives the change away.
+    stat = fasta_file.stat()
+    fasta_file.write_bytes(gzip.compress(b">a\nACGT\n>b\nTTTT\n"))
+    os.utime(fasta_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    (source_dir / "S2.fasta").unlink()
+
+    matrices = msa_matrix.convert_msa_dir(source_dir, tmp_path / "msa")
+    names, _ = msa_matrix.load_msa_matrix(matrices[0])
+
+    assert [_.name for _ in matrices] == ["S1.msa"]
+    assert names == ["a", "b"]
+    assert not (tmp_path / "msa" / "S2.names").exists()
@@ -0,0 +1,141 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from pipeline_report import benchmark, parse_data
+
+
+def test_attrition_loss_is_signed():
+    counts = pl.LazyFrame(
+        {
+            "filename": ["gained", "gained", "kept", "kept", "lost", "lost"],
+            "pipeline_point": ["pre", "post", "pre", "post", "pre", "post"],
+            "num_seqs": [10, 11, 5, 5, 8, 6],
+        }
+    )
+
+    attrition = parse_data.attrition_from_counts(counts)
+    by_file = {row["filename"]: row for row in attrition.iter_rows(named=True)}
+
+    assert by_file["gained"]["num_lost"] == -1
+    assert by_file["gained"]["pct_lost"] == -10.0
+    assert by_file["kept"]["num_lost"] == 0
+    assert by_file["kept"]["pct_lost"] == 0.0
+    assert by_file["lost"]["num_lost"] == 2
+    assert by_file["lost"]["pct_lost"] == 25.0
+
+
+def test_attrition_summary_counts_gains_as_negative_loss():
+    attrition = parse_data.attrition_from_counts(
+        pl.LazyFrame(
+            {
+                "filename": ["a", "a"],
+                "pipeline_point": ["pre", "post"],
+                "num_seqs": [4, 5],
+            }
+        )
+    )
+
+    summary = parse_data.summarise_attrition(attrition)
+
+    assert summary.seq_count_lost == -1
+    assert summary.pct_seqs_lost == -25.0
+
+
+def test_functional_filter_counts_reject_report_names_off_the_schema(tmp_path):
+    (tmp_path / "junk.report.csv").touch()
+
+    with pytest.raises(ValueError, match="junk"):
+        parse_data.load_functional_filter_counts(tmp_path)
+
+
+def _generate_report_data(cohort, output_dir, **kwargs) -> parse_data.PipelineData:
+    output_dir.mkdir()
+    return parse_data.generate_report_data(
+        cohort.pre_dir,
+        cohort.post_dir,
+        cohort.functional_filter_dir,
+        output_dir / "pre_post.parquet",
+        output_dir / "functional_filter.parquet",
+        output_dir / "attrition.parquet",
+        ref_name=benchmark.REF_NAME,
+        **kwargs,
+    )
+
+
+def test_aggregate_only_matches_per_read_counts(cohort, tmp_path):
+    per_read = _generate_report_data(cohort, tmp_path / "per_read")
+    aggregate = _generate_report_data(
+        cohort, tmp_path / "aggregate", aggregate_only=True
+    )
+
+    assert aggregate.functional_filter_df is None
+    assert aggregate.summary == per_read.summary
+    assert aggregate.attrition_df.sort("filename").equals(
+        per_read.attrition_df.sort("filename")
+    )
+
+    reads = per_read.functional_filter_df.with_columns(
+        pl.col("sample_id").cast(pl.String)
+    )
+    counts = aggregate.functional_filter_counts_df
+    assert parse_data.filter_combination_counts(counts, by=["sample_id"]).equals(
+        parse_data.filter_combination_counts(reads, by=["sample_id"])
+    )
+    flag_counts = (
+        reads.group_by("sample_id")
+        .agg(num_seqs=pl.len(), **{_: pl.col(_).sum() for _ in parse_data.FILTER_FLAGS})
+        .cast({_: pl.UInt32 for _ in ["num_seqs", *parse_data.FILTER_FLAGS]})
+        .sort("sample_id")
+    )
+    assert counts.select(flag_counts.columns).sort("sample_id").equals(flag_counts)
+
+    boxplot = parse_data.length_boxplot_stats(reads)
+    assert counts.select(boxplot.columns).sort("sample_id").equals(boxplot)
+
+
+def test_length_boxplot_stats_match_numpy():
+    lengths = np.array([*range(100, 120), 20, 300, 300])
+    reads = pl.DataFrame(
+        {
+            "sample_id": ["a"] * len(lengths) + ["a", "none_passed"],
+            "nt_length_ungapped": [*lengths, 5000, 110],
+            "passes_filter": [True] * len(lengths) + [False, False],
+        }
+    )
+
+    stats = parse_data.length_boxplot_stats(reads).row(0, named=True)
+
+    q1, median, q3 = np.percentile(lengths, [25, 50, 75])
+    low = q1 - parse_data.BOXPLOT_WHISKER_IQR * (q3 - q1)
+    high = q3 + parse_data.BOXPLOT_WHISKER_IQR * (q3 - q1)
+    assert parse_data.length_boxplot_stats(reads)["sample_id"].to_list() == ["a"]
+    assert (stats["length_q1"], stats["length_median"], stats["length_q3"]) == (
+        q1,
+        median,
+        q3,
+    )
+    assert (stats["length_min"], stats["length_max"]) == (20, 300)
+    assert stats["whisker_low"] == lengths[lengths >= low].min()
+    assert stats["whisker_high"] == lengths[lengths <= high].max()
+    assert stats["num_outliers"] == 3
+    assert stats["outliers"] == [20, 300]
+
+
+def test_length_boxplot_stats_thin_out_outliers():
+    lengths = [*(500 + _ % 20 for _ in range(1000)), *range(2000, 2100)]
+    reads = pl.DataFrame(
+        {
+            "sample_id": ["a"] * len(lengths),
+            "nt_length_ungapped": lengths,
+            "passes_filter": [True] * len(lengths),
+        }
+    )
+
+    stats = parse_data.length_boxplot_stats(reads, max_outliers=5).row(0, named=True)
+    everything = parse_data.length_boxplot_stats(reads).row(0, named=True)
+
+    assert stats["num_outliers"] == everything["num_outliers"] == 100
+    assert len(stats["outliers"]) == 5
+    assert set(stats["outliers"]) <= set(everything["outliers"])
+    assert stats["outliers"][0] == everything["outliers"][0]
@@ -0,0 +1,33 @@
+import csv
+
+from pipeline_report import profiling
+
+
+def test_stages_record_how_far_they_raised_the_peak(monkeypatch, tmp_path):
+    # The process peak before and after each of three stages.
+    peaks = iter([100.0, 250.0, 250.0, 250.0, 250.0, 300.0])
+    monkeypatch.setattr(profiling, "_max_rss_mb", lambda: next(peaks))
+    monkeypatch.setattr(profiling, "_records", [])
+
+    for name in ["load", "plot", "compile"]:
+        with profiling.stage(name):
+            pass
+
+    records = {_.stage: _ for _ in profiling.records()}
+    assert [records[_].max_rss_mb for _ in records] == [250.0, 250.0, 300.0]
+    assert [records[_].peak_rss_delta_mb for _ in records] == [150.0, 0.0, 50.0]
+
+    _, csv_path = profiling.write(tmp_path)
+    with csv_path.open() as handle:
+        rows = list(csv.DictReader(handle))
+    assert [float(_["peak_rss_delta_mb"]) for _ in rows] == [150.0, 0.0, 50.0]
+
+
+def test_stages_are_not_recorded_while_disabled(monkeypatch):
+    monkeypatch.setattr(profiling, "_records", None)
+
+    with profiling.stage("load") as record:
+        record.rows = 3
+
+    assert record.rows == 3
+    assert profiling.records() == []
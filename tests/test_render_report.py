@@ -0,0 +1,106 @@
+import polars as pl
+import pytest
+
+from pipeline_report import create_plots, render_report
+from pipeline_report.cache import PlotCache
+
+
+@pytest.fixture
+def drawn(monkeypatch):
+    """Records the plots drawn by a stand-in plotting function, which fails on request."""
+    drawn = []
+
+    def fake_plot(data, output, plot_output):
+        if "fail" in output.name:
+            raise ValueError("can't draw this")
+        drawn.append(output.name)
+        for path in plot_output.paths(output):
+            path.write_text("plot")
+
+    monkeypatch.setattr(create_plots, "fake_plot", fake_plot, raising=False)
+    return drawn
+
+
+def _job(output, data, **kwargs) -> render_report.PlotJob:
+    return render_report.PlotJob(
+        name=output.stem,
+        func="fake_plot",
+        output=output,
+        data=data,
+        columns=["sample_id", "count"],
+        **kwargs,
+    )
+
+
+def test_unchanged_plot_is_skipped(tmp_path, drawn):
+    plot_cache = PlotCache(tmp_path / "plots.json")
+    data = pl.DataFrame({"sample_id": ["a", "b"], "count": [1, 2], "other": [0, 0]})
+    job = _job(tmp_path / "counts.png", data)
+
+    render_report.draw_plots([job], plot_cache)
+    render_report.draw_plots([job], plot_cache)
+    # Columns the plot doesn't read don't affect it.
+    job.data = data.with_columns(other=pl.lit(1))
+    render_report.draw_plots([job], plot_cache)
+
+    assert drawn == ["counts.png"]
+
+
+def test_plot_is_redrawn_when_its_data_changes(tmp_path, drawn):
+    plot_cache = PlotCache(tmp_path / "plots.json")
+    data = pl.DataFrame({"sample_id": ["a", "b"], "count": [1, 2]})
+    job = _job(tmp_path / "counts.png", data)
+
+    render_report.draw_plots([job], plot_cache)
+    job.data = data.with_columns(count=pl.Series([1, 3]))
+    render_report.draw_plots([job], plot_cache)
+    job.data = job.data.reverse()
+    render_report.draw_plots([job], plot_cache)
+
+    assert drawn == ["counts.png"] * 3
+
+
+def test_plot_is_redrawn_when_its_parameters_change(tmp_path, drawn):
+    plot_cache = PlotCache(tmp_path / "plots.json")
+    data = pl.DataFrame({"sample_id": ["a"], "count": [1]})
+
+    render_report.draw_plots([_job(tmp_path / "counts.png", data)], plot_cache)
+    render_report.draw_plots(
+        [
+            _job(
+                tmp_path / "counts.png",
+                data,
+                plot_output=create_plots.PlotOutput(dpi=72),
+            )
+        ],
+        plot_cache,
+    )
+
+    assert drawn == ["counts.png"] * 2
+
+
+def test_plot_is_redrawn_when_an_output_is_missing(tmp_path, drawn):
+    plot_cache = PlotCache(tmp_path / "plots.json")
+    job = _job(
+        tmp_path / "counts.png",
+        pl.DataFrame({"sample_id": ["a"], "count": [1]}),
+        plot_output=create_plots.PlotOutput(formats=["svg"]),
+    )
+
+    render_report.draw_plots([job], plot_cache)
+    job.outputs[-1].unlink()
+    render_report.draw_plots([job], plot_cache)
+
+    assert drawn == ["counts.png"] * 2
+
+
+def test_failed_plot_is_retried_and_does_not_stop_the_others(tmp_path, drawn):
+    plot_cache = PlotCache(tmp_path / "plots.json")
+    data = pl.DataFrame({"sample_id": ["a"], "count": [1]})
+    jobs = [_job(tmp_path / "fail.png", data), _job(tmp_path / "counts.png", data)]
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="fail"):
+            render_report.draw_plots(jobs, plot_cache)
+
+    assert drawn == ["counts.png"]